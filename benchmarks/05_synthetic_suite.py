@@ -0,0 +1,242 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os, sys
+import json
+import time
+import platform
+import resource
+import subprocess
+import itertools as it
+import numpy as np
+import pesfit as pf
+import lmfit
+import argparse
+import multiprocessing as mp
+
+n_cpu = mp.cpu_count()
+
+# Self-contained benchmark suite of pesfit on synthetic multiband Voigt spectra. Every case (model size x backend x
+# number of workers) runs in a fresh process to measure its peak memory, the outcomes are written to a JSON file, which
+# can be compared against the file of a previous run to detect performance regressions.
+#
+# Examples:
+#   python 05_synthetic_suite.py -nb 2 4 -ne 200 -ps 16 -bk sequential pool threads -nw 1 2 4 -o bench.json
+#   python 05_synthetic_suite.py -nb 2 4 -ne 200 -ps 16 -bk sequential pool threads -nw 1 2 4 -o new.json -cmp bench.json
+
+# Definitions of command line interaction
+parser = argparse.ArgumentParser(description='Input arguments')
+parser.add_argument('-nb', '--nband', metavar='nband', nargs='*', type=int, help='Numbers of bands in the synthetic spectra and the fitting model')
+parser.add_argument('-ne', '--nenergy', metavar='nenergy', nargs='*', type=int, help='Numbers of energy values of the synthetic spectra')
+parser.add_argument('-ps', '--patchsize', metavar='patchsize', nargs='*', type=int, help='Side lengths of the square (kx, ky) patches of synthetic spectra')
+parser.add_argument('-bk', '--backend', metavar='backend', nargs='*', type=str, help='Execution methods to benchmark, "sequential", "batch" or a backend of parallel_fit()')
+parser.add_argument('-nw', '--nworker', metavar='nworker', nargs='*', type=int, help='Numbers of workers for the parallel backends (scaling curve)')
+parser.add_argument('-cs', '--chunksize', metavar='chunksize', nargs='?', type=str, help='Chunk size of tasks assigned to each worker ("auto" or an integer)')
+parser.add_argument('-rep', '--repeat', metavar='repeat', nargs='?', type=int, help='Number of repetitions of every case (the median time is reported)')
+parser.add_argument('-nl', '--noise', metavar='noise', nargs='?', type=float, help='Standard deviation of the Gaussian noise relative to the peak amplitude')
+parser.add_argument('-sd', '--seed', metavar='seed', nargs='?', type=int, help='Seed of the random number generator for the synthetic data')
+parser.add_argument('-o', '--output', metavar='output', nargs='?', type=str, help='Path of the JSON file for the benchmark outcomes')
+parser.add_argument('-cmp', '--compare', metavar='compare', nargs='?', type=str, help='Path of a JSON file from a previous run to compare the throughput with')
+parser.add_argument('-tol', '--tolerance', metavar='tolerance', nargs='?', type=float, help='Relative loss of throughput tolerated in the comparison')
+parser.add_argument('--case', metavar='case', nargs='?', type=str, help=argparse.SUPPRESS) # Internal use, runs a single case
+parser.set_defaults(nband=[2, 4], nenergy=[200], patchsize=[12], backend=['sequential', 'batch', 'pool', 'multiprocessing', 'threads'],
+                    nworker=[1, 2, n_cpu], chunksize='auto', repeat=3, noise=0.01, seed=0, output='pesfit_benchmark.json',
+                    compare=None, tolerance=0.1, case=None)
+
+SEQUENTIAL_METHODS = ['sequential', 'batch']
+
+
+def synthesize_patch(nband, nenergy, patchsize, noise=0.01, seed=0):
+    """ Synthesize a square patch of multiband Voigt spectra with quadratic band dispersions using ``pesfit.lineshape.MultipeakModel``.
+    """
+
+    rng = np.random.default_rng(seed)
+    xvals = np.linspace(-(nband + 2), 0, nenergy)
+    kx, ky = np.meshgrid(np.linspace(-1, 1, patchsize), np.linspace(-1, 1, patchsize))
+
+    # Band centers spaced by 1 eV, alternating between electron- and hole-like dispersions
+    centers = np.stack([-(i + 1.5) + (-1)**i*0.2*(kx**2 + ky**2) for i in range(nband)])
+
+    model = pf.fitter.model_generator(peaks={'Voigt':nband})
+    pars = model.make_params()
+    for name in pars:
+        pars[name].set(vary=True)
+    stack = pf.fitter.StackedModel(model, pars)
+
+    nspec = patchsize**2
+    pvals = np.zeros((nspec, stack.nvar))
+    for i, name in enumerate(stack.var_names):
+        parname = name.split('_', 1)[1]
+        if parname == 'center':
+            pvals[:, i] = centers[int(name[2:].split('_')[0]) - 1].ravel()
+        elif parname == 'amplitude':
+            pvals[:, i] = rng.uniform(0.6, 1.0, nspec)
+        elif parname == 'sigma':
+            pvals[:, i] = 0.15
+        elif parname == 'gamma':
+            pvals[:, i] = 0.1
+    ydata = stack.eval(pvals, xvals)
+    ydata += noise*ydata.max()*rng.standard_normal(ydata.shape)
+
+    return xvals, ydata.reshape((patchsize, patchsize, nenergy)), centers
+
+
+def persistent_inits(nband):
+    """ Initialization and constraints of the lineshape parameters shared by all synthetic spectra.
+    """
+
+    lp_prefixes = ['lp'+str(i)+'_' for i in range(1, nband+1)]
+    amplitudes = pf.fitter.init_generator(lpnames=lp_prefixes, parname='amplitude', varkeys=['value', 'min', 'max', 'vary'],
+                                        parvals=[[0.8, 0, 2, True] for i in range(nband)])
+    sigmas = pf.fitter.init_generator(lpnames=lp_prefixes, parname='sigma', varkeys=['value', 'min', 'max', 'vary'],
+                                    parvals=[[0.15, 0.05, 0.5, True] for i in range(nband)])
+    gammas = pf.fitter.init_generator(lpnames=lp_prefixes, parname='gamma', varkeys=['value', 'min', 'max', 'vary'],
+                                    parvals=[[0.1, 0, 0.5, True] for i in range(nband)])
+
+    return amplitudes + sigmas + gammas
+
+
+def peak_memory():
+    """ Peak resident memory (in MB) of the current process and of its terminated child processes.
+    """
+
+    scale = 1/2**20 if sys.platform == 'darwin' else 1/2**10 # ru_maxrss is in bytes on macOS and in kB on Linux
+    rself = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*scale
+    rchild = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss*scale
+
+    return rself, rchild
+
+
+def run_case(case):
+    """ Run a single benchmark case, returns the timing, throughput, memory and accuracy measures.
+    """
+
+    xvals, ydata, centers = synthesize_patch(case['nband'], case['nenergy'], case['patchsize'], case['noise'], case['seed'])
+    nspec = case['patchsize']**2
+    inits = persistent_inits(case['nband'])
+    band_inits = centers + 0.05
+    chunksize = case['chunksize'] if case['chunksize'] == 'auto' else int(case['chunksize'])
+
+    times, nfevs = [], []
+    for r in range(case['repeat']):
+        if case['backend'] in SEQUENTIAL_METHODS:
+            fitter = pf.fitter.PatchFitter(peaks={'Voigt':case['nband']}, xdata=xvals, ydata=ydata)
+            fitter.set_inits(inits_dict=inits, band_inits=band_inits)
+            tstart = time.perf_counter()
+            if case['backend'] == 'sequential':
+                fitter.sequential_fit(compact=True, nspec=nspec)
+            else:
+                fitter.batch_fit(nspec=nspec)
+            times.append(time.perf_counter() - tstart)
+        else:
+            fitter = pf.fitter.DistributedFitter(xvals, ydata, nfitter=nspec, lazy=True, peaks={'Voigt':case['nband']})
+            fitter.set_inits(inits_dict=inits, band_inits=band_inits)
+            tstart = time.perf_counter()
+            fitter.parallel_fit(backend=case['backend'], num_workers=case['nworker'], chunksize=chunksize, compact=True)
+            times.append(time.perf_counter() - tstart)
+            fitter.close_pool()
+        stats = fitter.batch_result if case['backend'] == 'batch' else fitter.collector
+        nfevs.append(stats.to_dataframe(stats=True)['nfev'].values.mean())
+
+    # Accuracy of the band positions as a sanity check of the benchmarked fits
+    fitted = np.stack([fitter.df_fit['lp{}_center'.format(i+1)].values for i in range(case['nband'])])
+    rself, rchild = peak_memory()
+    tmed = float(np.median(times))
+
+    return dict(case, nspec=nspec, times=times, time=tmed, throughput=nspec/tmed, nfev_mean=float(np.mean(nfevs)),
+                center_error=float(np.abs(fitted - centers.reshape((case['nband'], -1))).max()),
+                peak_rss_mb=rself, peak_rss_children_mb=rchild)
+
+
+def case_key(res):
+    """ Identifier of a benchmark case for the comparison between runs.
+    """
+
+    return tuple(res[k] for k in ('nband', 'nenergy', 'patchsize', 'backend', 'nworker'))
+
+
+def scaling_curves(results):
+    """ Speedup of the parallel backends over the number of workers, relative to the smallest number of workers.
+    """
+
+    curves = {}
+    for res in results:
+        if res['backend'] in SEQUENTIAL_METHODS:
+            continue
+        name = '{backend}_nb{nband}_ne{nenergy}_ps{patchsize}'.format(**res)
+        curves.setdefault(name, []).append((res['nworker'], res['time']))
+
+    for name, points in curves.items():
+        points.sort()
+        tref = points[0][1]*points[0][0]
+        curves[name] = {'nworker': [p[0] for p in points], 'time': [p[1] for p in points],
+                        'speedup': [points[0][1]/p[1] for p in points], 'efficiency': [tref/(p[1]*p[0]) for p in points]}
+
+    return curves
+
+
+def compare(results, fpath, tolerance):
+    """ Compare the throughput with a previous run, returns the cases that lost more than the tolerated fraction.
+    """
+
+    with open(fpath, 'r') as f:
+        baseline = dict((case_key(res), res) for res in json.load(f)['results'] if 'error' not in res)
+
+    regressions = []
+    print('{:>6} {:>7} {:>5} {:>16} {:>3} {:>12} {:>12} {:>7}'.format('nband', 'nenergy', 'patch', 'backend', 'nw', 'base (sp/s)', 'new (sp/s)', 'ratio'))
+    for res in results:
+        base = baseline.get(case_key(res))
+        if base is None:
+            continue
+        ratio = res['throughput']/base['throughput']
+        flag = ' <-- regression' if ratio < 1 - tolerance else ''
+        print('{:>6} {:>7} {:>5} {:>16} {:>3} {:>12.2f} {:>12.2f} {:>7.3f}{}'.format(res['nband'], res['nenergy'], res['patchsize'],
+            res['backend'], res['nworker'], base['throughput'], res['throughput'], ratio, flag))
+        if flag:
+            regressions.append(res)
+
+    return regressions
+
+
+if __name__ == '__main__':
+
+    cli_args = parser.parse_args()
+
+    if cli_args.case is not None: # Single case in a fresh process, the outcome is the last line of the output
+        print(json.dumps(run_case(json.loads(cli_args.case))))
+        sys.exit(0)
+
+    cases = []
+    for nband, nenergy, patchsize, backend in it.product(cli_args.nband, cli_args.nenergy, cli_args.patchsize, cli_args.backend):
+        nworkers = [1] if backend in SEQUENTIAL_METHODS else cli_args.nworker
+        for nworker in sorted(set(nworkers)):
+            cases.append(dict(nband=nband, nenergy=nenergy, patchsize=patchsize, backend=backend, nworker=nworker,
+                            chunksize=cli_args.chunksize, repeat=cli_args.repeat, noise=cli_args.noise, seed=cli_args.seed))
+
+    results = []
+    for i, case in enumerate(cases):
+        print('[{}/{}] nband = {nband}, nenergy = {nenergy}, patch = {patchsize}x{patchsize}, backend = {backend}, worker = {nworker}'.format(
+                i+1, len(cases), **case), flush=True)
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--case', json.dumps(case)], capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(proc.stderr)
+            results.append(dict(case, error=proc.stderr.strip().splitlines()[-1]))
+            continue
+        res = json.loads(proc.stdout.strip().splitlines()[-1])
+        print('    {:.3f} s, {:.2f} spectra/s, peak memory {:.0f} MB (children {:.0f} MB)'.format(res['time'], res['throughput'],
+                res['peak_rss_mb'], res['peak_rss_children_mb']), flush=True)
+        results.append(res)
+
+    completed = [res for res in results if 'error' not in res]
+    meta = {'pesfit': pf.__version__, 'numpy': np.__version__, 'lmfit': lmfit.__version__, 'python': platform.python_version(),
+            'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': n_cpu,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'arguments': vars(cli_args)}
+    with open(cli_args.output, 'w') as f:
+        json.dump({'meta': meta, 'results': results, 'scaling': scaling_curves(completed)}, f, indent=2)
+    print('Benchmark outcomes written to {}'.format(cli_args.output))
+
+    if cli_args.compare is not None:
+        regressions = compare(completed, cli_args.compare, cli_args.tolerance)
+        if regressions:
+            print('{} case(s) lost more than {:.0%} of the throughput.'.format(len(regressions), cli_args.tolerance))
+            sys.exit(1)
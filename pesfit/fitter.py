@@ -6,11 +6,16 @@ from . import istarmap
 import numpy as np
 from scipy import interpolate as interp
 import pandas as pd
-from functools import reduce
+from functools import partial
+from collections import OrderedDict
 from lmfit import Minimizer, fit_report
-import inspect, sys
+import inspect, sys, operator, weakref, hashlib, threading, time, copy, warnings
+import asyncio
+from contextlib import nullcontext
+import os
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MultipleLocator
+import h5py
 import hdfio.dict_io as io
 from tqdm import tqdm
 
@@ -33,6 +38,12 @@ except:
 
 
 existing_models = dict(inspect.getmembers(ls.lmm, inspect.isclass))
+existing_models['FastVoigtModel'] = ls.FastVoigtModel
+
+# Prebuilt models of ``pesfit.fitter.model_generator()`` keyed by their specification, in the order of use
+_model_cache = OrderedDict()
+_model_cache_lock = threading.Lock()
+model_cache_size = 64
 
 ####################
 # Fitting routines #
@@ -72,22 +83,94 @@ def init_generator(params=None, parname='center', varkeys=['value'], **kwds):
         return inits
 
 
-def model_generator(peaks={'Voigt':2}, background='None', **kwds):
+def _freeze(obj):
+    """ Hashable form of (nested) model settings.
+    """
+
+    if isinstance(obj, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in obj.items()))
+    elif isinstance(obj, (list, tuple)):
+        return tuple(_freeze(v) for v in obj)
+
+    return obj
+
+
+def _clone_component(comp):
+    """ Shallow copy of a model component with its own parameter hints and options.
+    """
+
+    cloned = copy.copy(comp)
+    cloned.param_hints = copy.deepcopy(comp.param_hints)
+    cloned.opts = dict(comp.opts)
+
+    return cloned
+
+
+def clone_model(model):
+    """ Cheap copy of a multipeak model, which has its own lineshape components, stages, parameter hints and convolution kernel cache. Only the lineshape functions and the parameter template (see ``pesfit.lineshape.MultipeakModel.make_params()``), which is not modified in place, are shared with the original.
+    """
+
+    cloned = copy.copy(model)
+    cloned.components = [_clone_component(comp) for comp in model.components]
+    for name in ('fermi', 'instrument'):
+        if getattr(model, name, None) is not None:
+            setattr(cloned, name, _clone_component(getattr(model, name)))
+    cloned.param_hints = copy.deepcopy(model.param_hints)
+    # Groupings of the components are rebuilt for the copied components
+    for name in ('_batch_groups', '_jacobian_groups'):
+        if hasattr(model, name):
+            setattr(cloned, name, None)
+    if hasattr(model, '_kernel_cache'):
+        cloned._kernel_cache = OrderedDict(model._kernel_cache)
+
+    return cloned
+
+
+def clear_model_cache():
+    """ Remove all prebuilt models from the cache of ``pesfit.fitter.model_generator()``.
+    """
+
+    with _model_cache_lock:
+        _model_cache.clear()
+
+
+def model_generator(peaks={'Voigt':2}, background='None', cache=True, **kwds):
     """ Simple multiband lineshape model generator with semantic parsing.
 
     **Parameters**\n
     peaks: dict | {'Voigt':2}
-        Peak profile specified in a dictionary. All possible models see ``lmfit.models``.
+        Peak profile specified in a dictionary. All possible models see ``lmfit.models``, in addition to 'FastVoigt' (see ``pesfit.lineshape.FastVoigtModel``).
     background: str | 'None'
         Background model name. All possible models see ``lmfit.models``.
+    cache: bool | True
+        Option to return a clone (see ``pesfit.fitter.clone_model()``) of a prebuilt model with the same specification, kept in a cache of up to ``pesfit.fitter.model_cache_size`` models. The model and its parameter template are built once per specification.
     **kwds: keyword arguments
-        Additional keyword arguments for ``pesfit.lineshape.MultipeakModel`` class.
+        lineshape_kwds: dict | {}
+            Keyword arguments for the peak profile model (e.g. ``{'accuracy':1e-2}`` for 'FastVoigt').
+        additional arguments:
+            Additional keyword arguments for ``pesfit.lineshape.MultipeakModel`` class.
 
     **Return**\n
     model: instance of ``pesfit.lineshape.MultipeakModel``
         Lineshape model created from the specified components.
     """
 
+    key = None
+    if cache:
+        try:
+            key = (_freeze(peaks), background, _freeze(kwds))
+            hash(key)
+        except TypeError: # Settings without a hashable form are not cached
+            key = None
+    if key is not None:
+        with _model_cache_lock:
+            model = _model_cache.get(key, None)
+            if model is not None:
+                _model_cache.move_to_end(key)
+        if model is not None:
+            return clone_model(model)
+
+    pk_kwds = kwds.pop('lineshape_kwds', {})
     bg_modname = background + 'Model'
     if bg_modname in existing_models.keys():
         bg_clsname = existing_models[bg_modname]
@@ -97,12 +180,23 @@ def model_generator(peaks={'Voigt':2}, background='None', **kwds):
         pk_modname = pk + 'Model'
         if pk_modname in existing_models.keys():
             pk_clsname = existing_models[pk_modname]
+            if pk_kwds:
+                pk_clsname = partial(pk_clsname, **pk_kwds)
         
         try:
             model = ls.MultipeakModel(lineshape=pk_clsname, n=pkcount, background=bg_clsname(prefix='bg_'), **kwds)
         except:
             model = ls.MultipeakModel(lineshape=pk_clsname, n=pkcount, **kwds)
 
+    if key is not None:
+        if hasattr(model, '_params_template'):
+            model.make_params() # Build the parameter template shared by the clones
+        with _model_cache_lock:
+            _model_cache[key] = model
+            while len(_model_cache) > model_cache_size:
+                _model_cache.popitem(last=False)
+        return clone_model(model)
+
     return model
 
 rct = 0 # Counter for the number of rounds
@@ -157,7 +251,7 @@ def random_varshift(fitres, model, params, shifts=[], yvals=None, xvals=None, pa
             varsetter(params, pardict)
         
         # print(kwds)
-        newfit = model.fit(yvals, params, x=xvals, **kwds)
+        newfit = model.fit(yvals, params, x=xvals, method=method, **kwds)
         # Use compare the current fit outcome with the memoized best result
         if cbfit is not None:
             if getattr(newfit, fit_attr) > getattr(cbfit, fit_attr):
@@ -176,14 +270,138 @@ def random_varshift(fitres, model, params, shifts=[], yvals=None, xvals=None, pa
         return random_varshift(newfit, model, params, newshifts, yvals, xvals, parnames, verbose, fit_attr, thresh, cbfit, rounds, rct, method, **kwds)
 
 
+def multistart_varshift(fitres, model, params, shifts=[], yvals=None, xvals=None, parnames=[], fit_attr='chisqr', thresh=0.85, nstarts=None, batch_size=4, jitter_seed=None, engine='auto', workers=None, verbose=False, method='leastsq', **kwds):
+    """ Multi-start alternative to ``pesfit.fitter.random_varshift()``. Shifted initializations are fitted in batches and the best result is kept. The fitting stops early once the goodness-of-fit criterion is met, so a bad spectrum costs at most ``nstarts`` fits in ``nstarts/batch_size`` rounds.
+
+    **Parameters**\n
+    fitres: instance of ``lmfit.model.ModelResult``
+        Current fitting result.
+    model: instance of ``lmfit.model.Model`` or ``pesfit.lineshape.MultipeakModel``
+        Lineshape model.
+    params: instance of ``lmfit.parameter.Parameters``
+        Initial lineshape model parameters, to which the shifts are applied.
+    shifts: list/tuple/array | []
+        Different shifts to apply to the initial conditions.
+    xvals, yvals: numpy array, numpy array | None, None
+        Horizontal and vertical axis values for the lineshape fitting.
+    parnames: list | []
+        List of names of the parameters to shift (empty list selects the varying peak positions, i.e. the '...center' parameters).
+    fit_attr: str | 'chisqr'
+        Attribute of the fitting result measuring the goodness of fit.
+    thresh: numeric | 0.85
+        Threshold of the goodness-of-fit attribute to accept a fit.
+    nstarts: int | None
+        Maximum number of shifted initializations to try (None for all shifts).
+    batch_size: int | 4
+        Number of shifted initializations fitted per round.
+    jitter_seed: int | None
+        Seed of the random number generator selecting the order of the shifts.
+    engine: str | 'auto'
+        Fitting engine for each batch, 'batch' (one batched least-squares problem, see ``pesfit.fitter.batch_fitting()``, followed by a refinement of the best start with ``Model.fit()``), 'threads' (thread pool of ``Model.fit()`` calls) or 'auto' (uses 'batch' if the model and settings support it).
+    workers: int | None
+        Number of threads for the 'threads' engine (None uses ``batch_size``).
+    verbose: bool | False
+        Option for printout of the goodness-of-fit values.
+    method: str | 'leastsq'
+        Optimization method of ``Model.fit()`` (the 'auto' engine uses 'batch' only for 'leastsq').
+    **kwds: keyword arguments
+        Extra keywords passed to the ``Model.fit()`` method.
+    """
+
+    if engine not in ('auto', 'batch', 'threads'):
+        raise ValueError("The fitting engine should be one of ['auto', 'batch', 'threads'].")
+
+    if (getattr(fitres, fit_attr) < thresh) or (len(shifts) == 0):
+        return fitres
+
+    if not parnames:
+        stage_prefixes = tuple(stage.prefix for stage in getattr(model, 'stages', []))
+        parnames = [name for name, par in params.items() if name.endswith('center') and par.vary and not par.expr
+                    and not (stage_prefixes and name.startswith(stage_prefixes))]
+
+    if engine == 'auto':
+        engine = 'threads'
+        if (method == 'leastsq') and (kwds.get('weights', None) is None):
+            try:
+                StackedModel(model, params)
+                engine = 'batch'
+            except (NotImplementedError, AttributeError):
+                pass
+
+    rng = np.random.default_rng(jitter_seed)
+    shifts = np.asarray(shifts)[rng.permutation(len(shifts))][:nstarts]
+    best = fitres
+
+    # Only the 'threads' engine needs a pool of threads
+    pool = ccf.ThreadPoolExecutor(max_workers=workers or batch_size) if engine == 'threads' else nullcontext()
+    with pool as executor:
+        for i in range(0, len(shifts), batch_size):
+            sfts = shifts[i:i+batch_size]
+            if verbose:
+                print('{} = {}'.format(fit_attr, getattr(best, fit_attr)))
+
+            if engine == 'batch':
+                inits_stack = dict((pn, {'value':params[pn].value + sfts}) for pn in parnames)
+                bres = batch_fitting(xvals, np.tile(yvals, (len(sfts), 1)), model, params=params, inits_stack=inits_stack, ynorm=False)
+                ibest = np.nanargmin(getattr(bres, fit_attr))
+                pars = params.copy()
+                for name, val in zip(bres.names, bres.values[ibest]):
+                    if pars[name].vary and not pars[name].expr:
+                        pars[name].set(value=val)
+                newfits = [model.fit(yvals, pars, x=xvals, method=method, **kwds)]
+
+            else:
+                start_pars = []
+                for sft in sfts:
+                    pars = params.copy()
+                    for pn in parnames:
+                        pars[pn].set(value=params[pn].value + sft)
+                    start_pars.append(pars)
+                newfits = list(executor.map(lambda pars: model.fit(yvals, pars, x=xvals, method=method, **kwds), start_pars))
+
+            for newfit in newfits:
+                if getattr(newfit, fit_attr) < getattr(best, fit_attr):
+                    best = newfit
+            # Early termination
+            if getattr(best, fit_attr) < thresh:
+                break
+
+    return best
+
+
+def flatten_inits(inits):
+    """ Flatten the initialization parameters and constraints into a list of (parameter name, settings) pairs, ordered as supplied.
+
+    **Parameters**\n
+    inits: dict/list/tuple
+        Initialization value dictionary at the component level ({prefix: {parameter: {key: value}}}) or at the parameter level ({parameter name: {key: value}}), or a collection of such dictionaries.
+    """
+
+    if isinstance(inits, dict):
+        inits = [inits]
+
+    items = []
+    for init in inits:
+        dd = u.dict_depth(init, level=0)
+        if dd == 3:
+            # Unpack the dictionary at the component level
+            for kcomp, vcomp in init.items():
+                for kparam, vparam in vcomp.items():
+                    items.append((kcomp + kparam, vparam))
+        elif dd == 2:
+            items.extend(init.items())
+
+    return items
+
+
 def varsetter(params, inits={}, ret=False):
     """ Function to set the parameter constrains in multiparameter fitting.
     
     **Parameters**\n
     params: ``lmfit.parameter.Parameter`` or other subclass of dict.
         Parameter dictionary.
-    init: dict | {}
-        Initialization value dictionary.
+    init: dict/list/tuple | {}
+        Initialization value dictionary, or a collection of them applied in order (format see ``pesfit.fitter.flatten_inits()``).
     ret: bool | False
         Option for returning outcome.
     """
@@ -193,33 +411,200 @@ def varsetter(params, inits={}, ret=False):
         
     else:
         if inits:
-
-            # Merge entries if inits are provided as a list of dictionaries.
-            # Merging doesn't change the depth of the dictionary.
-            if len(inits) > 1:
-                inits = reduce(u.dictmerge, inits)
-            
-            dd = u.dict_depth(inits, level=0)
-            
-            if dd == 3:
-                # Unpack the dictionary at the component level
-                for kcomp, vcomp in inits.items():
-                    # Unpack the dictionary at the parameter level
-                    for kparam, vparam in vcomp.items():
-                        varcomp = kcomp + kparam
-                        if varcomp in params.keys():
-                            params[varcomp].set(**vparam)
-            
-            elif dd == 2:
-                # Unpack the dictionary at the parameter level
-                for kparam, vparam in inits.items():
-                    params[kparam].set(**vparam)
+            for name, settings in flatten_inits(inits):
+                if name in params.keys():
+                    params[name].set(**settings)
     
     if ret:
         return params
 
 
-def pointwise_fitting(xdata, ydata, model=None, peaks=None, background='None', params=None, inits=None, ynorm=True, method='leastsq', jitter_init=False, ret='result', modelkwds={}, **kwds):
+class InitPlan(object):
+    """ Precompiled initialization of the fitting parameters. The persistent initialization is resolved once into arrays of parameter values, bounds and vary flags, onto which the spectrum-dependent values are written as array operations before the parameters are set.
+
+    **Parameters**\n
+    params: instance of ``lmfit.parameter.Parameters``
+        Parameter template of the model.
+    inits_persist: dict/list | None
+        Initialization parameters and constraints persistent throughout the fitting process (format see ``pesfit.fitter.flatten_inits()``).
+    prefixes: list/tuple | []
+        Prefixes of the lineshapes with spectrum-dependent initialization. The lineshapes with the parameter ``parname`` (e.g. excluding the background) are ordered as the rows of the spectrum-dependent values.
+    parname: str | 'center'
+        Name of the parameter with spectrum-dependent initialization.
+    varkeys: list/tuple | ['value', 'vary']
+        Parameter keys set by the spectrum-dependent values, ordered as their columns ('value', 'min', 'max', 'vary').
+    """
+
+    def __init__(self, params, inits_persist=None, prefixes=[], parname='center', varkeys=['value', 'vary']):
+
+        fields = dict((name, {'value':par.value, 'min':par.min, 'max':par.max, 'vary':par.vary, 'expr':par.expr or ''})
+                    for name, par in params.items())
+        self.extras = OrderedDict()
+
+        for name, settings in flatten_inits(inits_persist or []):
+            if name not in fields:
+                continue
+            for key, val in settings.items():
+                if key in ('value', 'min', 'max', 'vary'):
+                    fields[name][key] = val
+                    # Setting a value or a free parameter removes its constraint (as in ``lmfit.Parameter.set()``)
+                    if (key == 'value') or ((key == 'vary') and val):
+                        fields[name]['expr'] = ''
+                elif key == 'expr':
+                    fields[name]['expr'] = val or ''
+                else:
+                    self.extras.setdefault(name, {})[key] = val
+
+        # Parameters constrained by expressions are only set through the expressions
+        self.exprs = OrderedDict((name, fd['expr']) for name, fd in fields.items() if fd['expr'])
+        self.names = [name for name, fd in fields.items() if not fd['expr']]
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        self.arrays = {'value':np.array([fields[name]['value'] for name in self.names], dtype='float'),
+                    'min':np.array([fields[name]['min'] for name in self.names], dtype='float'),
+                    'max':np.array([fields[name]['max'] for name in self.names], dtype='float'),
+                    'vary':np.array([fields[name]['vary'] for name in self.names], dtype='bool')}
+
+        for vk in varkeys:
+            if vk not in self.arrays:
+                raise ValueError('Unsupported parameter key {} for the spectrum-dependent initialization.'.format(vk))
+        self.varkeys = list(varkeys)
+        # Rows of the spectrum-dependent values (one for every lineshape with the parameter) and the corresponding parameters
+        carriers = [pref + parname for pref in prefixes if pref + parname in fields]
+        rows = [i for i, name in enumerate(carriers) if name in self.index]
+        self.rows = np.array(rows, dtype='int')
+        self.cols = np.array([self.index[carriers[i]] for i in rows], dtype='int')
+
+    def apply(self, params, others=None, seed=None):
+        """ Set the parameters with the persistent and (optionally) spectrum-dependent initialization.
+
+        **Parameters**\n
+        params: instance of ``lmfit.parameter.Parameters``
+            Parameters to set (with the same names as the template).
+        others: 2D array | None
+            Spectrum-dependent initialization values with the shape (number of prefixes, number of varkeys).
+        seed: dict | None
+            Starting values that replace the initial values of the free parameters (clipped to their bounds).
+        """
+
+        arrs = dict((key, arr.copy()) for key, arr in self.arrays.items())
+
+        if others is not None:
+            others = np.asarray(others)[self.rows]
+            for j, vk in enumerate(self.varkeys):
+                arrs[vk][self.cols] = others[:, j]
+
+        if seed is not None:
+            cols = np.array([self.index[name] for name in seed if name in self.index], dtype='int')
+            vals = np.array([val for name, val in seed.items() if name in self.index], dtype='float')
+            free = arrs['vary'][cols]
+            cols, vals = cols[free], vals[free]
+            arrs['value'][cols] = np.clip(vals, arrs['min'][cols], arrs['max'][cols])
+
+        for name, settings in self.extras.items():
+            params[name].set(**settings)
+        for name, val, vmin, vmax, vary in zip(self.names, arrs['value'].tolist(), arrs['min'].tolist(),
+                                                arrs['max'].tolist(), arrs['vary'].tolist()):
+            params[name].set(value=val, vary=vary, min=vmin, max=vmax)
+        for name, expr in self.exprs.items():
+            if params[name].expr != expr:
+                params[name].set(expr=expr)
+
+        return params
+
+
+def energy_window(xdata, params, prefixes, margin, parname='center'):
+    """ Energy window covering the (bounded) range of the band positions of the selected lineshapes, extended by a margin on both sides.
+
+    **Parameters**\n
+    xdata: 1D array
+        Energy coordinates.
+    params: instance of ``lmfit.parameter.Parameters``
+        Parameters of the model.
+    prefixes: list/tuple
+        Prefixes of the lineshapes to include.
+    margin: numeric
+        Energy margin added around every band position.
+    parname: str | 'center'
+        Name of the parameter describing the band positions.
+
+    **Return**\n
+    Boolean mask of the energy coordinates within the union of the windows of all lineshapes.
+    """
+
+    mask = np.zeros(np.shape(xdata), dtype='bool')
+    for pref in prefixes:
+        par = params.get(pref + parname, None)
+        if par is None:
+            continue
+        # A free band position can move within its bounds
+        lo = par.min if (par.vary and np.isfinite(par.min)) else par.value
+        hi = par.max if (par.vary and np.isfinite(par.max)) else par.value
+        mask |= (xdata >= lo - margin) & (xdata <= hi + margin)
+
+    return mask
+
+
+def _stage_window(mod, xdata, pars, mask):
+    """ Contiguous range of the energy coordinates covering a window, extended by the half width of the instrument response on both sides (see ``pesfit.lineshape.MultipeakModel.kernel_span()``). The stages of the model require uniformly spaced coordinates, and the convolution within the window is then unaffected by its edges.
+    """
+
+    if not mask.any():
+        return mask
+    span = 0
+    if getattr(mod, 'instrument', None) is not None:
+        span = mod.kernel_span(xdata, **mod._stage_args(mod.instrument, pars))
+    lo, hi = xdata[mask].min() - span, xdata[mask].max() + span
+
+    return (xdata >= lo) & (xdata <= hi)
+
+
+def _cropped_fitting(mod, ydata, pars, xdata, crop, crop_groups, parname, **kwds):
+    """ Fitting within the energy window of the band positions (see ``pesfit.fitter.energy_window()``), optionally preceded by fitting groups of bands within their own windows. For models with stages, each window is a contiguous range extended by the half width of the instrument response (see ``pesfit.fitter._stage_window()``).
+    """
+
+    staged = bool(getattr(mod, 'stages', []))
+    prefixes = [pref for pref in getattr(mod, 'prefixes', []) if (pref + parname) in pars]
+    mask = energy_window(xdata, pars, prefixes, crop, parname=parname)
+    if staged:
+        mask = _stage_window(mod, xdata, pars, mask)
+    nvary = sum(par.vary and not par.expr for par in pars.values())
+    if mask.sum() <= nvary: # Too few points left for the fitting
+        mask = np.ones(np.shape(xdata), dtype='bool')
+
+    nfev = 0
+    if crop_groups and (len(prefixes) > crop_groups):
+        # Groups of neighbouring bands in energy, the other bands are kept fixed while fitting each group
+        order = np.argsort([pars[pref + parname].value for pref in prefixes])
+        groups = [[prefixes[i] for i in order[j:j+crop_groups]] for j in range(0, len(prefixes), crop_groups)]
+        for group in groups:
+            others = [name for name, par in pars.items() if par.vary and not par.expr and
+                        any(name.startswith(pref) for pref in prefixes if pref not in group)]
+            gmask = energy_window(xdata, pars, group, crop, parname=parname)
+            if staged:
+                gmask = _stage_window(mod, xdata, pars, gmask)
+            if gmask.sum() <= nvary - len(others):
+                continue
+            for name in others:
+                pars[name].vary = False
+            try:
+                gres = mod.fit(ydata[gmask], pars, x=xdata[gmask], **kwds)
+            finally:
+                for name in others:
+                    pars[name].vary = True
+            nfev += gres.nfev
+            for name, par in gres.params.items():
+                if par.vary and not par.expr:
+                    pars[name].value = par.value
+
+    fit_result = mod.fit(ydata[mask], pars, x=xdata[mask], **kwds)
+
+    return fit_result, mask, nfev
+
+
+# Keyword arguments of ``pesfit.fitter.multistart_varshift()`` that are not passed on to ``Model.fit()``
+_multistart_keys = ('parnames', 'fit_attr', 'thresh', 'nstarts', 'batch_size', 'jitter_seed', 'engine', 'workers', 'verbose')
+
+def pointwise_fitting(xdata, ydata, model=None, peaks=None, background='None', params=None, inits=None, ynorm=True, method='leastsq', jitter_init=False, jacobian=False, ret='result', modelkwds={}, timing=None, crop=None, crop_groups=None, **kwds):
     """ Pointwise fitting of a multiband line profile.
 
     **Parameters**\n
@@ -237,17 +622,27 @@ def pointwise_fitting(xdata, ydata, model=None, peaks=None, background='None', p
         Option to normalize each trace by its maximum before fitting.
     method: str | 'leastsq'
         Optimization method of choice (complete list see https://lmfit.github.io/lmfit-py/fitting.html).
-    jitter_init: bool | False
-        Option to introduct random perturbations (jittering) to the peak position in fitting. The values of jittering is supplied in ``shifts``.
+    jitter_init: bool/str | False
+        Option to introduct random perturbations (jittering) to the peak position in fitting. The values of jittering is supplied in ``shifts``. ``True`` uses the recursive ``pesfit.fitter.random_varshift()``, ``'multistart'`` uses the batched ``pesfit.fitter.multistart_varshift()``.
+    jacobian: bool | False
+        Option to supply the analytic Jacobian of the model (see ``pesfit.lineshape.MultipeakModel.jacobian()``) to the minimizer, only used with the ``'leastsq'`` method and additive models (other models fall back to finite differences with a warning).
     ret: str | 'result'
         Specification of return values.\n
         ``'result'``: returns the fitting result\n
         ``'all'``: returns the fitting result and evaluated lineshape components.
+    timing: dict | None
+        Dictionary to which the time spent (in seconds) in model evaluations (``'model'``, estimated from the number of function evaluations), the remaining minimizer iterations (``'minimize'``) and the jittered refits (``'jitter'``) is added, together with the number of function evaluations (``'nfev'``).
+    crop: numeric | None
+        Energy margin of the adaptive energy window. The fitting is then restricted to the union of the windows around the initial band positions (or their bounds, see ``pesfit.fitter.energy_window()``), which shortens the residual evaluated in every iteration. For models with a Fermi-Dirac cutoff or an instrument response, the window is the contiguous range from the lowest to the highest position, extended by the half width of the instrument response. The fitting result refers to the cropped energy coordinates (``fit_result.userkws['x']``). ``None`` fits the entire energy range.
+    crop_groups: int | None
+        Number of bands (neighbouring in energy) fitted together within their own window, with the other bands fixed, before the final fitting within the full window. Only used with ``crop``.
     **kwds: keyword arguments
+        parname: str | 'center'
+            Name of the parameter describing the band positions, used for the adaptive energy window.
         shifts: list/tuple/numpy array | np.arange(0.1, 1.1, 0.1)
             The choices of random shifts to apply to the peak position initialization (energy in eV unit). The shifts are only operational when ``jitter_init=True``.
         other arguments
-            See details in ``pesfit.fitter.random_varshift()``.
+            See details in ``pesfit.fitter.random_varshift()`` and ``pesfit.fitter.multistart_varshift()``.
     """
     
     # Initialize model
@@ -265,6 +660,18 @@ def pointwise_fitting(xdata, ydata, model=None, peaks=None, background='None', p
         pars = params
 
     sfts = kwds.pop('shifts', np.arange(0.1, 1.1, 0.1))
+    parname = kwds.pop('parname', 'center')
+    if jitter_init == 'multistart':
+        ms_kwds = dict((k, kwds.pop(k)) for k in _multistart_keys if k in kwds)
+
+    # Replace the finite-difference Jacobian of the minimizer by the analytic one
+    if jacobian and (method == 'leastsq') and hasattr(mod, 'jacobian'):
+        if getattr(mod, 'op', None) is operator.add:
+            fit_kws = kwds.pop('fit_kws', None) or {}
+            kwds['fit_kws'] = {**fit_kws, 'Dfun':mod.jacobian}
+        else:
+            warnings.warn('The analytic Jacobian is only available for additive multipeak models, '
+                          'falling back to finite differences.')
     
     # Initialization for each pointwise fitting
     if inits is not None:
@@ -276,11 +683,33 @@ def pointwise_fitting(xdata, ydata, model=None, peaks=None, background='None', p
     else:
         ydatafit = ydata.copy()
     
-    fit_result = mod.fit(ydatafit, pars, x=xdata, **kwds)
+    if timing is not None:
+        tstart = time.perf_counter()
+    if crop is None:
+        fit_result = mod.fit(ydatafit, pars, x=xdata, method=method, **kwds)
+        nfev_groups = 0
+    else:
+        fit_result, mask, nfev_groups = _cropped_fitting(mod, ydatafit, pars, xdata, crop, crop_groups, parname, method=method, **kwds)
+        xdata, ydatafit = xdata[mask], ydatafit[mask]
+    if timing is not None:
+        tfit = time.perf_counter() - tstart
+        # The model evaluation time is estimated from a single evaluation at the best-fit values
+        tstart = time.perf_counter()
+        mod.eval(fit_result.params, x=xdata)
+        tmodel = min((time.perf_counter() - tstart)*(fit_result.nfev + nfev_groups), tfit)
+        timing['model'] = timing.get('model', 0.) + tmodel
+        timing['minimize'] = timing.get('minimize', 0.) + tfit - tmodel
+        tstart = time.perf_counter()
     
     # Apply random shifts to initialization to find a better fit
-    if jitter_init:
+    if jitter_init == 'multistart':
+        fit_result = multistart_varshift(fit_result, model=mod, params=pars, yvals=ydatafit, xvals=xdata, shifts=sfts, method=method, **ms_kwds, **kwds)
+    elif jitter_init:
         fit_result = random_varshift(fit_result, model=mod, params=pars, yvals=ydatafit, xvals=xdata, shifts=sfts, method=method, **kwds)
+    if timing is not None:
+        if jitter_init:
+            timing['jitter'] = timing.get('jitter', 0.) + time.perf_counter() - tstart
+        timing['nfev'] = fit_result.nfev + nfev_groups
     
     if ret == 'result':
         return fit_result
@@ -289,6 +718,293 @@ def pointwise_fitting(xdata, ydata, model=None, peaks=None, background='None', p
         return fit_result, fit_comps
 
 
+class StackedModel(object):
+    """ Evaluation of a multipeak lineshape model over a stack of parameter sets (one for each line spectrum) using the broadcastable lineshapes in ``pesfit.lineshape``. The stacked parameter array has the varying parameters (``self.var_names``) followed by the fixed ones (``self.fixed_names``) as columns.
+
+    **Parameters**\n
+    model: instance of ``pesfit.lineshape.MultipeakModel``
+        Lineshape model with all components supported in ``pesfit.lineshape.batch_kernels`` and ``pesfit.lineshape.jacobian_kernels``.
+    params: instance of ``lmfit.parameter.Parameters``
+        Parameter template, which sets the varying, fixed and aliased (constrained by expression to another parameter) parameters.
+    """
+
+    def __init__(self, model, params):
+
+        if getattr(model, 'op', operator.add) is not operator.add:
+            raise NotImplementedError('Batch fitting is only available for additive multipeak models.')
+        if getattr(model, 'stages', []):
+            raise NotImplementedError('Batch fitting does not support the Fermi-Dirac cutoff and the instrument response.')
+
+        self.var_names = [name for name, par in params.items() if par.vary and not par.expr]
+        self.fixed_names = []
+        self.aliases = OrderedDict()
+        self.groups = []
+
+        comp_groups = OrderedDict()
+        for comp in model.components:
+            comp_groups.setdefault(comp.func, []).append(comp)
+
+        for func, comps in comp_groups.items():
+            kernel = ls.batch_kernels.get(func, None)
+            jkernel = ls.jacobian_kernels.get(func, None)
+            if (kernel is None) or (jkernel is None):
+                raise NotImplementedError('Batch fitting does not support the lineshape {}.'.format(func.__name__))
+
+            # Function arguments absent from the parameters take their default values
+            argcols = OrderedDict()
+            for rn in comps[0]._func_allargs:
+                pnames = [comp.prefix + rn for comp in comps]
+                if (rn not in comps[0].independent_vars) and all(pn in params for pn in pnames):
+                    argcols[rn] = np.array([self._source_column(params, pn) for pn in pnames])
+            self.groups.append((kernel, jkernel, argcols))
+
+    @property
+    def nvar(self):
+        """ Number of varying parameters.
+        """
+
+        return len(self.var_names)
+
+    @property
+    def names(self):
+        """ Names of all columns of the stacked parameter array.
+        """
+
+        return self.var_names + self.fixed_names
+
+    def _source_column(self, params, name):
+        """ Column index of the stacked parameter array providing the value of a parameter.
+        """
+
+        par = params[name]
+        expr = par.expr.strip() if par.expr is not None else ''
+
+        if not expr:
+            if par.vary:
+                return self.var_names.index(name)
+            elif name not in self.fixed_names:
+                self.fixed_names.append(name)
+            return self.nvar + self.fixed_names.index(name)
+        elif expr in params:
+            col = self._source_column(params, expr)
+            self.aliases[name] = col
+            return col
+        else:
+            raise NotImplementedError('Batch fitting does not support the constraint {} = {}.'.format(name, expr))
+
+    def _args(self, argcols, pvals):
+        """ Stacked function arguments with the shape (number of spectra, number of components, 1).
+        """
+
+        return dict((rn, pvals[:, cols][..., None]) for rn, cols in argcols.items())
+
+    def eval(self, pvals, x):
+        """ Evaluate the model for every parameter set, returns an array with the shape (number of spectra, number of x values).
+        """
+
+        out = 0
+        for kernel, _, argcols in self.groups:
+            out = out + kernel(x, **self._args(argcols, pvals)).sum(axis=1)
+
+        return out
+
+    def jacobian(self, pvals, x):
+        """ Jacobian of the model for every parameter set with respect to the varying parameters, returns an array with the shape (number of spectra, number of x values, number of varying parameters).
+        """
+
+        nstack = pvals.shape[0]
+        jac = np.zeros((nstack, np.size(x), self.nvar))
+        for _, jkernel, argcols in self.groups:
+            derivs = jkernel(x, **self._args(argcols, pvals))
+            for rn, cols in argcols.items():
+                deriv = np.broadcast_to(derivs[rn], (nstack, len(cols), np.size(x)))
+                for i, col in enumerate(cols):
+                    if col < self.nvar:
+                        jac[..., col] += deriv[:, i, :]
+
+        return jac
+
+
+class BatchFitResult(object):
+    """ Outcome of the batched least-squares fitting of a stack of line spectra. Only the parameters entering the lineshapes are fitted, the derived parameters constrained by other expressions (e.g. '...fwhm' and '...height') are not evaluated.
+
+    **Parameters**\n
+    names: list
+        Names of the parameters, including the aliased ones (excluding the derived ones).
+    values: 2D array
+        Best-fit parameter values with the shape (number of spectra, number of parameters).
+    stderr: 2D array
+        Standard errors of the parameters (zero for the fixed ones).
+    chisqr, redchi: 1D array, 1D array
+        Chi-squared and reduced chi-squared of every fit.
+    niter: 1D array
+        Number of iterations for every fit.
+    success: 1D array
+        Convergence status of every fit.
+    """
+
+    def __init__(self, names, values, stderr, chisqr, redchi, niter, success):
+
+        self.names = names
+        self.values = values
+        self.stderr = stderr
+        self.chisqr = chisqr
+        self.redchi = redchi
+        self.niter = niter
+        self.success = success
+
+    @property
+    def nspec(self):
+        """ Number of fitted line spectra.
+        """
+
+        return self.values.shape[0]
+
+    def to_dataframe(self, **kwds):
+        """ Fitting parameters reformatted as a dataframe, in the same format as ``pesfit.utils.ResultCollector.to_dataframe()`` (the number of function evaluations is given by the number of iterations). The derived parameters (e.g. '...fwhm' and '...height') have no columns here, and are NaN where the compact results (see ``self.compact()``) are collected together with the outcomes of ``Model.fit()``.
+        """
+
+        collector = u.ResultCollector(self.names, self.nspec)
+        collector.values[:] = self.values
+        collector.stderr[:] = self.stderr
+        collector.stats[:] = np.stack((self.chisqr, self.redchi, self.niter, self.success), axis=1)
+        collector.filled[:] = True
+
+        return collector.to_dataframe(**kwds)
+
+    def compact(self, i):
+        """ Outcome of the i-th line spectrum as an instance of ``pesfit.fitter.CompactResult`` (the number of function evaluations is given by the number of iterations).
+        """
+
+        return CompactResult.from_arrays(self.names, self.values[i], self.stderr[i], self.chisqr[i], self.redchi[i],
+                                        self.niter[i], self.success[i])
+
+
+def batch_fitting(xdata, ydata, model, params=None, inits_stack=None, ynorm=True, max_iter=200, ftol=1.5e-8, xtol=1.5e-8, lambda_init=1e-3):
+    """ Fitting of a stack of line spectra as one batched least-squares problem. Every iteration of the Levenberg-Marquardt algorithm updates all unconverged spectra simultaneously using array operations, with per-spectrum damping and convergence masks. Parameter bounds are enforced by projection.
+
+    **Parameters**\n
+    xdata: 1D array
+        Energy coordinates shared by all line spectra.
+    ydata: 2D array
+        Line spectra with the shape (number of spectra, number of energy values).
+    model: instance of ``pesfit.lineshape.MultipeakModel``
+        Lineshape model (see ``pesfit.fitter.StackedModel`` for the supported components).
+    params: instance of ``lmfit.parameter.Parameters`` | None
+        Parameter template shared by all line spectra.
+    inits_stack: dict | None
+        Spectrum-dependent initialization in the format of {parameter name: {key: values}}, where the keys are 'value', 'min', 'max' (values given as 1D arrays over the spectra) or 'vary' (needs to be identical for all spectra).
+    ynorm: bool | True
+        Option to normalize each trace by its maximum before fitting.
+    max_iter: int | 200
+        Maximum number of iterations.
+    ftol, xtol: numeric, numeric | 1.5e-8, 1.5e-8
+        Relative tolerances in the sum of squares and the parameter values for convergence.
+    lambda_init: numeric | 1e-3
+        Initial damping factor.
+
+    **Return**\n
+    result: instance of ``pesfit.fitter.BatchFitResult``
+        Fitting outcome of all line spectra.
+    """
+
+    xdata = np.ravel(xdata)
+    ydata = np.atleast_2d(ydata).astype('float')
+    ydata = ydata.reshape((ydata.shape[0], -1))
+    nspec = ydata.shape[0]
+    if ynorm:
+        ydata = ydata / ydata.max(axis=1, keepdims=True)
+
+    if params is None:
+        params = model.make_params()
+    else:
+        params = params.copy()
+    if inits_stack is None:
+        inits_stack = {}
+
+    # The varying parameters need to be identical for all spectra
+    for name, ivals in inits_stack.items():
+        if 'vary' in ivals:
+            vary = np.unique(np.asarray(ivals['vary'], dtype='bool'))
+            if vary.size > 1:
+                raise ValueError('The parameter {} needs to vary for all spectra or for none.'.format(name))
+            params[name].set(vary=bool(vary[0]))
+
+    smod = StackedModel(model, params)
+    names, nvar = smod.names, smod.nvar
+    pvals = np.tile([params[n].value for n in names], (nspec, 1)).astype('float')
+    lower = np.tile([params[n].min for n in smod.var_names], (nspec, 1)).astype('float')
+    upper = np.tile([params[n].max for n in smod.var_names], (nspec, 1)).astype('float')
+    for name, ivals in inits_stack.items():
+        if name not in names:
+            continue
+        col = names.index(name)
+        if 'value' in ivals:
+            pvals[:, col] = ivals['value']
+        if col < nvar:
+            if 'min' in ivals:
+                lower[:, col] = ivals['min']
+            if 'max' in ivals:
+                upper[:, col] = ivals['max']
+    pvals[:, :nvar] = np.clip(pvals[:, :nvar], lower, upper)
+
+    resid = smod.eval(pvals, xdata) - ydata
+    cost = np.sum(resid**2, axis=1)
+    damping = np.full(nspec, lambda_init)
+    niter = np.zeros(nspec, dtype='int')
+    success = np.zeros(nspec, dtype='bool')
+    active = np.arange(nspec)
+
+    for it in range(max_iter):
+        if active.size == 0:
+            break
+        pv, rs, cs = pvals[active], resid[active], cost[active]
+        jac = smod.jacobian(pv, xdata)
+        jtj = np.einsum('nij,nik->njk', jac, jac)
+        jtr = np.einsum('nij,ni->nj', jac, rs)
+        diag = np.maximum(np.einsum('njj->nj', jtj), 1e-12)
+
+        # Damped Gauss-Newton step with Marquardt scaling
+        lhs = jtj + damping[active, None, None]*(diag[:, :, None]*np.eye(nvar))
+        step = -np.linalg.solve(lhs, jtr[..., None])[..., 0]
+        pnew = pv.copy()
+        pnew[:, :nvar] = np.clip(pv[:, :nvar] + step, lower[active], upper[active])
+        rnew = smod.eval(pnew, xdata) - ydata[active]
+        cnew = np.sum(rnew**2, axis=1)
+
+        improved = cnew < cs
+        upd = active[improved]
+        pvals[upd], resid[upd], cost[upd] = pnew[improved], rnew[improved], cnew[improved]
+        damping[active] = np.where(improved, damping[active]/10, damping[active]*10)
+        niter[active] += 1
+
+        # Convergence of the sum of squares or the parameter values, only counting accepted steps
+        dx = np.abs(pnew[:, :nvar] - pv[:, :nvar])
+        xconv = improved & np.all(dx <= xtol*(np.abs(pv[:, :nvar]) + xtol), axis=1)
+        fconv = improved & ((cs - cnew) <= ftol*cs)
+        converged = fconv | xconv
+        success[active[converged]] = True
+        stalled = damping[active] > 1e10
+        active = active[~(converged | stalled)]
+
+    # Error estimates from the curvature matrix at the best-fit values
+    nfree = max(xdata.size - nvar, 1)
+    redchi = cost / nfree
+    jac = smod.jacobian(pvals, xdata)
+    covar = np.linalg.pinv(np.einsum('nij,nik->njk', jac, jac))
+    stderr = np.zeros_like(pvals)
+    stderr[:, :nvar] = np.sqrt(np.abs(np.einsum('njj->nj', covar)) * redchi[:, None])
+
+    # Include the aliased parameters in the outcome
+    alias_cols = list(smod.aliases.values())
+    names = names + list(smod.aliases.keys())
+    values = np.hstack((pvals, pvals[:, alias_cols]))
+    stderr = np.hstack((stderr, stderr[:, alias_cols]))
+
+    return BatchFitResult(names, values, stderr, cost, redchi, niter, success)
+
+
+
 class PatchFitter(object):
     """ Class for fitting a patch of photoemission band mapping data.
 
@@ -407,13 +1123,15 @@ class PatchFitter(object):
         else:
             self.xvals = xdata
         
-        ydata_dim = self.ydata.ndim
-        if ydata_dim == 3:
-            self.ydata2D = u.partial_flatten(self.ydata[...,self.drange], axis=(0, 1))
-        elif ydata_dim == 2:
-            self.ydata2D = self.ydata[...,self.drange].copy()
-        elif ydata_dim == 1:
-            self.ydata2D = self.ydata[None,self.drange].copy()
+        # The spectral data are read later in the streaming mode (see ``self.stream_fit()``)
+        if self.ydata is not None:
+            ydata_dim = self.ydata.ndim
+            if ydata_dim == 3:
+                self.ydata2D = u.partial_flatten(self.ydata[...,self.drange], axis=(0, 1))
+            elif ydata_dim == 2:
+                self.ydata2D = self.ydata[...,self.drange].copy()
+            elif ydata_dim == 1:
+                self.ydata2D = self.ydata[None,self.drange].copy()
         
         try:
             if band_inits is not None:
@@ -422,6 +1140,8 @@ class PatchFitter(object):
                     self.band_inits2D = u.partial_flatten(self.band_inits, axis=(1, 2)) + offset
                 elif self.band_inits.ndim == 2:
                     self.band_inits2D = self.band_inits + offset
+                elif self.band_inits.ndim == 1: # Single line spectrum
+                    self.band_inits2D = self.band_inits[:,None] + offset
             else:
                 self.band_inits2D = None
         except:
@@ -449,25 +1169,47 @@ class PatchFitter(object):
         **kwds: keywords arguments
             nspec: int | ``self.nspec``
                 Number of spectra for fitting.
+            compact, keep_full, covar: bool, list/tuple/set, bool | False, (), False
+                Options for retaining compact fitting results (see ``pesfit.fitter.fit_spectrum()``).
+            warm_start: bool | False
+                Option to seed every fit with the converged values of its neighbours on the (kx, ky) grid (see ``pesfit.fitter.warm_start_fit()``).
+            order: str | 'serpentine'
+                Order of traversing the grid in the warm-start mode ('raster', 'serpentine' or 'hilbert', see ``pesfit.utils.traversal_order()``).
+            checkpoint: str | None
+                Path of an HDF5 file, to which the fitting outcomes are written incrementally (see ``pesfit.utils.ResultWriter``). ``self.df_fit`` then contains all outcomes in the file and ``self.fitres`` only those of the current run.
+            checkpoint_key: str | 'fitres'
+                Key of the fitting outcomes in the checkpoint file.
+            resume: bool | False
+                Option to skip the spectra with outcomes already in the checkpoint file, which requires the same model, data shape and initialization as the fitting that wrote them. Otherwise the outcomes in the file are replaced.
+            flush_every: int | 100
+                Number of fitting outcomes per write to the checkpoint file.
+            cache: instance of ``pesfit.utils.ResultCache`` | None
+                Cache of fitting outcomes (see ``pesfit.fitter.fit_spectrum()``).
+            profile: bool | False
+                Option to time the phases of the fitting, reported by ``self.profiler`` (see ``pesfit.utils.Profiler``).
             additional arguments:
                 See ``pesfit.fitter.pointwise_fitting()``.
         """
         
+        self.profiler = u.Profiler() if kwds.get('profile', False) else None
+        if self.profiler is not None:
+            self.profiler.start()
         self.pars = self.model.make_params()
         self.fitres = []
-        # Setting the initialization parameters and constraints persistent throughout the fitting process
-        try:
-            varsetter(self.pars, self.inits_persist, ret=False)
-        except:
-            pass
         
         tqdm = u.tqdmenv(pbenv)
 
-        # Fitting parameters for all line spectra in the data patch
-        self.df_fit = pd.DataFrame(columns=self.pars.keys())
-        self.df_fit['spec_id'] = ''
         # Number of spectrum to fit (for diagnostics)
         nspec = kwds.pop('nspec', self.nspec)
+        compact = kwds.pop('compact', False)
+        keep_full = set(kwds.pop('keep_full', ()))
+        covar = kwds.pop('covar', False)
+        warm_start = kwds.pop('warm_start', False)
+        order = kwds.pop('order', 'serpentine')
+        writer, done = _checkpoint_writer(kwds, setup=(_model_spec(self.model), self.xvals, np.shape(self.ydata2D), self.inits_persist,
+                                        self.band_inits2D, varkeys, other_initvals, pref_exclude, include_vary))
+        # Fitting parameters for all line spectra in the data patch
+        self.collector = u.ResultCollector(self.pars.keys(), nspec)
         
         # Construct the variable initialization parameters (usu. band positions) for all spectra
         # TODO: a better handling of nested dictionary generation
@@ -484,31 +1226,182 @@ class PatchFitter(object):
                 else:
                     inits_vary_vals = other_initvals
 
-        if pref_exclude: # Exclude certain lineshapes in updating initialization, if needed
-            prefixes = list(set(self.prefixes) - set(pref_exclude))
+        # Exclude certain lineshapes in updating initialization, if needed
+        prefixes = [pref for pref in self.prefixes if pref not in pref_exclude]
+        # Setting the initialization parameters and constraints persistent throughout the fitting process
+        with _phase(self.profiler, 'init'):
+            self.plan = InitPlan(self.pars, self.inits_persist, prefixes=prefixes, varkeys=varkeys)
+
+        # Traverse the (kx, ky) grid with the initialization seeded from the converged neighbours
+        if warm_start:
+            spec_ids = [n for n in u.traversal_order(self.patch_r, self.patch_c, order=order) if (n < nspec) and (n not in done)]
+            other_inits = inits_vary_vals if include_vary else None
+            fit_results = []
+            for out, extra in warm_start_fit(self.model, self.pars, self.xvals, self.ydata2D, tqdm(spec_ids, disable=not(pbar)),
+                                        (self.patch_r, self.patch_c), include_vary, prefixes, varkeys, other_inits, self.plan,
+                                        compact=compact, keep_full=keep_full, covar=covar, **kwds):
+                if self.profiler is not None:
+                    self.profiler.merge(extra['timing'], extra['spec_id'])
+                with _phase(self.profiler, 'collect'):
+                    fit_results.append((extra['spec_id'], out))
+                    self.collector.collect(out, extra['spec_id'])
+                    if writer is not None:
+                        writer.add(self.collector, extra['spec_id'])
+            with _phase(self.profiler, 'collect'):
+                self.fitres = [out for _, out in sorted(fit_results, key=lambda fres: fres[0])]
+                self.df_fit = self.collector.to_dataframe() if writer is None else writer.load()
+            if self.profiler is not None:
+                self.profiler.stop()
+            return
         
         # Sequentially fit every line spectrum in the data patch
         for n in tqdm(range(nspec), disable=not(pbar)):
+            if n in done:
+                continue
+
+            # Line fitting of the current energy distribution curve with the initialization that varies for every line spectrum
+            others = inits_vary_vals[..., n] if include_vary else None
+            out, extra = fit_spectrum(self.model, self.pars, self.xvals, self.ydata2D[n, :], n, include_vary, prefixes, varkeys, others,
+                                self.plan, compact=compact, keep_full=keep_full, covar=covar, **kwds)
+            if self.profiler is not None:
+                self.profiler.merge(extra['timing'], n)
+            with _phase(self.profiler, 'collect'):
+                self.fitres.append(out)
+                self.collector.collect(out, n)
+                if writer is not None:
+                    writer.add(self.collector, n)
+
+        with _phase(self.profiler, 'collect'):
+            self.df_fit = self.collector.to_dataframe() if writer is None else writer.load()
+        if self.profiler is not None:
+            self.profiler.stop()
+
+    def batch_fit(self, varkeys=['value', 'vary'], other_initvals=[True], pref_exclude=['bg_'], include_vary=True, **kwds):
+        """ Fit all line spectra of the data patch simultaneously as one batched least-squares problem (see ``pesfit.fitter.batch_fitting()``).
 
-            # Setting the initialization parameters that vary for every line spectrum
-            if include_vary:
-                other_inits = inits_vary_vals[..., n]
-                self.inits_vary = init_generator(parname='center', varkeys=varkeys, lpnames=prefixes, parvals=other_inits)
-                self.inits_all = u.merge_nested_dict(self.inits_persist + self.inits_vary)
-            else:
-                self.inits_all = u.merge_nested_dict(self.inits_persist)
-            varsetter(self.pars, self.inits_all, ret=False)
+        **Parameters**\n
+        varkeys: list/tuple | ['value', 'vary']
+            Collection of parameter keys to set ('value', 'min', 'max', 'vary').
+        other_initvals: list/tuple | [True]
+            Initialization values for spectrum-dependent variables other than the band energies.
+        pref_exclude: list/tuple | ['bg_']
+            Prefixes of the lineshapes to exclude from the spectrum-dependent initialization.
+        include_vary: bool | True
+            Option to include the spectrum-dependent initialization.
+        **kwds: keywords arguments
+            nspec: int | ``self.nspec``
+                Number of spectra for fitting.
+            additional arguments:
+                See ``pesfit.fitter.batch_fitting()``.
+        """
 
-            y = self.ydata2D[n, :].ravel() # Current energy distribution curve
-            # Line fitting with all the initial guesses supplied
-            out = pointwise_fitting(self.xvals.ravel(), y, model=self.model, params=self.pars, **kwds)
-            self.fitres.append(out)
+        self.pars = self.model.make_params()
+        InitPlan(self.pars, self.inits_persist).apply(self.pars)
+        nspec = kwds.pop('nspec', self.nspec)
 
-            dfout = u.df_collect(out.params, extra_params={'spec_id':n}, currdf=self.df_fit)
-            self.df_fit = dfout
+        # Spectrum-dependent initialization of the band energies
+        inits_stack = {}
+        if include_vary:
+            prefixes = [pref for pref in self.prefixes if pref not in pref_exclude]
+            varyvals = self.band_inits2D[:self.model.nlp, :nspec]
+            othervals = np.ones((len(varkeys)-1, nspec))*np.asarray(other_initvals)[:, None]
+            for pref, vvals in zip(prefixes, varyvals):
+                keyvals = [vvals] + list(othervals)
+                inits_stack[pref + 'center'] = dict((vk, kv) for vk, kv in zip(varkeys, keyvals))
+
+        self.batch_result = batch_fitting(self.xvals, self.ydata2D[:nspec, :], model=self.model, params=self.pars, inits_stack=inits_stack, **kwds)
+        self.df_fit = self.batch_result.to_dataframe()
+
+    def stream_fit(self, fpath, dataset, outpath, keyname='fitres', chunksize=1024, resume=False, varkeys=['value', 'vary'], other_initvals=[True], pref_exclude=['bg_'], include_vary=True, pbar=False, pbenv='notebook', **kwds):
+        """ Fitting of the line spectra in an HDF5 dataset chunk by chunk, without loading the whole dataset into memory. Every chunk of spectra is read from the file (energy range selected by ``self.drange``), fitted and its outcome appended to an HDF5 table, so the memory use is bounded by the chunk size. The spectrum ID is the row-major flattened index over all but the last (energy) dimension of the dataset. The initialization is set beforehand by ``self.set_inits()`` (``xdata`` and ``band_inits`` in the flattened layout, no ``ydata`` needed). The outcome is only kept in the output file, ``self.df_fit`` is not set (use ``self.load_fitting()`` to read it).
+
+        **Parameters**\n
+        fpath: str
+            Path of the HDF5 file containing the spectral data.
+        dataset: str
+            Name of the dataset with the spectral data, with energy as the last dimension (any number of leading dimensions).
+        outpath: str
+            Path of the HDF5 file to write the fitting outcome to (readable by ``self.load_fitting()``).
+        keyname: str | 'fitres'
+            Key of the fitting outcome in the output file.
+        chunksize: int | 1024
+            Maximum number of spectra read and fitted per chunk.
+        resume: bool | False
+            Option to skip the spectra with outcomes already in the output file (see ``pesfit.utils.ResultWriter``), which requires the same model, dataset shape and initialization as the fitting that wrote them. Otherwise the existing content under the key is replaced.
+        varkeys: list/tuple | ['value', 'vary']
+            Collection of parameter keys to set, starting with 'value' (taken from the band initialization).
+        other_initvals: list/tuple/array | [True]
+            Initialization values for the other keys in ``varkeys``, either shared by all spectra (size ``len(varkeys) - 1``) or spectrum-dependent with the shape (number of bands, ``len(varkeys)``, number of spectra) as in ``self.sequential_fit()``.
+        pref_exclude, include_vary, pbar, pbenv:
+            See ``self.sequential_fit()``.
+        **kwds: keyword arguments
+            nspec: int | all spectra in the dataset
+                Number of spectra for fitting.
+            additional arguments:
+                See ``pesfit.fitter.fit_spectrum()`` and ``pesfit.fitter.pointwise_fitting()``.
+        """
+
+        tqdm = u.tqdmenv(pbenv)
+        self.pars = self.model.make_params()
+        prefixes = [pref for pref in self.prefixes if pref not in pref_exclude]
+        self.plan = InitPlan(self.pars, self.inits_persist, prefixes=prefixes, varkeys=varkeys)
+        drange = slice(None) if self.drange is None else self.drange
+
+        with h5py.File(fpath, 'r') as f:
+            dset = f[dataset]
+            nspec = kwds.pop('nspec', int(np.prod(dset.shape[:-1], dtype='int')))
+            setup = (_model_spec(self.model), self.xvals, dset.shape, drange, self.inits_persist, self.band_inits2D,
+                    varkeys, other_initvals, pref_exclude, include_vary)
+            writer = u.ResultWriter(outpath, keyname=keyname, resume=resume, flush_every=chunksize, signature=u.content_digest(*setup))
+            done = set(writer.done_ids().tolist())
+            if include_vary:
+                other_initvals = self._stream_other_inits(other_initvals, varkeys, nspec)
+
+            with tqdm(total=nspec, disable=not(pbar)) as progress:
+                for sel, start, stop in u.chunk_slices(dset.shape[:-1], chunksize):
+                    if start >= nspec:
+                        break
+                    stop = min(stop, nspec)
+                    todo = [n for n in range(start, stop) if n not in done]
+                    progress.update(stop - start - len(todo))
+                    if not todo:
+                        continue
+                    ychunk = dset[sel + (Ellipsis, drange)].reshape((-1, np.size(self.xvals)))
+
+                    # Spectrum-dependent initialization of the chunk
+                    if include_vary:
+                        if other_initvals.ndim == 3: # Spectrum-dependent values of all keys
+                            other_inits = other_initvals[..., start:stop]
+                        else:
+                            varyvals = self.band_inits2D[:self.model.nlp, None, start:stop]
+                            othervals = np.ones((self.model.nlp, other_initvals.size, stop-start))*other_initvals[None, :, None]
+                            other_inits = np.concatenate((varyvals, othervals), axis=1)
+
+                    collector = u.ResultCollector(self.pars.keys(), stop-start, offset=start)
+                    for n in todo:
+                        others = other_inits[..., n-start] if include_vary else None
+                        out, _ = fit_spectrum(self.model, self.pars, self.xvals, ychunk[n-start, :], n, include_vary,
+                                            prefixes, varkeys, others, self.plan, **kwds)
+                        collector.collect(out, n)
+                        writer.add(collector, n)
+                        progress.update(1)
+
+                    writer.flush()
+
+    def _stream_other_inits(self, other_initvals, varkeys, nspec):
+        """ Check the shape of ``other_initvals`` in ``self.stream_fit()``.
+        """
+
+        other_initvals = np.asarray(other_initvals)
+        nkeys = len(varkeys)
+        if (other_initvals.ndim == 1) and (other_initvals.size == nkeys - 1):
+            return other_initvals
+        elif (other_initvals.ndim == 3) and (other_initvals.shape[:2] == (self.model.nlp, nkeys)) and (other_initvals.shape[2] >= nspec):
+            return other_initvals
+        else:
+            raise ValueError('other_initvals needs to have the size {} (shared by all spectra) or the shape ({}, {}, {}) (spectrum-dependent), '
+                            'but has the shape {}.'.format(nkeys - 1, self.model.nlp, nkeys, nspec, other_initvals.shape))
 
-        self.df_fit.sort_values('spec_id', ascending=True, inplace=True)
-    
     def save_data(self, fdir=r'./', fname='', ftype='h5', keyname='fitres', orient='dict', **kwds):
         """ Save the fitting outcome to a file.
         """
@@ -542,11 +1435,10 @@ class PatchFitter(object):
         return outdict
     
     def view(self, fit_result=None, fit_df=None, xaxis=None, **kwds):
-        """ Visualize selected fitting results.
+        """ Visualize selected fitting results. Compact results (see ``self.sequential_fit()``) cannot be visualized, the spectra to view need to be included in the ``keep_full`` keyword argument of the fitting.
         """
         
-        if xaxis is None:
-            xvals = self.xvals
+        xvals = np.ravel(self.xvals if xaxis is None else xaxis)
         
         if fit_result is None:
             fid = kwds.pop('fid', 0)
@@ -559,13 +1451,308 @@ class PatchFitter(object):
         return plot
 
 
+class CompactResult(object):
+    """ Compact outcome of a line spectrum fit. It retains only the best-fit values, uncertainties, fit statistics and optionally the covariance matrix of an ``lmfit.model.ModelResult``, without the data, model and residual arrays.
+
+    **Parameters**\n
+    fitres: instance of ``lmfit.model.ModelResult``
+        Full fitting result.
+    covar: bool | False
+        Option to keep the covariance matrix (and the names of the varying parameters in its order).
+    """
+
+    __slots__ = ('names', 'values', 'stderr', 'chisqr', 'redchi', 'nfev', 'success', 'var_names', 'covar')
+
+    def __init__(self, fitres, covar=False):
+
+        params = fitres.params
+        self.names = tuple(params.keys())
+        self.values = np.array([par.value for par in params.values()], dtype='float')
+        self.stderr = np.array([np.nan if par.stderr is None else par.stderr for par in params.values()], dtype='float')
+        self.chisqr = fitres.chisqr
+        self.redchi = fitres.redchi
+        self.nfev = fitres.nfev
+        self.success = fitres.success
+
+        if covar:
+            self.var_names = tuple(fitres.var_names)
+            self.covar = fitres.covar
+        else:
+            self.var_names = None
+            self.covar = None
+
+    @classmethod
+    def from_arrays(cls, names, values, stderr, chisqr, redchi, nfev, success):
+        """ Construct a compact result from the parameter names, values and standard errors and the fit statistics.
+        """
+
+        res = cls.__new__(cls)
+        res.names = tuple(names)
+        res.values = np.asarray(values, dtype='float')
+        res.stderr = np.asarray(stderr, dtype='float')
+        res.chisqr, res.redchi, res.nfev, res.success = chisqr, redchi, nfev, bool(success)
+        res.var_names = None
+        res.covar = None
+
+        return res
+
+    @property
+    def best_values(self):
+        """ Dictionary of the best-fit parameter values.
+        """
+
+        return dict(zip(self.names, self.values))
+
+    def __repr__(self):
+
+        return '<CompactResult: {} parameters, chisqr={:.4g}>'.format(len(self.names), self.chisqr)
+
+
+def _phase(profiler, name):
+    """ Timing context of a fitting phase (see ``pesfit.utils.Profiler.phase()``), which does nothing without a profiler.
+    """
+
+    return nullcontext() if profiler is None else profiler.phase(name)
+
+
+def _model_spec(model):
+    """ Specification of a lineshape model by its components, stages, operator and evaluation settings (used as a cache key).
+    """
+
+    comps = getattr(model, 'components', [model]) + getattr(model, 'stages', [])
+    spec = [(comp.func.__module__, comp.func.__name__, comp.prefix, tuple(comp.independent_vars), sorted(comp.opts.items()))
+            for comp in comps]
+    op = getattr(model, 'op', None)
+    settings = (getattr(model, 'conv_span', None), getattr(model, 'vectorize', None))
+
+    return (type(model).__name__, spec, getattr(op, '__name__', None), settings)
+
+
+def _checkpoint_writer(kwds, setup=()):
+    """ Set up the incremental writing of the fitting outcomes from the checkpoint options in the keyword arguments (see ``pesfit.fitter.PatchFitter.sequential_fit()``), returns the writer (None without checkpoint) and the IDs of the spectra to skip. The parts of the fitting setup in ``setup`` (e.g. model, data shape and initialization) are hashed into the signature of the checkpoint.
+    """
+
+    path = kwds.pop('checkpoint', None)
+    keyname = kwds.pop('checkpoint_key', 'fitres')
+    resume = kwds.pop('resume', False)
+    flush_every = kwds.pop('flush_every', 100)
+    if path is None:
+        return None, set()
+
+    writer = u.ResultWriter(path, keyname=keyname, resume=resume, flush_every=flush_every, signature=u.content_digest(*setup))
+
+    return writer, set(writer.done_ids().tolist())
+
+
+def fit_spectrum(model, pars, xvals, yspec, n, include_vary, prefixes, varkeys, others, inits_persist, seed=None, compact=False, keep_full=(), covar=False, cache=None, profile=False, **kwds):
+    """ Fit a single line spectrum with custom initializaton (the unit task of parallel fitting).
+
+    **Parameters**\n
+    model: instance of ``lmfit.model.Model`` or ``pesfit.lineshape.MultipeakModel``
+        Lineshape model for the fitting task.
+    pars: instance of ``lmfit.parameter.Parameters``
+        Parameters of the model.
+    xvals, yspec: 1D array, 1D array
+        Energy coordinates and the line spectrum.
+    n: int
+        Spectrum ID.
+    include_vary: bool
+        Option to include the spectrum-dependent initialization.
+    prefixes: list/tuple
+        Prefixes of the lineshapes with spectrum-dependent initialization.
+    varkeys: list/tuple
+        Collection of parameter keys to set ('value', 'min', 'max', 'vary').
+    others: numpy array | None
+        Spectrum-dependent initialization values.
+    inits_persist: list/dict or instance of ``pesfit.fitter.InitPlan``
+        Initialization parameters and constraints persistent throughout the fitting process, or their precompiled form (compiled on the fly otherwise).
+    seed: dict | None
+        Starting values (e.g. from converged neighbouring spectra) that replace the initial values of the free parameters (clipped to their bounds).
+    compact: bool | False
+        Option to return the fitting result as an instance of ``pesfit.fitter.CompactResult``.
+    keep_full: list/tuple/set | ()
+        Spectrum IDs for which the full ``lmfit.model.ModelResult`` is retained in the compact mode.
+    covar: bool | False
+        Option to keep the covariance matrix in the compact result.
+    cache: instance of ``pesfit.utils.ResultCache`` | None
+        Cache of fitting outcomes keyed by the spectrum, energy coordinates, model, initialization and fitting settings. A cache hit returns the cached compact result (regardless of ``compact``), the spectra in ``keep_full`` are always fitted.
+    profile: bool | False
+        Option to time the phases of the task (see ``pesfit.utils.Profiler``), returned under the ``'timing'`` key of the extra outputs together with the completion time (``'t_done'``, from ``time.time()``).
+    **kwds: keyword arguments
+        See ``pesfit.fitter.pointwise_fitting()``.
+    """
+
+    # Setting the initialization parameters that vary for every line spectrum
+    tstart = time.perf_counter()
+    if isinstance(inits_persist, InitPlan):
+        plan = inits_persist
+    else:
+        plan = InitPlan(pars, inits_persist, prefixes=prefixes, varkeys=varkeys)
+    plan.apply(pars, others=others if include_vary else None, seed=seed)
+    out_extra = {'spec_id': n}
+    if profile:
+        timing = {'init': time.perf_counter() - tstart}
+        out_extra['timing'] = timing
+
+    use_cache = (cache is not None) and (n not in keep_full)
+    if use_cache:
+        parstate = [(name, par.value, par.min, par.max, par.vary, par.expr) for name, par in pars.items()]
+        kwparts = [part for item in sorted(kwds.items()) for part in item]
+        key = cache.key(_model_spec(model), np.asarray(xvals), np.asarray(yspec), parstate, covar, *kwparts)
+        out_cached = cache.get(key)
+        if out_cached is not None:
+            if profile:
+                timing['t_done'] = time.time()
+            return out_cached, out_extra
+
+    # Line fitting with all the initial guesses supplied
+    if profile:
+        kwds['timing'] = timing
+    out_single = pointwise_fitting(xvals.ravel(), yspec.ravel(), model=model, params=pars, **kwds)
+    if use_cache:
+        out_compact = CompactResult(out_single, covar=covar)
+        cache.put(key, out_compact)
+        if compact:
+            out_single = out_compact
+    elif compact and (n not in keep_full):
+        out_single = CompactResult(out_single, covar=covar)
+    if profile:
+        timing['t_done'] = time.time()
+
+    return out_single, out_extra
+
+
+def warm_start_fit(model, pars, xvals, ydata2D, spec_ids, grid_shape, include_vary, prefixes, varkeys, other_inits, inits_persist, **kwds):
+    """ Fit a sequence of line spectra on a (kx, ky) grid, seeding every fit with the mean best-fit values of its converged nearest neighbours (warm start). Spectra without converged neighbours start from the regular initialization.
+
+    **Parameters**\n
+    model, pars, xvals:
+        See ``pesfit.fitter.fit_spectrum()``.
+    ydata2D: 2D array
+        Line spectra of the grid, with the (flattened) spectrum ID in the first dimension.
+    spec_ids: list/tuple/array
+        Spectrum IDs in the order of fitting (see ``pesfit.utils.traversal_order()``).
+    grid_shape: list/tuple
+        Number of rows and columns of the grid (the spectrum ID is the row-major flattened index).
+    include_vary, prefixes, varkeys, inits_persist:
+        See ``pesfit.fitter.fit_spectrum()``.
+    other_inits: numpy array | None
+        Spectrum-dependent initialization values, with the spectrum ID in the last dimension.
+    **kwds: keyword arguments
+        See ``pesfit.fitter.fit_spectrum()`` and ``pesfit.fitter.pointwise_fitting()``.
+
+    **Return**\n
+    Generator of the outcomes of ``pesfit.fitter.fit_spectrum()`` in the order of fitting.
+    """
+
+    nrow, ncol = grid_shape
+    if not isinstance(inits_persist, InitPlan):
+        inits_persist = InitPlan(pars, inits_persist, prefixes=prefixes, varkeys=varkeys)
+    converged = {}
+
+    for n in spec_ids:
+        nbvals = [converged[m] for m in u.grid_neighbours(n, nrow, ncol) if m in converged]
+        if nbvals:
+            seed = dict((name, np.mean([nbv[name] for nbv in nbvals])) for name in nbvals[0])
+        else:
+            seed = None
+
+        others = None if other_inits is None else other_inits[..., n]
+        fres = fit_spectrum(model, pars, xvals, ydata2D[n, :], n, include_vary, prefixes, varkeys, others, inits_persist, seed=seed, **kwds)
+        if fres[0].success:
+            converged[n] = fres[0].best_values
+
+        yield fres
+
+
+def _fit_block(yblock, start, spec_ids, model, plan, xvals, others, include_vary, prefixes, varkeys, fit_kwds):
+    """ Fit the line spectra of a block, where ``start`` is the ID of its first spectrum (the unit task of the 'distributed' backend in ``pesfit.fitter.DistributedFitter.parallel_fit()``).
+    """
+
+    pars = model.make_params()
+    fit_results = []
+    for n in spec_ids:
+        ioth = None if others is None else others[..., n-start]
+        fit_results.append(fit_spectrum(model, pars, xvals, yblock[n-start, :], n, include_vary, prefixes, varkeys, ioth, plan, **fit_kwds))
+
+    return fit_results
+
+
+def _release_shared(shared):
+    """ Release a collection of shared arrays.
+    """
+
+    for sarr in shared.values():
+        sarr.close()
+    shared.clear()
+
+
+# Per-process state of the workers in a persistent pool (see ``pesfit.fitter.DistributedFitter.start_pool()``)
+_worker_state = {}
+
+def _init_worker(model, inits_persist, xvals, ydata2D, other_inits, include_vary, prefixes, varkeys, fit_kwds):
+    """ Initialize a persistent fitting worker with the model, data and settings shared by all tasks.
+    """
+
+    _worker_state.clear()
+    pars = model.make_params()
+    plan = InitPlan(pars, inits_persist, prefixes=prefixes, varkeys=varkeys)
+    _worker_state.update(model=model, pars=pars, inits_persist=plan, xvals=xvals,
+                        ydata2D=ydata2D, other_inits=other_inits, include_vary=include_vary,
+                        prefixes=prefixes, varkeys=varkeys, fit_kwds=fit_kwds)
+
+
+def _worker_fit(n):
+    """ Fit the line spectrum with the ID ``n`` using the state of a persistent worker.
+    """
+
+    ws = _worker_state
+    others = None if ws['other_inits'] is None else ws['other_inits'][..., n]
+
+    return fit_spectrum(ws['model'], ws['pars'], ws['xvals'], ws['ydata2D'][n, :], n, ws['include_vary'],
+                        ws['prefixes'], ws['varkeys'], others, ws['inits_persist'], **ws['fit_kwds'])
+
+
+def _worker_fit_tile(spec_ids, grid_shape):
+    """ Warm-start fitting of a tile of line spectra using the state of a persistent worker.
+    """
+
+    ws = _worker_state
+
+    return list(warm_start_fit(ws['model'], ws['pars'], ws['xvals'], ws['ydata2D'], spec_ids, grid_shape, ws['include_vary'],
+                        ws['prefixes'], ws['varkeys'], ws['other_inits'], ws['inits_persist'], **ws['fit_kwds']))
+
+
+# Keyword arguments supported by the batched fitting in the 'threads' backend (see ``pesfit.fitter.DistributedFitter.parallel_fit()``)
+_thread_batch_keys = ('ynorm', 'max_iter', 'ftol', 'xtol', 'lambda_init', 'profile')
+
 class DistributedFitter(object):
     """ Parallelized fitting of line spectra in a photoemission data patch.
+
+    **Parameters**\n
+    xdata: 1D array
+        Energy coordinates for photoemission line spectrum fitting.
+    ydata: numpy array
+        Photoemission spectral data for fitting (2D or 3D). The default shape is that the last dimension is energy.
+    drange: slice object | None
+        Slice object corresponding to the energy range to select.
+    model: instance of ``lmfit.model.Model`` or ``pesfit.lineshape.MultipeakModel`` | None
+        Existing universal lineshape model for fitting (shared by all spectra).
+    modelkwds: dict | {}
+        Keyword arguments for ``pesfit.fitter.model_generator()``, used when no model is supplied.
+    **kwds: keyword arguments
+        nfitter: int | 1
+            Number of spectra for fitting.
+        lazy: bool | False
+            Option to use a single model and parameter template for all spectra instead of constructing a ``pesfit.fitter.PatchFitter`` for every spectrum. The spectrum-dependent state is then only created within each fitting task.
+        peaks, background: dict, str | {'Voigt':2}, 'None'
+            See ``pesfit.fitter.model_generator()``.
     """
 
     def __init__(self, xdata, ydata, drange=None, model=None, modelkwds={}, **kwds):
 
         self.nfitter = kwds.pop('nfitter', 1)
+        self.lazy = kwds.pop('lazy', False)
 
         self.xdata = xdata
         self.ydata = ydata
@@ -581,11 +1768,38 @@ class DistributedFitter(object):
             self.ydata2D = self.ydata[...,self.drange].copy()
         self.patch_r, self.patch_c, self.elen = self.patch_shape
         
-        self.fitters = [PatchFitter(self.xvals, self.ydata2D[ft,...], mode=model, modelkwds=modelkwds, **kwds) for ft in range(self.nfitter)]
-        self.models = [self.fitters[n].model for n in range(self.nfitter)]
-        self.model = self.fitters[0].model
-        self.prefixes = self.fitters[0].prefixes
+        if self.lazy:
+            self.fitters = []
+            if model is None:
+                peaks = kwds.pop('peaks', {'Voigt':2})
+                bg = kwds.pop('background', 'None')
+                self.model = model_generator(peaks=peaks, background=bg, **modelkwds)
+            else:
+                self.model = model
+            self.models = [self.model]
+            self.prefixes = self.model.prefixes
+        else:
+            self.fitters = [PatchFitter(self.xvals, self.ydata2D[ft,...], model=model, modelkwds=modelkwds, **kwds) for ft in range(self.nfitter)]
+            self.models = [self.fitters[n].model for n in range(self.nfitter)]
+            self.model = self.fitters[0].model
+            self.prefixes = self.fitters[0].prefixes
         self.fitres = []
+        self.pool = None
+        self._pool_key = None
+        self._inits_version = 0
+        self.shared = None
+
+    def __getstate__(self):
+        """ Pickling excludes the persistent pool of workers (relevant for the backends that ship ``self._single_fit``).
+        """
+
+        state = self.__dict__.copy()
+        state['pool'] = None
+        state['_pool_key'] = None
+        state.pop('_pool_finalizer', None)
+        state.pop('_shared_finalizer', None)
+
+        return state
     
     @property
     def nspec(self):
@@ -603,6 +1817,7 @@ class DistributedFitter(object):
             self.inits_persist = inits_dict
         else:
             self.inits_persist = {}
+        self._inits_version += 1 # Outdates the state of the persistent workers
 
         try:
             if band_inits is not None:
@@ -616,9 +1831,14 @@ class DistributedFitter(object):
         except:
             raise Exception('Cannot reshape the initialization!')
         
-        for n in range(self.nfitter):
+        if (self.shared is not None) and (self.band_inits2D is not None):
+            self.band_inits2D = self._share('band_inits2D', self.band_inits2D)
+
+        # In the lazy mode, the initialization is only applied in the fitting tasks
+        for n in range(len(self.fitters)):
             if self.band_inits2D is not None:
-                self.fitters[n].set_inits(inits_dict=inits_dict, band_inits=self.band_inits2D[:,n:n+1], drange=None, offset=offset)
+                # Copies keep the fitters from holding views of the shared storage (see ``self.share_data()``)
+                self.fitters[n].set_inits(inits_dict=inits_dict, band_inits=np.array(self.band_inits2D[:,n:n+1]), drange=None, offset=offset)
             else:
                 self.fitters[n].set_inits(inits_dict=inits_dict, band_inits=None, drange=None, offset=offset)
 
@@ -637,8 +1857,10 @@ class DistributedFitter(object):
         scheduler: str | 'processes'
             Scheduler for parallelization ('processes' or 'threads', which can fail).
         backend: str | 'multiprocessing'
-            Backend for executing the parallelization ('dask', 'concurrent', 'multiprocessing', 'parmap', 'async').
-            Input 'singles' for sequential operation.
+            Backend for executing the parallelization ('dask', 'concurrent', 'multiprocessing', 'parmap', 'async', 'pool', 'threads').
+            Input 'singles' for sequential operation. The 'pool' backend uses persistent workers (see ``self.start_pool()``), which receive the model, data and settings only once and the spectrum ID per task.
+            The 'threads' backend runs the fitting tasks in a thread pool without starting processes or pickling, with separate parameters for every thread (see ``thread_batch``).
+            The 'distributed' backend fits blocks of spectra on a ``dask.distributed`` cluster (see ``client`` and ``block_size``).
         ret: bool | False
             Option for returning the fitting outcome.
         **kwds: keyword arguments
@@ -646,24 +1868,61 @@ class DistributedFitter(object):
                 Number of spectra for fitting.
             num_workers: int | ``n_cpu``
                 Number of workers to use for the parallelization.
-            chunksize: int | integer from nfitter/num_worker
-                Number of tasks assigned to each worker (needs to be >=1).
+            chunksize: int or 'auto' | 'auto'
+                Number of tasks assigned to each worker (needs to be >=1). With 'auto', the 'pool' backend sizes the chunks adaptively from the measured task duration (see ``pesfit.utils.GuidedScheduler``), and the other backends use the integer from nfitter/num_worker. Adaptive chunks are not used for the backends that send the fitter with every chunk.
+            target_time: numeric | 0.25
+                Target duration of a chunk (in seconds) for the adaptive chunk sizes of the 'pool' backend.
+            client: instance of ``dask.distributed.Client`` | None
+                Client of the cluster for the 'distributed' backend (None starts a local cluster with ``num_workers`` workers for the duration of the fitting). The spectral data are split into blocks of spectra that are sent to the workers, the model and initialization are sent to every worker once, and only the compact results (``compact=True`` by default) are returned.
+            block_size: int | nfitter/(4*num_workers)
+                Number of spectra per block in the 'distributed' backend.
+            thread_batch: int/bool | None
+                Number of spectra fitted together as one batched least-squares problem per task of the 'threads' backend (``True`` for an even split over the workers, see ``pesfit.fitter.batch_fitting()``). The array operations of the batched problem release the GIL, which lets the threads run in parallel. The outcomes are always compact, and only the settings of ``batch_fitting()`` (``ynorm``, ``max_iter``, ``ftol``, ``xtol``, ``lambda_init``) and ``profile`` apply, other keyword arguments raise a ``ValueError``. ``None`` fits the spectra one at a time with ``pointwise_fitting()``, which is largely bound by the GIL.
+            warm_start: bool | False
+                Option to split the (kx, ky) grid into tiles and fit each tile sequentially within a worker, seeding every fit with the converged values of its neighbours (see ``pesfit.fitter.warm_start_fit()``). Only available with the 'pool' backend.
+            order: str | 'serpentine'
+                Order of traversing each tile in the warm-start mode (see ``pesfit.utils.traversal_order()``).
+            tile_shape: list/tuple | square tiles, about one per worker
+                Number of rows and columns of a tile in the warm-start mode.
+            checkpoint, checkpoint_key, resume, flush_every: str, str, bool, int | None, 'fitres', False, 100
+                Options for the incremental writing of the fitting outcomes to a checkpoint file (see ``pesfit.fitter.PatchFitter.sequential_fit()``). The outcomes are written as they are returned by the backend.
+            profile: bool | False
+                Option to time the phases of the fitting, reported by ``self.profiler`` (see ``pesfit.utils.Profiler``). The phases of the tasks are timed within the workers, the time between the completion of a task and the arrival of its outcome is counted as serialization and transfer (``'ipc'``).
+            band_bounds: numeric/list/tuple | None
+                Half-width of the bounds of the band positions around their spectrum-dependent initialization (a number or one per band), which adds 'min' and 'max' to ``varkeys``. Requires ``include_vary=True``.
+            additional arguments:
+                See ``pesfit.fitter.fit_spectrum()`` and ``pesfit.fitter.pointwise_fitting()``.
         """
 
+        self.profiler = u.Profiler() if kwds.get('profile', False) else None
+        if self.profiler is not None:
+            self.profiler.start()
         n_cpu = mp.cpu_count()
         nspec = kwds.pop('nfitter', self.nfitter) # Separate nspec and nfitter
+        warm_start = kwds.pop('warm_start', False)
+        order = kwds.pop('order', 'serpentine')
+        tile_shape = kwds.pop('tile_shape', None)
+        band_bounds = kwds.pop('band_bounds', None)
+        if warm_start and (backend != 'pool'):
+            raise ValueError("The warm-start mode requires the 'pool' backend.")
+        writer, done = _checkpoint_writer(kwds, setup=(_model_spec(self.model), self.xvals, np.shape(self.ydata2D), self.inits_persist,
+                                        self.band_inits2D, varkeys, other_initvals, pref_exclude, include_vary, band_bounds))
+        spec_ids = [n for n in range(nspec) if n not in done]
+        ntask = len(spec_ids)
         self.pars = [md.make_params() for md in self.models]
-        # Setting the initialization parameters and constraints persistent throughout the fitting process
-        try:
-            for p in self.pars:
-                varsetter(p, self.inits_persist, ret=False)
-        except:
-            pass
 
         self.fitres = [] # Re-initialize fitting outcomes
-        # Fitting parameters for all line spectra in the data patch
-        self.df_fit = pd.DataFrame(columns=self.pars[0].keys())
-        self.df_fit['spec_id'] = '' # Spectrum ID for queuing
+        # Fitting parameters for all line spectra in the data patch, filled by the spectrum ID
+        self.collector = u.ResultCollector(self.pars[0].keys(), nspec)
+
+        def record(fres, arrival=None):
+            if self.profiler is not None:
+                self.profiler.merge(fres[1]['timing'], fres[1]['spec_id'], time.time() if arrival is None else arrival)
+            with _phase(self.profiler, 'collect'):
+                self.fitres.append(fres)
+                self.collector.collect(fres[0], fres[1]['spec_id'])
+                if writer is not None:
+                    writer.add(self.collector, fres[1]['spec_id'])
 
         if include_vary:
             varyvals = self.band_inits2D[:self.model.nlp, :nspec]
@@ -677,26 +1936,49 @@ class DistributedFitter(object):
                         raise Exception('other_initvals has incorrect shape!')
                 else:
                     raise Exception('other_initvals has incorrect shape!')
-
-        if pref_exclude: # Exclude certain lineshapes in updating initialization, if needed
-            prefixes = list(set(self.prefixes) - set(pref_exclude))
-        else:
-            prefixes =  self.prefixes
+            if band_bounds is not None:
+                halfwidth = np.reshape(band_bounds, (-1, 1)) * np.ones((self.model.nlp, nspec))
+                bounds = np.stack((varyvals - halfwidth, varyvals + halfwidth), axis=1)
+                self.other_inits = np.concatenate((self.other_inits, bounds), axis=1)
+                varkeys = list(varkeys) + ['min', 'max']
+        elif band_bounds is not None:
+            raise ValueError('Bounds of the band positions require include_vary=True.')
+
+        # Exclude certain lineshapes in updating initialization, if needed
+        prefixes = [pref for pref in self.prefixes if pref not in pref_exclude]
+        # Initialization parameters and constraints persistent throughout the fitting process, compiled once for all tasks
+        with _phase(self.profiler, 'init'):
+            self.plan = InitPlan(self.pars[0], self.inits_persist, prefixes=prefixes, varkeys=varkeys)
         
         # Generate arguments for compartmentalized fitting tasks
-        try:
-            process_args = [(self.models[n], self.pars[n], self.xvals, self.fitters[n].ydata2D, n, include_vary, prefixes,
-            varkeys, self.other_inits[...,n], pref_exclude) for n in range(nspec)]
-        except:
-            process_args = [(self.models[n], self.pars[n], self.xvals, self.fitters[n].ydata2D, n, include_vary, prefixes,
-            varkeys, None, pref_exclude) for n in range(nspec)]
+        if backend == 'pool':
+            process_args = []
+        else:
+            process_args = [self._task_args(n, include_vary, prefixes, varkeys, pref_exclude) for n in spec_ids]
         
         # Use different libraries for parallelization
         n_workers = kwds.pop('num_workers', n_cpu)
-        chunk_size = kwds.pop('chunksize', u.intnz(nspec/n_workers))
+        chunk_size = kwds.pop('chunksize', 'auto')
+        target_time = kwds.pop('target_time', 0.25)
+        # Adaptive chunks are only used with the persistent pool, whose tasks carry just the spectrum ID
+        adaptive = (chunk_size == 'auto') and (backend == 'pool')
+        if adaptive:
+            chunk_scheduler = u.GuidedScheduler(n_workers, target_time=target_time)
+        elif chunk_size == 'auto':
+            chunk_size = u.intnz(ntask/n_workers)
+        thread_batch = kwds.pop('thread_batch', None)
+        client = kwds.pop('client', None)
+        block_size = kwds.pop('block_size', None)
+        # The remaining keyword arguments are passed on to the fitting of every spectrum
+        single_fit = partial(self._single_fit, **kwds)
+        # Outcomes returned at once by the backend (the others are recorded as they arrive)
+        fit_results = []
         
-        if backend == 'dask':
-            fit_tasks = [dk.delayed(self._single_fit)(*args) for args in process_args]
+        if ntask == 0: # All spectra are fitted already
+            pass
+
+        elif backend == 'dask':
+            fit_tasks = [dk.delayed(single_fit)(*args) for args in process_args]
             if pbar:
                 with ProgressBar():
                     fit_results = dk.compute(*fit_tasks, scheduler=scheduler, num_workers=n_workers, **para_kwds)
@@ -705,24 +1987,86 @@ class DistributedFitter(object):
 
         elif backend == 'concurrent':
             with ccf.ProcessPoolExecutor(max_workers=n_workers, **para_kwds) as executor:
-                fit_results = list(tqdm(executor.map(self._single_fit, *zip(*process_args), chunksize=chunk_size), total=nspec, disable=not(pbar)))
+                for fres in tqdm(executor.map(single_fit, *zip(*process_args), chunksize=chunk_size), total=ntask, disable=not(pbar)):
+                    record(fres)
 
         elif backend == 'multiprocessing':
             pool = mp.Pool(processes=n_workers, **para_kwds)
-            fit_results = []
-            for fr in tqdm(pool.istarmap(self._single_fit, process_args, chunksize=chunk_size), total=nspec, disable=not(pbar)):
-                fit_results.append(fr)
+            fit_iter = pool.istarmap(single_fit, process_args, chunksize=chunk_size)
+            for fres in tqdm(fit_iter, total=ntask, disable=not(pbar)):
+                record(fres)
             pool.close()
             pool.join()
 
+        elif backend == 'pool':
+            other_inits = getattr(self, 'other_inits', None) if include_vary else None
+            self.start_pool(n_workers, nspec=nspec, other_inits=other_inits, include_vary=include_vary, prefixes=prefixes,
+                            varkeys=varkeys, fit_kwds=kwds, **para_kwds)
+            if warm_start:
+                grid_shape = (self.patch_r, self.patch_c)
+                if tile_shape is None:
+                    side = u.intnz(np.ceil(np.sqrt(self.nspec/n_workers)))
+                    tile_shape = (side, side)
+                todo = np.zeros(nspec, dtype='bool')
+                todo[spec_ids] = True
+                tiles = [tl[tl < nspec] for tl in u.grid_tiles(*grid_shape, tile_shape, order=order)]
+                tiles = [tl[todo[tl]] for tl in tiles]
+                tiles = [tl for tl in tiles if tl.size > 0]
+                tile_fit = partial(_worker_fit_tile, grid_shape=grid_shape)
+                for tile_results in tqdm(self.pool.imap(tile_fit, tiles), total=len(tiles), disable=not(pbar)):
+                    for fres in tile_results:
+                        record(fres)
+            else:
+                if adaptive:
+                    fit_iter = self.pool.adaptive_starmap(_worker_fit, [(n,) for n in spec_ids], scheduler=chunk_scheduler)
+                else:
+                    fit_iter = self.pool.imap(_worker_fit, spec_ids, chunksize=chunk_size)
+                for fres in tqdm(fit_iter, total=ntask, disable=not(pbar)):
+                    record(fres)
+
+        elif backend == 'threads':
+            local = threading.local() # Parameters of every thread
+            with ccf.ThreadPoolExecutor(max_workers=n_workers) as executor:
+                if thread_batch:
+                    unsupported = sorted(k for k in kwds if (k not in _thread_batch_keys) and not ((k == 'compact') and kwds[k]))
+                    if unsupported:
+                        raise ValueError('The batched fitting in threads does not support the keyword arguments {}.'.format(', '.join(unsupported)))
+                    bsize = u.intnz(np.ceil(ntask/n_workers)) if thread_batch is True else int(thread_batch)
+                    blocks = [spec_ids[i:i+bsize] for i in range(0, ntask, bsize)]
+                    futures = [executor.submit(self._thread_batch_fit, block, local, include_vary, varkeys, **kwds) for block in blocks]
+                    with tqdm(total=ntask, disable=not(pbar)) as progress:
+                        for fut in ccf.as_completed(futures):
+                            for fres in fut.result():
+                                record(fres)
+                                progress.update(1)
+                else:
+                    futures = [executor.submit(self._thread_fit, n, local, include_vary, prefixes, varkeys, **kwds) for n in spec_ids]
+                    for fut in tqdm(ccf.as_completed(futures), total=ntask, disable=not(pbar)):
+                        record(fut.result())
+
+        elif backend == 'distributed':
+            from dask import distributed as ddist
+
+            own_client = client is None
+            if own_client:
+                client = ddist.Client(n_workers=n_workers)
+            kwds.setdefault('compact', True)
+            try:
+                for fres in tqdm(self._distributed_fit(client, spec_ids, nspec, block_size, include_vary, prefixes, varkeys, kwds),
+                                total=ntask, disable=not(pbar)):
+                    record(fres)
+            finally:
+                if own_client:
+                    client.close()
+
         elif backend == 'parmap':
-            fit_results = parmap.starmap(self._single_fit, process_args, pm_processes=n_workers, pm_chunksize=chunk_size, pm_parallel=True, pm_pbar=pbar)
+            fit_results = parmap.starmap(single_fit, process_args, pm_processes=n_workers, pm_chunksize=chunk_size, pm_parallel=True, pm_pbar=pbar)
         
         elif backend == 'async':
-            fit_procs = parmap.starmap_async(self._single_fit, process_args, pm_processes=n_workers, pm_chunksize=chunk_size, pm_parallel=True)
+            fit_procs = parmap.starmap_async(single_fit, process_args, pm_processes=n_workers, pm_chunksize=chunk_size, pm_parallel=True)
 
             try:
-                parmap.parmap._do_pbar(fit_procs, num_tasks=nspec, chunksize=chunk_size)
+                parmap.parmap._do_pbar(fit_procs, num_tasks=ntask, chunksize=chunk_size)
             finally:
                 fit_results = fit_procs.get()
         
@@ -741,45 +2085,342 @@ class DistributedFitter(object):
             
             torc.init()
             torc.launch(None)
-            fit_results = torc.map(self._single_fit, *zip(*process_args), chunksize=chunk_size)
+            fit_results = torc.map(single_fit, *zip(*process_args), chunksize=chunk_size)
             torc.shutdown()
         
         elif backend == 'singles': # Run sequentially for debugging use
-            fit_results = [self._single_fit(*args, **kwds) for args in tqdm(process_args, disable=not(pbar))]
+            for args in tqdm(process_args, disable=not(pbar)):
+                record(single_fit(*args))
 
         else:
             raise NotImplementedError
 
         # Collect the results
+        arrival = time.time()
         for fres in fit_results:
-            self.fitres.append(fres)
-            dfout = u.df_collect(fres[0].params, extra_params=fres[1], currdf=self.df_fit)
-            self.df_fit = dfout
+            record(fres, arrival)
             # print_fit_result(fres.params, printout=True)
 
-        # Sort values by `spec_id` (relevant for unordered parallel fitting)
-        self.df_fit.sort_values('spec_id', ascending=True, inplace=True)
+        # Rows are ordered by `spec_id` (relevant for unordered parallel fitting)
+        with _phase(self.profiler, 'collect'):
+            self.df_fit = self.collector.to_dataframe() if writer is None else writer.load()
+        if self.profiler is not None:
+            self.profiler.stop()
 
         if ret:
             return self.df_fit
     
+    def hierarchical_fit(self, bins=2, window=0.1, parname='center', pref_exclude=[], coarse_kwds={}, widen=3, ret=False, **kwds):
+        """ Coarse-to-fine fitting of the data patch. The spectra are first averaged over square blocks of the (kx, ky) grid (see ``pesfit.utils.grid_bin()``) and fitted with the initialization averaged in the same way. The fitted band positions are then interpolated back onto the full grid (see ``pesfit.utils.grid_unbin()``) as the initialization of the full-resolution fitting, which bounds them within a narrow window. Spectra with band positions that end up pinned at a bound are refitted with a widened window. The initialization set by ``self.set_inits()`` is restored afterwards, the interpolated one is kept in ``self.refined_inits``.
+
+        **Parameters**\n
+        bins: int | 2
+            Number of grid points per block along each dimension of the coarse grid.
+        window: numeric/list/tuple | 0.1
+            Half-width of the bounds of the band positions around the interpolated initialization in the full-resolution fitting (a number or one per band, see ``band_bounds`` in ``self.parallel_fit()``).
+        parname: str | 'center'
+            Name of the parameter describing the band positions.
+        pref_exclude: list/tuple | []
+            Prefixes of the lineshapes excluded from the spectrum-dependent initialization.
+        coarse_kwds: dict | {}
+            Keyword arguments that replace those in ``kwds`` for the coarse fitting.
+        widen: numeric | 3
+            Factor widening the window for refitting the spectra with band positions pinned at a bound (within 1% of the window), ``None`` or 0 to skip the refitting. The IDs of the spectra still pinned afterwards are kept in ``self.pinned``. The refitted outcomes replace those in ``self.fitres`` and ``self.df_fit`` but are not written to a checkpoint file.
+        ret: bool | False
+            Option for returning the fitting outcome.
+        **kwds: keyword arguments
+            See ``self.parallel_fit()``, used for both stages. The coarse fitter is kept in ``self.coarse_fitter``.
+        """
+
+        if self.band_inits2D is None:
+            raise ValueError('Coarse-to-fine fitting requires the band initialization (band_inits in self.set_inits()).')
+        nlp = self.model.nlp
+        grid_shape = (self.patch_r, self.patch_c)
+        # Lineshapes describing the bands (excluding e.g. the background)
+        prefixes = [pref for pref in self.prefixes if (pref not in pref_exclude) and (pref + parname in self.model.param_names)][:nlp]
+
+        # Fitting on the coarse grid
+        ycoarse = u.grid_bin(self.ydata2D[:self.nspec, ...].reshape(grid_shape + (-1,)), bins)
+        bands = np.asarray(self.band_inits2D[:nlp, :self.nspec]).reshape((nlp,) + grid_shape)
+        bands_coarse = np.moveaxis(u.grid_bin(np.moveaxis(bands, 0, -1), bins), -1, 0)
+        ncoarse = ycoarse.shape[0] * ycoarse.shape[1]
+        self.coarse_fitter = DistributedFitter(np.ravel(self.xvals), ycoarse, drange=slice(None), model=self.model, lazy=True, nfitter=ncoarse)
+        self.coarse_fitter.set_inits(inits_dict=self.inits_persist, band_inits=bands_coarse)
+        ckwds = dict((key, val) for key, val in kwds.items() if key not in ('nfitter', 'checkpoint', 'resume', 'band_bounds'))
+        ckwds.update(coarse_kwds)
+        try:
+            self.coarse_fitter.parallel_fit(pref_exclude=pref_exclude, **ckwds)
+
+            # Interpolated band positions, falling back to the averaged initialization where the coarse fitting failed
+            centers = np.stack([self.coarse_fitter.df_fit[pref + parname].values for pref in prefixes]).astype('float')
+            centers = centers.reshape(bands_coarse.shape)
+            invalid = ~np.isfinite(centers)
+            centers[invalid] = bands_coarse[invalid]
+            self.refined_inits = np.moveaxis(u.grid_unbin(np.moveaxis(centers, 0, -1), bins, grid_shape), -1, 0).reshape((nlp, -1))
+        finally:
+            self.coarse_fitter.close_pool()
+
+        # Fitting on the full grid with the refined initialization
+        band_inits2D = self.band_inits2D
+        self.band_inits2D = self.refined_inits
+        try:
+            kwds.setdefault('band_bounds', window)
+            self.parallel_fit(pref_exclude=pref_exclude, **kwds)
+        finally:
+            self.band_inits2D = band_inits2D
+
+        halfwidth = np.reshape(kwds['band_bounds'], (-1, 1)) * np.ones((nlp, 1))
+        self.pinned = self._pinned_spectra(prefixes, parname, halfwidth)
+        if widen and (self.pinned.size > 0):
+            rkwds = dict((key, val) for key, val in kwds.items() if key not in ('nfitter', 'checkpoint', 'resume', 'band_bounds'))
+            self._refit_spectra(self.pinned, halfwidth*widen, pref_exclude, **rkwds)
+            self.pinned = self._pinned_spectra(prefixes, parname, halfwidth*widen)
+
+        if ret:
+            return self.df_fit
+
+    def _pinned_spectra(self, prefixes, parname, halfwidth, rtol=0.01):
+        """ IDs of the spectra with band positions at the bounds around ``self.refined_inits`` (see ``self.hierarchical_fit()``).
+        """
+
+        fitted = self.df_fit.reindex(np.arange(self.refined_inits.shape[1]))
+        fitted = np.stack([fitted[pref + parname].values for pref in prefixes])
+        offsets = np.abs(fitted - self.refined_inits)
+        pinned = np.any(offsets >= halfwidth*(1 - rtol), axis=0)
+
+        return np.flatnonzero(pinned)
+
+    def _refit_spectra(self, spec_ids, halfwidth, pref_exclude, **kwds):
+        """ Refit the selected spectra with the band positions bounded around ``self.refined_inits``, replacing their outcomes in ``self.fitres``, ``self.collector`` and ``self.df_fit``.
+        """
+
+        yrefit = np.asarray(self.ydata2D[spec_ids, ...]).reshape((len(spec_ids), -1))
+        refitter = DistributedFitter(np.ravel(self.xvals), yrefit, drange=slice(None), model=self.model, lazy=True, nfitter=len(spec_ids))
+        refitter.set_inits(inits_dict=self.inits_persist, band_inits=self.refined_inits[:, spec_ids])
+        try:
+            refitter.parallel_fit(pref_exclude=pref_exclude, band_bounds=halfwidth[:, 0], **kwds)
+        finally:
+            refitter.close_pool()
+
+        position = dict((fres[1]['spec_id'], i) for i, fres in enumerate(self.fitres))
+        for fres in refitter.fitres:
+            n = int(spec_ids[fres[1]['spec_id']])
+            fres[1]['spec_id'] = n
+            self.collector.collect(fres[0], n)
+            if n in position:
+                self.fitres[position[n]] = fres
+            else:
+                self.fitres.append(fres)
+        self.df_fit = self.collector.to_dataframe()
+
+    def _task_args(self, n, include_vary, prefixes, varkeys, pref_exclude):
+        """ Arguments of the fitting task for the line spectrum with the ID ``n`` (see ``self._single_fit()``).
+        """
+
+        if self.lazy:
+            model, pars, yspec = self.model, self.pars[0], self.ydata2D[n, :]
+        else:
+            model, pars, yspec = self.models[n], self.pars[n], self.ydata2D[n, :]
+
+        try:
+            others = self.other_inits[..., n]
+        except:
+            others = None
+
+        return (model, pars, self.xvals, yspec, n, include_vary, prefixes, varkeys, others, pref_exclude)
+
     def _single_fit(self, model, pars, xvals, yspec, n, include_vary, prefixes, varkeys, others, pref_exclude, **kwds):
         """ Fit a single line spectrum with custom initializaton.
         """
-        
-        # Setting the initialization parameters that vary for every line spectrum
+
+        return fit_spectrum(model, pars, xvals, yspec, n, include_vary, prefixes, varkeys, others, self.plan, **kwds)
+
+    def _thread_pars(self, local):
+        """ Parameters of the current thread (created at the first use).
+        """
+
+        if not hasattr(local, 'pars'):
+            local.pars = self.model.make_params()
+
+        return local.pars
+
+    def _thread_fit(self, n, local, include_vary, prefixes, varkeys, **kwds):
+        """ Fit the line spectrum with the ID ``n`` in a thread (see the 'threads' backend of ``self.parallel_fit()``).
+        """
+
+        if self.lazy:
+            model, pars, yspec = self.model, self._thread_pars(local), self.ydata2D[n, :]
+        else: # Every spectrum has its own model and parameters
+            model, pars, yspec = self.models[n], self.pars[n], self.ydata2D[n, :]
+        others = self.other_inits[..., n] if include_vary else None
+
+        return fit_spectrum(model, pars, self.xvals, yspec, n, include_vary, prefixes, varkeys, others, self.plan, **kwds)
+
+    def _thread_batch_fit(self, spec_ids, local, include_vary, varkeys, ynorm=True, **kwds):
+        """ Fit a block of line spectra as one batched least-squares problem in a thread (see the 'threads' backend of ``self.parallel_fit()``).
+        """
+
+        pars = self.plan.apply(self._thread_pars(local))
+        inits_stack = {}
         if include_vary:
-            inits_vary = init_generator(parname='center', varkeys=varkeys, lpnames=prefixes, parvals=others)
-            inits_all = u.merge_nested_dict(self.inits_persist + inits_vary)
+            for row, col in zip(self.plan.rows, self.plan.cols):
+                inits_stack[self.plan.names[col]] = dict((vk, self.other_inits[row, j, spec_ids]) for j, vk in enumerate(varkeys))
+
+        bkwds = dict((k, kwds[k]) for k in ('max_iter', 'ftol', 'xtol', 'lambda_init') if k in kwds)
+        yblock = np.reshape(self.ydata2D[spec_ids, ...], (len(spec_ids), -1))
+        tstart = time.perf_counter()
+        bres = batch_fitting(self.xvals, yblock, self.model, params=pars, inits_stack=inits_stack, ynorm=ynorm, **bkwds)
+
+        if kwds.get('profile', False): # The time of the batched problem is shared evenly by its spectra
+            tfit = (time.perf_counter() - tstart) / len(spec_ids)
+            tdone = time.time()
+            return [(bres.compact(i), {'spec_id': n, 'timing': {'minimize': tfit, 'nfev': bres.niter[i], 't_done': tdone}})
+                    for i, n in enumerate(spec_ids)]
+
+        return [(bres.compact(i), {'spec_id': n}) for i, n in enumerate(spec_ids)]
+
+    def _distributed_fit(self, client, spec_ids, nspec, block_size, include_vary, prefixes, varkeys, fit_kwds):
+        """ Fit blocks of line spectra on a ``dask.distributed`` cluster, yields the outcomes as the blocks complete (see the 'distributed' backend of ``self.parallel_fit()``).
+        """
+
+        from dask import distributed as ddist
+
+        ydata = np.reshape(self.ydata2D, (self.ydata2D.shape[0], -1))[:nspec]
+        if block_size is None:
+            block_size = u.intnz(np.ceil(nspec / (4*len(client.scheduler_info()['workers']))))
+
+        # Model and initialization are shared by all tasks and sent to every worker once
+        model_f = client.scatter(self.model, broadcast=True)
+        plan_f = client.scatter(self.plan, broadcast=True)
+
+        todo = np.zeros(nspec, dtype='bool')
+        todo[spec_ids] = True
+        futures = []
+        for start in range(0, nspec, block_size):
+            stop = min(start + block_size, nspec)
+            ids = np.arange(start, stop)[todo[start:stop]]
+            if ids.size == 0:
+                continue
+            others = self.other_inits[..., start:stop] if include_vary else None
+            # The task runs where its data block is sent
+            yblock = client.scatter(ydata[start:stop])
+            futures.append(client.submit(_fit_block, yblock, start, ids.tolist(), model_f, plan_f, self.xvals, others,
+                                        include_vary, prefixes, varkeys, fit_kwds, pure=False))
+
+        for fut in ddist.as_completed(futures):
+            for fres in fut.result():
+                yield fres
+            fut.release()
+
+    def start_pool(self, num_workers=None, nspec=None, other_inits=None, include_vary=True, prefixes=None, varkeys=['value', 'vary'], fit_kwds={}, **kwds):
+        """ Start a persistent pool of fitting workers. Each worker receives the model, persistent initialization, energy coordinates and spectral data once at startup. A running pool is reused if the settings and the initialization are unchanged, and restarted otherwise.
+
+        **Parameters**\n
+        num_workers: int | None
+            Number of workers (``None`` uses the number of CPUs).
+        nspec: int | None
+            Number of spectra for fitting.
+        other_inits: numpy array | None
+            Spectrum-dependent initialization values, with the spectrum ID in the last dimension.
+        include_vary, prefixes, varkeys:
+            See ``pesfit.fitter.fit_spectrum()``.
+        fit_kwds: dict | {}
+            Keyword arguments for ``pesfit.fitter.pointwise_fitting()``.
+        **kwds: keyword arguments
+            Additional keyword arguments for ``multiprocessing.Pool``.
+        """
+
+        if nspec is None:
+            nspec = self.nfitter
+        if prefixes is None:
+            prefixes = self.prefixes
+
+        if other_inits is None:
+            inits_digest = None
         else:
-            inits_all = u.merge_nested_dict(self.inits_persist)
-        varsetter(pars, inits_all, ret=False)
-        
-        # Line fitting with all the initial guesses supplied
-        out_single = pointwise_fitting(xvals.ravel(), yspec.ravel(), model=model, params=pars, ynorm=True, **kwds)
-        out_extra = {'spec_id': n}
+            inits_digest = hashlib.sha1(np.ascontiguousarray(other_inits)).hexdigest()
+        pool_key = (num_workers, nspec, self._inits_version, include_vary, tuple(prefixes), tuple(varkeys),
+                    inits_digest, u.content_digest(fit_kwds, kwds))
+        if (self.pool is not None) and (pool_key == self._pool_key):
+            return
+
+        self.close_pool()
+        # Workers attach to the shared data instead of receiving copies
+        if self.shared is not None:
+            ydata2D = self.shared['ydata2D']
+            if other_inits is not None:
+                self._share('other_inits', other_inits)
+                other_inits = self.shared['other_inits']
+        else:
+            ydata2D = self.ydata2D[:nspec, ...]
+        initargs = (self.model, self.inits_persist, self.xvals, ydata2D, other_inits,
+                    include_vary, prefixes, varkeys, fit_kwds)
+        self.pool = mp.Pool(processes=num_workers, initializer=_init_worker, initargs=initargs, **kwds)
+        self._pool_key = pool_key
+        # Terminate the workers when the fitter is garbage-collected or at interpreter exit
+        self._pool_finalizer = weakref.finalize(self, self.pool.terminate)
+
+    def share_data(self, storage='shm', fdir=None):
+        """ Place the flattened spectral data (``self.ydata2D``) and band energy initialization (``self.band_inits2D``) in shared memory or memory-mapped files. The persistent workers (``backend='pool'`` in ``self.parallel_fit()``) then index into the shared storage without copying the data. The original spectral data (``self.ydata``) and the copies held by the constituent fitters are released, so the spectra are only kept in the shared storage.
+
+        **Parameters**\n
+        storage: str | 'shm'
+            Type of storage, 'shm' for shared memory and 'memmap' for memory-mapped files (see ``pesfit.utils.SharedArray``).
+        fdir: str | None
+            Directory for the memory-mapped files (uses temporary files if None).
+        """
 
-        return out_single, out_extra
+        self.unshare_data()
+        self.shared = {}
+        self._storage = (storage, fdir)
+        # Release the shared storage when the fitter is garbage-collected or at interpreter exit
+        self._shared_finalizer = weakref.finalize(self, _release_shared, self.shared)
+
+        self.ydata2D = self._share('ydata2D', self.ydata2D)
+        self.ydata = None
+        for fitter in self.fitters:
+            fitter.ydata, fitter.ydata2D = None, None
+        if getattr(self, 'band_inits2D', None) is not None:
+            self.band_inits2D = self._share('band_inits2D', self.band_inits2D)
+        self._inits_version += 1
+
+    def _share(self, name, arr):
+        """ Copy an array into the shared storage under the specified name, returns the shared array.
+        """
+
+        storage, fdir = self._storage
+        if name in self.shared:
+            self.shared.pop(name).close()
+        if fdir is None:
+            fpath = None
+        else:
+            fpath = os.path.join(fdir, '{}_{}.dat'.format(name, id(self)))
+        self.shared[name] = u.SharedArray(arr, storage=storage, fpath=fpath)
+
+        return self.shared[name].array
+
+    def unshare_data(self):
+        """ Move the shared data back into private memory and release the shared storage (``self.ydata`` is not restored).
+        """
+
+        if self.shared is not None:
+            self.close_pool()
+            self.ydata2D = np.array(self.ydata2D)
+            if getattr(self, 'band_inits2D', None) is not None:
+                self.band_inits2D = np.array(self.band_inits2D)
+            self._shared_finalizer()
+        self.shared = None
+
+    def close_pool(self):
+        """ Shut down the persistent pool of fitting workers.
+        """
+
+        if self.pool is not None:
+            self._pool_finalizer.detach()
+            self.pool.close()
+            self.pool.join()
+        self.pool = None
+        self._pool_key = None
 
     def save_data(self, fdir=r'./', fname='', ftype='h5', keyname='fitres', orient='dict', **kwds):
         """ Save the fitting outcome to a file.
@@ -797,6 +2438,273 @@ class DistributedFitter(object):
         else:
             raise NotImplementedError
 
+
+def _fit_requests(xdata, ydata, model, params, inits, engine, ynorm, fit_kwds):
+    """ Fit a micro-batch of line spectra submitted to ``pesfit.fitter.AsyncFitter``, returns a list of ``pesfit.fitter.CompactResult``.
+    """
+
+    if engine == 'batch':
+        # Stack the spectrum-dependent initialization, defaulting to the parameter template
+        inits_stack = {}
+        for i, init in enumerate(inits):
+            if init is None:
+                continue
+            for name, settings in flatten_inits(init):
+                stack = inits_stack.setdefault(name, {})
+                for key, val in settings.items():
+                    if key not in stack:
+                        stack[key] = np.full(len(inits), getattr(params[name], key), dtype='float')
+                    stack[key][i] = val
+        res = batch_fitting(xdata, ydata, model, params=params, inits_stack=inits_stack, ynorm=ynorm, **fit_kwds)
+
+        return [res.compact(i) for i in range(res.nspec)]
+
+    else:
+        return [CompactResult(pointwise_fitting(xdata, yspec, model=model, params=params.copy(), inits=init, ynorm=ynorm, **fit_kwds))
+                for yspec, init in zip(ydata, inits)]
+
+
+def _init_async_worker(xdata, model, params, ynorm, fit_kwds):
+    """ Initialize a worker of the 'pool' engine of ``pesfit.fitter.AsyncFitter`` with the settings shared by all micro-batches.
+    """
+
+    _worker_state.clear()
+    _worker_state.update(xdata=xdata, model=model, params=params, ynorm=ynorm, fit_kwds=fit_kwds)
+
+
+def _worker_fit_requests(ydata, inits):
+    """ Fit a micro-batch of line spectra using the state of a worker of ``pesfit.fitter.AsyncFitter``.
+    """
+
+    ws = _worker_state
+
+    return _fit_requests(ws['xdata'], ydata, ws['model'], ws['params'], inits, 'pool', ws['ynorm'], ws['fit_kwds'])
+
+
+class AsyncFitter(object):
+    """ Asynchronous fitting of line spectra arriving one at a time (e.g. from the binning during data acquisition). Spectra are submitted from an asyncio event loop and grouped into micro-batches, which are fitted outside of the event loop, either by the batched least-squares engine (see ``pesfit.fitter.batch_fitting()``) in a background thread or by ``pesfit.fitter.pointwise_fitting()`` in a process pool. The futures of the submitted spectra are resolved with instances of ``pesfit.fitter.CompactResult`` as the fits complete.
+
+    **Parameters**\n
+    xdata: 1D array
+        Energy coordinates shared by all line spectra.
+    model: instance of ``lmfit.model.Model`` or ``pesfit.lineshape.MultipeakModel`` | None
+        A lineshape model for the fitting task (None generates one with the ``peaks`` and ``background`` keywords, see ``pesfit.fitter.model_generator()``).
+    params: instance of ``lmfit.parameter.Parameters`` | None
+        Parameter template shared by all line spectra.
+    inits: dict/list | None
+        Initialization shared by all line spectra (format see ``pesfit.fitter.varsetter()``).
+    engine: str | 'batch'
+        Fitting engine for the micro-batches ('batch' or 'pool').
+    max_batch: int | 32
+        Maximum number of spectra in a micro-batch.
+    max_delay: numeric | 0.01
+        Time (in seconds) to wait for more spectra to fill a micro-batch after the first one arrived.
+    max_pending: int | 256
+        Maximum number of queued spectra, beyond which the submission waits (backpressure).
+    num_workers: int | ``multiprocessing.cpu_count()``
+        Number of processes for the 'pool' engine, which is also the number of micro-batches fitted concurrently.
+    ynorm: bool | True
+        Option to normalize each trace by its maximum before fitting.
+    modelkwds: dict | {}
+        Keyword arguments for the model generation.
+    **kwds: keyword arguments
+        peaks, background: dict, str | {'Voigt':2}, 'None'
+            Model specification (see ``pesfit.fitter.model_generator()``).
+        additional arguments:
+            See ``pesfit.fitter.batch_fitting()`` ('batch' engine) or ``pesfit.fitter.pointwise_fitting()`` ('pool' engine).
+    """
+
+    def __init__(self, xdata, model=None, params=None, inits=None, engine='batch', max_batch=32, max_delay=0.01, max_pending=256, num_workers=None, ynorm=True, modelkwds={}, **kwds):
+
+        self.xdata = np.ravel(xdata)
+        peaks = kwds.pop('peaks', {'Voigt':2})
+        background = kwds.pop('background', 'None')
+        if model is None:
+            model = model_generator(peaks=peaks, background=background, **modelkwds)
+        self.model = model
+
+        if params is None:
+            self.pars = self.model.make_params()
+        else:
+            self.pars = params.copy()
+        if inits is not None:
+            varsetter(self.pars, inits, ret=False)
+
+        if engine not in ('batch', 'pool'):
+            raise ValueError("The fitting engine should be either 'batch' or 'pool'.")
+        elif engine == 'batch':
+            # Fail early for models unsupported by the batched engine
+            StackedModel(self.model, self.pars)
+        self.engine = engine
+
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.num_workers = num_workers or mp.cpu_count()
+        self.ynorm = ynorm
+        self.fit_kwds = kwds
+
+        self.queue = None
+        self.nbatches = 0
+        self._batcher = None
+        self._getter = None
+        self._executor = None
+        self._inflight = set()
+
+    @property
+    def pending(self):
+        """ Number of queued line spectra.
+        """
+
+        return 0 if self.queue is None else self.queue.qsize()
+
+    async def start(self):
+        """ Start the micro-batching loop and the executor of the fitting engine (called on the first submission otherwise).
+        """
+
+        if self._batcher is not None:
+            return
+
+        self.queue = asyncio.Queue(maxsize=self.max_pending)
+        if self.engine == 'pool':
+            self._executor = ccf.ProcessPoolExecutor(max_workers=self.num_workers, initializer=_init_async_worker,
+                                initargs=(self.xdata, self.model, self.pars, self.ynorm, self.fit_kwds))
+            self._slots = asyncio.Semaphore(self.num_workers)
+        else:
+            self._executor = ccf.ThreadPoolExecutor(max_workers=1)
+            self._slots = asyncio.Semaphore(1)
+        self._batcher = asyncio.ensure_future(self._batch_loop())
+
+    async def submit(self, yspec, inits=None):
+        """ Queue a line spectrum for fitting, waiting while the queue is full.
+
+        **Parameters**\n
+        yspec: 1D array
+            Line spectrum.
+        inits: dict/list | None
+            Spectrum-dependent initialization (format see ``pesfit.fitter.varsetter()``). The 'batch' engine only supports the 'value', 'min' and 'max' keys here, the varying parameters are set by the shared initialization.
+
+        **Return**\n
+        future: instance of ``asyncio.Future``
+            Future resolved with the fitting outcome.
+        """
+
+        if (inits is not None) and (self.engine == 'batch'):
+            if any('vary' in settings for _, settings in flatten_inits(inits)):
+                raise ValueError("The 'batch' engine does not support spectrum-dependent 'vary' settings.")
+        if self._batcher is None:
+            await self.start()
+
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((np.ravel(yspec), inits, fut))
+
+        return fut
+
+    async def fit(self, yspec, inits=None):
+        """ Fit a line spectrum and wait for the outcome (see ``self.submit()`` for the arguments).
+        """
+
+        fut = await self.submit(yspec, inits)
+
+        return await fut
+
+    async def close(self):
+        """ Fit the remaining queued spectra, then stop the micro-batching loop and the executor.
+        """
+
+        if self._batcher is None:
+            return
+
+        await self.queue.put(None)
+        await self._batcher
+        if self._inflight:
+            await asyncio.wait(self._inflight)
+        self._executor.shutdown(wait=True)
+        self._batcher = None
+        self._executor = None
+
+    async def __aenter__(self):
+
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+
+        await self.close()
+
+    async def _next_item(self, timeout=None):
+        """ Retrieve the next queued item, returns a (received, item) pair. The pending retrieval is kept across timeouts so that no item is lost.
+        """
+
+        if self._getter is None:
+            self._getter = asyncio.ensure_future(self.queue.get())
+        done, _ = await asyncio.wait({self._getter}, timeout=timeout)
+        if not done:
+            return False, None
+
+        item = self._getter.result()
+        self._getter = None
+
+        return True, item
+
+    async def _batch_loop(self):
+        """ Group the queued spectra into micro-batches and dispatch them to the fitting engine.
+        """
+
+        loop = asyncio.get_running_loop()
+        closing = False
+
+        while not closing:
+            _, item = await self._next_item()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                received, item = await self._next_item(timeout=max(deadline - loop.time(), 0))
+                if not received:
+                    break
+                elif item is None:
+                    closing = True
+                    break
+                batch.append(item)
+
+            # Requests cancelled while in the queue are not fitted
+            batch = [req for req in batch if not req[2].cancelled()]
+            if batch:
+                await self._slots.acquire()
+                task = asyncio.ensure_future(self._run_batch(batch))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+
+    async def _run_batch(self, batch):
+        """ Fit a micro-batch in the executor and resolve the futures of its spectra.
+        """
+
+        loop = asyncio.get_running_loop()
+        inits = [req[1] for req in batch]
+
+        try:
+            ydata = np.stack([req[0] for req in batch])
+            if self.engine == 'pool':
+                results = await loop.run_in_executor(self._executor, _worker_fit_requests, ydata, inits)
+            else:
+                results = await loop.run_in_executor(self._executor, _fit_requests, self.xdata, ydata, self.model,
+                                        self.pars, inits, 'batch', self.ynorm, self.fit_kwds)
+        except Exception as err:
+            for req in batch:
+                if not req[2].done():
+                    req[2].set_exception(err)
+        else:
+            for req, res in zip(batch, results):
+                if not req[2].done():
+                    req[2].set_result(res)
+        finally:
+            self.nbatches += 1
+            self._slots.release()
+
+
 if __name__ == '__main__':
     pass
 
@@ -965,7 +2873,7 @@ def plot_fit_result(fitres, x, plot_components=True, downsamp=1, flatten=False,
     fitres: instance of ``lmfit.model.ModelResult``
         Fitting result from the `lmfit` routine.
     x: numpy array
-        Horizontal-axis values of the lineshape model.
+        Horizontal-axis values of the lineshape model (the energy coordinates of the fitting are used for results of the fitting within an energy window).
     plot_components: bool | True
         Option to plot components of the multipeak lineshape.
     downsamp: int | 1
@@ -986,6 +2894,13 @@ def plot_fit_result(fitres, x, plot_components=True, downsamp=1, flatten=False,
         lfs: numeric | 15
             Font size of the axis labels.
     """
+
+    if isinstance(fitres, CompactResult):
+        raise TypeError('Compact results retain no data or model for plotting, keep the full fitting result '
+                        'of the spectrum with the keep_full keyword argument (or fit with compact=False).')
+    # Results of the fitting within an energy window (see ``crop`` in ``pointwise_fitting()``) are plotted over the window
+    if np.size(fitres.best_fit) != np.size(x):
+        x = np.ravel(fitres.userkws[fitres.model.independent_vars[0]])
     
     figsz = kwds.pop('figsize', (8, 5))
     
@@ -2,6 +2,9 @@
 # -*- coding: utf-8 -*-
 
 import multiprocessing.pool as mpp
+import time, queue, sys
+from collections import deque
+from . import utils as u
 
 def istarmap(self, func, iterable, chunksize=1):
     """ Starmap-version of imap. The code is adapted from
@@ -17,7 +20,8 @@ def istarmap(self, func, iterable, chunksize=1):
                 chunksize))
 
     task_batches = mpp.Pool._get_tasks(func, iterable, chunksize)
-    result = mpp.IMapIterator(self._cache)
+    # The iterator is constructed from the pool since Python 3.8
+    result = mpp.IMapIterator(self if sys.version_info >= (3, 8) else self._cache)
     self._taskqueue.put(
         (
             self._guarded_task_generation(result._job,
@@ -27,4 +31,49 @@ def istarmap(self, func, iterable, chunksize=1):
         ))
     return (item for chunk in result for item in chunk)
 
-mpp.Pool.istarmap = istarmap
\ No newline at end of file
+
+def _timed_starmap(func, argslist):
+    """ Apply a function to a chunk of argument tuples, returns the outcomes and the elapsed time.
+    """
+
+    tstart = time.perf_counter()
+    out = [func(*args) for args in argslist]
+
+    return out, time.perf_counter() - tstart
+
+
+def adaptive_starmap(self, func, iterable, scheduler=None, max_inflight=None):
+    """ Starmap-version of imap with chunk sizes adapted to the measured task duration (see ``pesfit.utils.GuidedScheduler``). Chunks are handed out whenever a worker becomes available, so the outcomes are yielded in the order of completion.
+    """
+
+    if self._state != mpp.RUN:
+        raise ValueError("Pool not running")
+
+    nworkers = self._processes
+    if scheduler is None:
+        scheduler = u.GuidedScheduler(nworkers)
+    if max_inflight is None:
+        max_inflight = 2*nworkers # Keeps every worker supplied with the next chunk
+
+    pending = deque(iterable)
+    completed = queue.Queue()
+    inflight = 0
+
+    while pending or inflight:
+        while pending and (inflight < max_inflight):
+            size = min(scheduler.next_size(len(pending)), len(pending))
+            chunk = [pending.popleft() for _ in range(size)]
+            self.apply_async(_timed_starmap, (func, chunk), callback=completed.put, error_callback=completed.put)
+            inflight += 1
+
+        res = completed.get()
+        inflight -= 1
+        if isinstance(res, BaseException):
+            raise res
+        out, elapsed = res
+        scheduler.update(len(out), elapsed)
+        for item in out:
+            yield item
+
+mpp.Pool.istarmap = istarmap
+mpp.Pool.adaptive_starmap = adaptive_starmap
@@ -0,0 +1,808 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from lmfit.lineshapes import voigt, gaussian
+from pesfit import fitter
+
+
+def synthetic_patch(nrow=2, ncol=2, seed=0):
+    """ Two dispersive Voigt bands on a linear background.
+    """
+
+    rng = np.random.default_rng(seed)
+    x = np.linspace(-6, 0, 300)
+    kx, ky = np.meshgrid(np.linspace(-1, 1, ncol), np.linspace(-1, 1, nrow))
+    c1, c2 = -3.5 + 0.4*kx**2, -1.5 - 0.3*ky**2
+    y = voigt(x[None,None,:], 1, c1[...,None], 0.3) + 0.8*voigt(x[None,None,:], 1, c2[...,None], 0.3)
+    y += 0.02 + 0.005*(x + 6) + 0.005*rng.standard_normal(y.shape)
+    binit = np.stack([c1 + 0.1, c2 - 0.1])
+
+    return x, y, np.stack([c1, c2]), binit
+
+
+def band_inits(nband=2):
+
+    pref = ['lp{}_'.format(i+1) for i in range(nband)]
+    return fitter.init_generator(lpnames=pref, parname='sigma', varkeys=['value', 'min', 'max', 'vary'], parvals=[[0.3, 0.05, 1, True]]*nband) + \
+        fitter.init_generator(lpnames=pref, parname='amplitude', varkeys=['value', 'min', 'max', 'vary'], parvals=[[1, 0, 10, True]]*nband)
+
+
+def test_initplan_rows_skip_background():
+
+    model = fitter.model_generator(peaks={'Voigt':2}, background='Linear')
+    pars = model.make_params()
+    assert model.prefixes[0] == 'bg_'
+    plan = fitter.InitPlan(pars, prefixes=model.prefixes, varkeys=['value', 'vary'])
+    plan.apply(pars, others=np.array([[-3.2, True], [-1.7, True]]))
+
+    assert pars['lp1_center'].value == -3.2
+    assert pars['lp2_center'].value == -1.7
+
+
+@pytest.mark.parametrize('backend', ['singles', 'pool'])
+def test_parallel_fit_with_background(backend):
+
+    x, y, centers, binit = synthetic_patch()
+    dfit = fitter.DistributedFitter(x, y, nfitter=4, lazy=True, peaks={'Voigt':2}, background='Linear')
+    dfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+    try:
+        dfit.parallel_fit(backend=backend, num_workers=1, compact=True)
+    finally:
+        dfit.close_pool()
+
+    for i in range(2):
+        assert np.allclose(dfit.df_fit['lp{}_center'.format(i+1)].values, centers[i].ravel(), atol=0.02)
+
+
+@pytest.mark.parametrize('backend', ['multiprocessing', 'pool'])
+def test_lazy_and_eager_fitters_agree(backend):
+
+    x, y, centers, binit = synthetic_patch()
+    modelkwds = {'convolve':'gaussian', 'conv_span':0.2}
+    outcomes = []
+    for lazy in [False, True]:
+        dfit = fitter.DistributedFitter(x, y, nfitter=4, lazy=lazy, peaks={'Voigt':2}, background='Linear', modelkwds=modelkwds)
+        for model in dfit.models:
+            assert (model.instrument is not None) and (model.conv_span == 0.2)
+        dfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+        try:
+            dfit.parallel_fit(backend=backend, num_workers=2, compact=True)
+        finally:
+            dfit.close_pool()
+        outcomes.append(dfit.df_fit)
+
+    assert 'ins_sigma' in outcomes[1].columns
+    assert list(outcomes[0].columns) == list(outcomes[1].columns)
+    assert np.allclose(outcomes[0].values, outcomes[1].values)
+
+    # A supplied model is used in both modes
+    for lazy in [False, True]:
+        dfit = fitter.DistributedFitter(x, y, nfitter=4, lazy=lazy, model=model)
+        assert all(m is model for m in dfit.models)
+
+
+def test_sequential_fit_multistart_seed():
+
+    x, y, centers, binit = synthetic_patch(seed=1)
+    outcomes = []
+    for _ in range(2):
+        kfit = fitter.PatchFitter(peaks={'Voigt':2}, xdata=x, ydata=y)
+        kfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+        kfit.sequential_fit(jitter_init='multistart', jitter_seed=0, shifts=[-0.1, 0.1, 0.2], nstarts=2, thresh=-1, compact=True)
+        outcomes.append(kfit.df_fit[['lp1_center', 'lp2_center']].values)
+
+    assert np.array_equal(outcomes[0], outcomes[1])
+    assert np.allclose(outcomes[0].T, centers.reshape((2, -1)), atol=0.05)
+
+
+def test_warm_start_sequential_fit():
+
+    x, y, centers, binit = synthetic_patch(nrow=4, ncol=4)
+    binit += np.array([0.1, -0.1])[:, None, None] # Cold initialization further from the band positions
+    outcomes = []
+    for warm_start in [False, True]:
+        pfit = fitter.PatchFitter(x, y, peaks={'Voigt':2}, background='Linear')
+        pfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+        pfit.sequential_fit(warm_start=warm_start, order='hilbert')
+        outcomes.append((pfit.df_fit, sum(fres.nfev for fres in pfit.fitres)))
+
+    (cold, cold_nfev), (warm, warm_nfev) = outcomes
+    assert np.allclose(warm.values, cold.values, atol=1e-6)
+    assert warm_nfev <= cold_nfev
+
+
+def test_warm_start_pool_tiles():
+
+    x, y, centers, binit = synthetic_patch(nrow=5, ncol=5)
+    dfit = fitter.DistributedFitter(x, y, nfitter=25, lazy=True, peaks={'Voigt':2}, background='Linear')
+    dfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+    try:
+        dfit.parallel_fit(backend='pool', num_workers=2, warm_start=True, tile_shape=(2, 3), compact=True)
+    finally:
+        dfit.close_pool()
+
+    assert sorted(fres[1]['spec_id'] for fres in dfit.fitres) == list(range(25))
+    for i in range(2):
+        assert np.allclose(dfit.df_fit['lp{}_center'.format(i+1)].values, centers[i].ravel(), atol=0.02)
+
+
+def test_profiled_fits():
+
+    x, y, centers, binit = synthetic_patch(nrow=2, ncol=3)
+    pfit = fitter.PatchFitter(x, y, peaks={'Voigt':2})
+    pfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+    pfit.sequential_fit(profile=True, compact=True)
+    dfit = fitter.DistributedFitter(x, y, nfitter=6, lazy=True, peaks={'Voigt':2})
+    dfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+    try:
+        dfit.parallel_fit(backend='pool', num_workers=2, profile=True, compact=True)
+    finally:
+        dfit.close_pool()
+
+    for profiler, extra in [(pfit.profiler, set()), (dfit.profiler, {'ipc'})]:
+        report = profiler.report()
+        assert {'init', 'model', 'minimize', 'collect'} | extra <= set(report['phases'])
+        assert report['wall'] > 0
+        nfev = profiler.nfev_series()
+        assert list(nfev.index) == list(range(6))
+        assert np.all(nfev.values > 0)
+        assert report['nfev']['nspec'] == 6
+
+
+def test_cached_models_own_kernel_caches():
+
+    fitter.clear_model_cache()
+    first = fitter.model_generator(peaks={'Voigt':2}, convolve='gaussian')
+    second = fitter.model_generator(peaks={'Voigt':2}, convolve='gaussian')
+    assert first._kernel_cache is not second._kernel_cache
+
+    x = np.linspace(-6, 0, 300)
+    pars = first.make_params()
+    first.eval(pars, x=x)
+    assert len(first._kernel_cache) == 1
+    assert len(second._kernel_cache) == 0
+
+
+def test_cached_models_own_components():
+
+    fitter.clear_model_cache()
+    first = fitter.model_generator(peaks={'Voigt':2}, background='Linear', fermi=True)
+    first.components[1].set_param_hint('sigma', value=0.7)
+    first.fermi.set_param_hint('kt', value=0.1)
+    second = fitter.model_generator(peaks={'Voigt':2}, background='Linear', fermi=True)
+
+    assert second.components[1] is not first.components[1]
+    assert second.components[1].param_hints.get('sigma', {}).get('value', None) != 0.7
+    assert second.fermi.param_hints['kt']['value'] == 0.025
+    grouped = [comp for _, comps in second.batch_groups for comp in comps]
+    assert not any(comp is fcomp for comp in grouped for fcomp in first.components)
+
+
+def test_convolution_in_threads():
+
+    import concurrent.futures as ccf
+
+    model = fitter.model_generator(peaks={'Voigt':2}, convolve='gaussian', cache=False)
+    x = np.linspace(-6, 0, 300)
+    sigmas = np.linspace(0.01, 0.2, 64)
+
+    def evaluate(sigma):
+        pars = model.make_params()
+        pars['ins_sigma'].set(value=sigma, vary=True)
+        return model.eval(pars, x=x)
+
+    with ccf.ThreadPoolExecutor(max_workers=8) as executor:
+        threaded = list(executor.map(evaluate, np.tile(sigmas, 4)))
+    expected = [evaluate(sigma) for sigma in sigmas]
+
+    for i, values in enumerate(threaded):
+        assert np.allclose(values, expected[i % sigmas.size])
+
+
+def test_hierarchical_fit_with_background():
+
+    x, y, centers, binit = synthetic_patch(nrow=4, ncol=4)
+    dfit = fitter.DistributedFitter(x, y, nfitter=16, lazy=True, peaks={'Voigt':2}, background='Linear')
+    dfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+    dfit.hierarchical_fit(bins=2, window=0.2, backend='singles', compact=True)
+
+    assert dfit.refined_inits.shape == (2, 16)
+    for i in range(2):
+        assert np.allclose(dfit.df_fit['lp{}_center'.format(i+1)].values, centers[i].ravel(), atol=0.02)
+
+
+def test_hierarchical_fit_closes_coarse_pool():
+
+    x, y, centers, binit = synthetic_patch(nrow=4, ncol=4)
+    dfit = fitter.DistributedFitter(x, y, nfitter=16, lazy=True, peaks={'Voigt':2})
+    dfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+    try:
+        dfit.hierarchical_fit(bins=2, window=0.2, backend='pool', num_workers=1, compact=True)
+    finally:
+        dfit.close_pool()
+
+    assert dfit.coarse_fitter.pool is None
+    assert np.allclose(dfit.df_fit['lp1_center'].values, centers[0].ravel(), atol=0.02)
+
+
+def test_hierarchical_fit_refits_pinned_spectra():
+
+    x, y, centers, binit = synthetic_patch(nrow=6, ncol=6)
+    truth = centers.reshape((2, -1))
+    outcomes = {}
+    for widen in (None, 3):
+        dfit = fitter.DistributedFitter(x, y, nfitter=36, lazy=True, peaks={'Voigt':2})
+        dfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+        dfit.hierarchical_fit(bins=3, window=0.1, backend='singles', compact=True, widen=widen)
+        fitted = np.stack([dfit.df_fit['lp1_center'].values, dfit.df_fit['lp2_center'].values])
+        outcomes[widen] = (dfit.pinned, np.abs(fitted - truth).max(), len(dfit.fitres))
+
+    assert outcomes[None][0].size > 0
+    assert outcomes[3][0].size == 0
+    assert outcomes[3][1] < 0.02
+    assert outcomes[3][2] == 36
+
+
+def batch_spectra(nspec=6, seed=2):
+    """ Two Gaussian bands on a linear background with spectrum-dependent positions.
+    """
+
+    rng = np.random.default_rng(seed)
+    x = np.linspace(-4, 0, 200)
+    c1, c2 = np.linspace(-3, -2.6, nspec), np.linspace(-1.4, -1.0, nspec)
+    y = gaussian(x, 1, c1[:,None], 0.25) + gaussian(x, 0.7, c2[:,None], 0.2) + 0.05 + 0.01*x
+    y += 0.003*rng.standard_normal(y.shape)
+
+    return x, y, np.stack([c1, c2])
+
+
+def gaussian_model():
+
+    model = fitter.model_generator(peaks={'Gaussian':2}, background='Linear', cache=False)
+    pars = model.make_params()
+    for i, (center, sigma, amplitude) in enumerate([(-2.8, 0.3, 1), (-1.2, 0.3, 0.5)]):
+        pars['lp{}_center'.format(i+1)].set(value=center)
+        pars['lp{}_sigma'.format(i+1)].set(value=sigma, min=0.01, max=2)
+        pars['lp{}_amplitude'.format(i+1)].set(value=amplitude, min=0)
+    pars['bg_slope'].set(value=0)
+    pars['bg_intercept'].set(value=0)
+
+    return model, pars
+
+
+def test_batch_fitting_matches_lmfit():
+
+    x, y, centers = batch_spectra()
+    model, pars = gaussian_model()
+    inits_stack = {'lp1_center': {'value': centers[0] + 0.1}, 'lp2_center': {'value': centers[1] - 0.1}}
+    bres = fitter.batch_fitting(x, y, model, params=pars, inits_stack=inits_stack, ynorm=False)
+
+    assert bres.nspec == y.shape[0]
+    assert bres.success.all()
+    for i in range(bres.nspec):
+        ipars = pars.copy()
+        ipars['lp1_center'].set(value=centers[0, i] + 0.1)
+        ipars['lp2_center'].set(value=centers[1, i] - 0.1)
+        ref = model.fit(y[i], ipars, x=x)
+        batch = bres.compact(i).best_values
+        for name in bres.names:
+            assert np.isclose(batch[name], ref.params[name].value, rtol=1e-4, atol=1e-5), name
+        assert np.isclose(bres.chisqr[i], ref.chisqr, rtol=1e-4)
+
+
+def test_batch_fitting_bounds():
+
+    x, y, centers = batch_spectra()
+    model, pars = gaussian_model()
+    upper = centers[0] - 0.1 # Excludes the true band positions
+    inits_stack = {'lp1_center': {'value': centers[0] - 0.2, 'min': centers[0] - 0.5, 'max': upper},
+                   'lp2_center': {'value': centers[1]}}
+    bres = fitter.batch_fitting(x, y, model, params=pars, inits_stack=inits_stack, ynorm=False)
+
+    fitted = bres.values[:, bres.names.index('lp1_center')]
+    assert np.all(fitted <= upper + 1e-12)
+    assert np.allclose(fitted, upper)
+    assert np.allclose(bres.values[:, bres.names.index('lp2_center')], centers[1], atol=0.01)
+
+
+def test_batch_fitting_aliased_parameters():
+
+    x, y, centers = batch_spectra()
+    model, pars = gaussian_model()
+    pars['lp2_sigma'].set(expr='lp1_sigma')
+    inits_stack = {'lp1_center': {'value': centers[0]}, 'lp2_center': {'value': centers[1]}}
+    bres = fitter.batch_fitting(x, y, model, params=pars, inits_stack=inits_stack, ynorm=False)
+
+    assert 'lp2_sigma' in bres.names
+    sig1, sig2 = bres.values[:, bres.names.index('lp1_sigma')], bres.values[:, bres.names.index('lp2_sigma')]
+    assert np.array_equal(sig1, sig2)
+    ipars = pars.copy()
+    ipars['lp1_center'].set(value=centers[0, 0])
+    ipars['lp2_center'].set(value=centers[1, 0])
+    ref = model.fit(y[0], ipars, x=x)
+    assert np.isclose(sig1[0], ref.params['lp1_sigma'].value, rtol=1e-4)
+
+
+def test_batch_fitting_converges_on_accepted_steps(monkeypatch):
+
+    x, y, centers = batch_spectra()
+    model, pars = gaussian_model()
+    inits_stack = {'lp1_center': {'value': centers[0] + 0.1}, 'lp2_center': {'value': centers[1] - 0.1}}
+    kwds = dict(params=pars, inits_stack=inits_stack, ynorm=False, lambda_init=100, xtol=0.05)
+    start = fitter.batch_fitting(x, y, model, max_iter=0, **kwds)
+
+    # An uphill first step is small enough to pass the parameter tolerance but has to be rejected
+    jacobian, calls = fitter.StackedModel.jacobian, []
+    def flipped(self, pvals, x):
+        calls.append(1)
+        return -jacobian(self, pvals, x) if len(calls) == 1 else jacobian(self, pvals, x)
+    monkeypatch.setattr(fitter.StackedModel, 'jacobian', flipped)
+    bres = fitter.batch_fitting(x, y, model, **kwds)
+
+    assert bres.success.all()
+    assert np.all(bres.niter > 1)
+    assert np.all(bres.chisqr < start.chisqr)
+
+
+def test_batch_fitting_rejects_inconsistent_settings():
+
+    x, y, centers = batch_spectra()
+    model, pars = gaussian_model()
+    vary = np.ones(y.shape[0], dtype='bool')
+    vary[0] = False
+    with pytest.raises(ValueError):
+        fitter.batch_fitting(x, y, model, params=pars, inits_stack={'lp1_center': {'vary': vary}})
+
+    pars['lp2_sigma'].set(expr='2*lp1_sigma')
+    with pytest.raises(NotImplementedError):
+        fitter.batch_fitting(x, y, model, params=pars)
+
+
+def test_pool_restarts_on_changed_array_settings():
+
+    x, y, centers, binit = synthetic_patch()
+    dfit = fitter.DistributedFitter(x, y, nfitter=4, lazy=True)
+    dfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+    shifts = np.linspace(-0.5, 0.5, 2001) # Long enough to be truncated by repr()
+    try:
+        dfit.start_pool(1, fit_kwds={'shifts': shifts})
+        pool = dfit.pool
+        dfit.start_pool(1, fit_kwds={'shifts': shifts.copy()})
+        assert dfit.pool is pool
+
+        changed = shifts.copy()
+        changed[1000] += 0.01
+        dfit.start_pool(1, fit_kwds={'shifts': changed})
+        assert dfit.pool is not pool
+    finally:
+        dfit.close_pool()
+
+
+def test_shared_data_released_in_eager_mode():
+
+    from multiprocessing import shared_memory
+
+    x, y, centers, binit = synthetic_patch()
+    dfit = fitter.DistributedFitter(x, y, nfitter=4, peaks={'Voigt':2})
+    dfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+    dfit.share_data()
+    assert dfit.ydata is None
+    assert all(ft.ydata2D is None for ft in dfit.fitters)
+
+    names = [sarr.name for sarr in dfit.shared.values()]
+    dfit.set_inits(inits_dict=band_inits(), band_inits=binit) # Replaces the shared initialization
+    try:
+        dfit.parallel_fit(backend='pool', num_workers=1, compact=True)
+    finally:
+        dfit.unshare_data()
+
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+    assert np.allclose(dfit.df_fit['lp1_center'].values, centers[0].ravel(), atol=0.02)
+
+
+def test_view_requires_full_results():
+
+    import matplotlib
+    matplotlib.use('Agg')
+
+    x, y, centers, binit = synthetic_patch(nrow=1)
+    kfit = fitter.PatchFitter(peaks={'Voigt':2}, xdata=x, ydata=y)
+    kfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+    kfit.sequential_fit(compact=True, keep_full=[1])
+
+    with pytest.raises(TypeError, match='keep_full'):
+        kfit.view(fid=0)
+    kfit.view(fid=1)
+
+
+@pytest.mark.parametrize('jitter_init', [True, 'multistart'])
+def test_pointwise_fitting_forwards_method(jitter_init):
+
+    x, y, centers, binit = synthetic_patch(nrow=1, ncol=1)
+    model = fitter.model_generator(peaks={'Voigt':2})
+    pars = model.make_params()
+    fitter.varsetter(pars, band_inits())
+    fitter.varsetter(pars, {'lp1_center':{'value':-3.3}, 'lp2_center':{'value':-1.7}})
+
+    fres = fitter.pointwise_fitting(x, y[0,0], model=model, params=pars, method='powell', jitter_init=jitter_init,
+                                    shifts=[0.1, -0.1], thresh=-1, verbose=False)
+
+    assert fres.method.lower() == 'powell'
+    assert np.allclose([fres.params['lp1_center'].value, fres.params['lp2_center'].value], centers.ravel(), atol=0.05)
+
+
+def test_multistart_engines(monkeypatch):
+
+    x, y, centers, binit = synthetic_patch(nrow=1, ncol=1)
+    model = fitter.model_generator(peaks={'Voigt':2})
+    pars = model.make_params()
+    fitter.varsetter(pars, band_inits())
+    fitter.varsetter(pars, {'lp1_center':{'value':-3.3}, 'lp2_center':{'value':-1.7}})
+    fres = model.fit(y[0,0], pars, x=x)
+
+    with pytest.raises(ValueError, match="'threads'"):
+        fitter.multistart_varshift(fres, model, pars, shifts=[0.1], yvals=y[0,0], xvals=x, engine='processes')
+
+    # The batched engine runs without a pool of threads
+    def no_threads(*args, **kwargs):
+        raise AssertionError('The batch engine should not start threads.')
+    monkeypatch.setattr(fitter.ccf, 'ThreadPoolExecutor', no_threads)
+    best = fitter.multistart_varshift(fres, model, pars, shifts=[0.1, -0.1], yvals=y[0,0], xvals=x, thresh=-1, engine='batch')
+    assert best.chisqr <= fres.chisqr
+
+
+def test_pointwise_fitting_jacobian_needs_additive_model():
+
+    import operator
+    from lmfit.models import GaussianModel
+    from pesfit import lineshape as ls
+
+    x = np.linspace(-3, 3, 201)
+    model = ls.MultipeakModel(lineshape=GaussianModel, n=2, op=operator.mul)
+    truth = model.make_params()
+    for name, val in [('lp1_center', -0.3), ('lp2_center', 0.4), ('lp1_sigma', 1), ('lp2_sigma', 1.5), ('lp1_amplitude', 2), ('lp2_amplitude', 2)]:
+        truth[name].set(value=val)
+    y = model.eval(truth, x=x)
+    with pytest.raises(ValueError):
+        model.jacobian(truth, x=x)
+
+    pars = truth.copy()
+    pars['lp1_center'].set(value=-0.2)
+    with pytest.warns(UserWarning, match='finite differences'):
+        fres = fitter.pointwise_fitting(x, y, model=model, params=pars, jacobian=True, ynorm=False)
+    assert fres.success
+    assert np.allclose(fres.best_fit, y, atol=1e-6)
+
+
+@pytest.mark.parametrize('onespec', [False, True])
+def test_stream_fit_matches_sequential_fit(tmp_path, onespec):
+
+    import h5py
+    import pandas as pd
+
+    x, y, centers, binit = synthetic_patch()
+    if onespec:
+        y, binit = y[0,0], binit[:,0,0]
+    with h5py.File(tmp_path / 'data.h5', 'w') as f:
+        f.create_dataset('spectra', data=y)
+
+    kfit = fitter.PatchFitter(peaks={'Voigt':2}, xdata=x, ydata=y)
+    kfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+    kfit.sequential_fit(compact=True)
+
+    sfit = fitter.PatchFitter(peaks={'Voigt':2}, xdata=x)
+    sfit.set_inits(inits_dict=band_inits(), xdata=x, band_inits=binit)
+    sfit.stream_fit(str(tmp_path / 'data.h5'), 'spectra', str(tmp_path / 'out.h5'), chunksize=3, compact=True)
+    df = pd.read_hdf(tmp_path / 'out.h5', key='fitres')
+
+    assert np.array_equal(df['spec_id'].values, np.arange(kfit.nspec))
+    assert np.allclose(df[['lp1_center', 'lp2_center']].values, kfit.df_fit[['lp1_center', 'lp2_center']].values)
+
+
+def test_stream_fit_other_initvals(tmp_path):
+
+    import h5py
+    import pandas as pd
+
+    x, y, centers, binit = synthetic_patch()
+    with h5py.File(tmp_path / 'data.h5', 'w') as f:
+        f.create_dataset('spectra', data=y)
+    sfit = fitter.PatchFitter(peaks={'Voigt':2}, xdata=x)
+    sfit.set_inits(inits_dict=band_inits(), xdata=x, band_inits=binit)
+    stream = lambda name, **kwds: sfit.stream_fit(str(tmp_path / 'data.h5'), 'spectra', str(tmp_path / name), chunksize=3, compact=True, **kwds)
+
+    # Shared and spectrum-dependent values of the keys besides 'value' give the same outcome
+    varkeys = ['value', 'min', 'max']
+    binit2D = binit.reshape((2, -1))
+    per_spec = np.stack((binit2D, binit2D - 0.5, binit2D + 0.5), axis=1)
+    stream('shared.h5', varkeys=varkeys, other_initvals=[-6, 0])
+    stream('per_spec.h5', varkeys=varkeys, other_initvals=per_spec)
+    shared, local = pd.read_hdf(tmp_path / 'shared.h5', key='fitres'), pd.read_hdf(tmp_path / 'per_spec.h5', key='fitres')
+    for i in range(2):
+        name = 'lp{}_center'.format(i+1)
+        assert np.allclose(shared[name].values, centers[i].ravel(), atol=0.02)
+        assert np.allclose(local[name].values, shared[name].values, atol=1e-4)
+    assert not hasattr(sfit, 'df_fit')
+
+    with pytest.raises(ValueError, match='shape'):
+        stream('wrong.h5', varkeys=varkeys, other_initvals=[True])
+
+
+def test_sequential_fit_resumes_from_checkpoint(tmp_path):
+
+    x, y, centers, binit = synthetic_patch()
+    ckpt = str(tmp_path / 'ckpt.h5')
+    kfit = fitter.PatchFitter(peaks={'Voigt':2}, xdata=x, ydata=y)
+    kfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+    kfit.sequential_fit(compact=True)
+    full = kfit.df_fit
+
+    kfit.sequential_fit(compact=True, nspec=2, checkpoint=ckpt)
+    kfit.sequential_fit(compact=True, checkpoint=ckpt, resume=True)
+    assert len(kfit.fitres) == 2
+    assert np.allclose(kfit.df_fit.values, full.values)
+
+    # The checkpoint is replaced without resuming and rejected with a different initialization
+    kfit.sequential_fit(compact=True, nspec=1, checkpoint=ckpt)
+    assert len(kfit.df_fit) == 1
+    kfit.set_inits(inits_dict=band_inits(), band_inits=binit + 0.05)
+    with pytest.raises(ValueError):
+        kfit.sequential_fit(compact=True, checkpoint=ckpt, resume=True)
+
+
+def test_result_cache_keys_model_settings(tmp_path):
+
+    from pesfit import utils as u
+
+    x, y, centers, binit = synthetic_patch(nrow=1)
+    cache = u.ResultCache(str(tmp_path))
+    outcomes = []
+    for span in [0.1, 0.1, 0.2]:
+        kfit = fitter.PatchFitter(peaks={'Voigt':2}, xdata=x, ydata=y, modelkwds={'convolve':'gaussian', 'conv_span':span})
+        kfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+        kfit.sequential_fit(cache=cache)
+        outcomes.append(kfit.df_fit.values)
+
+    assert (cache.hits, cache.misses) == (2, 4)
+    assert np.array_equal(outcomes[0], outcomes[1])
+
+    # Entries written by the worker processes are hit in new worker processes
+    pool_outcomes = []
+    for _ in range(2):
+        dfit = fitter.DistributedFitter(x, y, nfitter=2, lazy=True, peaks={'Voigt':2}, modelkwds={'convolve':'gaussian', 'conv_span':0.2})
+        dfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+        try:
+            dfit.parallel_fit(backend='pool', num_workers=2, cache=cache)
+        finally:
+            dfit.close_pool()
+        pool_outcomes.append(dfit.df_fit.values)
+        if len(pool_outcomes) == 1:
+            nentries = len(cache._entries())
+    assert len(cache._entries()) == nentries
+    assert np.array_equal(pool_outcomes[0], pool_outcomes[1])
+
+
+def test_adaptive_chunks_only_with_pool(monkeypatch):
+
+    import multiprocessing.pool as mpp
+
+    def no_adaptive(*args, **kwargs):
+        raise AssertionError('Adaptive chunks would send the fitter with every chunk.')
+    monkeypatch.setattr(mpp.Pool, 'adaptive_starmap', no_adaptive)
+
+    x, y, centers, binit = synthetic_patch()
+    dfit = fitter.DistributedFitter(x, y, nfitter=4, lazy=True, peaks={'Voigt':2})
+    dfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+    dfit.parallel_fit(backend='multiprocessing', num_workers=2, compact=True)
+
+    assert np.allclose(dfit.df_fit['lp1_center'].values, centers[0].ravel(), atol=0.02)
+
+
+@pytest.mark.parametrize('thread_batch', [None, True])
+def test_parallel_fit_in_threads(thread_batch):
+
+    x, y, centers, binit = synthetic_patch()
+    dfit = fitter.DistributedFitter(x, y, nfitter=4, lazy=True, peaks={'Voigt':2})
+    dfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+    dfit.parallel_fit(backend='threads', num_workers=2, thread_batch=thread_batch, compact=True)
+
+    assert len(dfit.fitres) == 4
+    for i in range(2):
+        assert np.allclose(dfit.df_fit['lp{}_center'.format(i+1)].values, centers[i].ravel(), atol=0.02)
+
+
+def test_thread_batch_rejects_unsupported_settings():
+
+    x, y, centers, binit = synthetic_patch()
+    dfit = fitter.DistributedFitter(x, y, nfitter=4, lazy=True, peaks={'Gaussian':2})
+    dfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+    for kwds in [{'jitter_init':True}, {'jacobian':True}, {'keep_full':[0]}, {'covar':True}, {'compact':False}]:
+        with pytest.raises(ValueError, match=list(kwds)[0]):
+            dfit.parallel_fit(backend='threads', num_workers=2, thread_batch=True, **kwds)
+
+
+def test_parallel_fit_on_local_cluster():
+
+    ddist = pytest.importorskip('dask.distributed')
+
+    x, y, centers, binit = synthetic_patch()
+    dfit = fitter.DistributedFitter(x, y, nfitter=4, lazy=True, peaks={'Voigt':2})
+    dfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+    with ddist.LocalCluster(n_workers=2, threads_per_worker=1, dashboard_address=None) as cluster, ddist.Client(cluster) as client:
+        dfit.parallel_fit(backend='distributed', client=client, block_size=3)
+
+    assert sorted(fres[1]['spec_id'] for fres in dfit.fitres) == [0, 1, 2, 3]
+    assert isinstance(dfit.fitres[0][0], fitter.CompactResult)
+    for i in range(2):
+        assert np.allclose(dfit.df_fit['lp{}_center'.format(i+1)].values, centers[i].ravel(), atol=0.02)
+
+
+def async_spectra(nspec=6):
+    """ Line spectra and the spectrum-dependent initialization for ``AsyncFitter``.
+    """
+
+    x, y, centers, binit = synthetic_patch(nrow=2, ncol=3)
+    ys = y.reshape((-1, x.size))[:nspec]
+    inits = [{'lp1_center':{'value':b1}, 'lp2_center':{'value':b2}} for b1, b2 in binit.reshape((2, -1)).T[:nspec]]
+
+    return x, ys, inits, centers.reshape((2, -1))[:, :nspec]
+
+
+@pytest.mark.parametrize('engine', ['batch', 'pool'])
+def test_async_fitter_batches_by_size(engine):
+
+    import asyncio
+    x, ys, inits, centers = async_spectra()
+
+    async def run():
+        async with fitter.AsyncFitter(x, inits=band_inits(), engine=engine, max_batch=4, max_delay=0.5, num_workers=1) as afit:
+            futs = [await afit.submit(y, init) for y, init in zip(ys, inits)]
+        return afit, [fut.result() for fut in futs]
+
+    afit, results = asyncio.run(run())
+    assert afit.nbatches == 2
+    assert all(isinstance(res, fitter.CompactResult) for res in results)
+    fitted = np.array([[res.best_values['lp1_center'], res.best_values['lp2_center']] for res in results]).T
+    assert np.allclose(fitted, centers, atol=0.02)
+
+
+def test_async_fitter_batches_by_delay():
+
+    import asyncio
+    x, ys, inits, centers = async_spectra(4)
+
+    async def run():
+        async with fitter.AsyncFitter(x, inits=band_inits(), max_batch=32, max_delay=0.01) as afit:
+            futs = [await afit.submit(y, init) for y, init in zip(ys[:2], inits[:2])]
+            await asyncio.sleep(0.3)
+            futs += [await afit.submit(y, init) for y, init in zip(ys[2:], inits[2:])]
+        return afit, futs
+
+    afit, futs = asyncio.run(run())
+    assert afit.nbatches == 2
+    assert all(fut.done() for fut in futs)
+
+
+def test_async_fitter_backpressure_cancellation_and_close():
+
+    import asyncio
+    x, ys, inits, centers = async_spectra(4)
+
+    async def run():
+        afit = fitter.AsyncFitter(x, inits=band_inits(), max_batch=1, max_delay=0, max_pending=2)
+        await afit.start()
+        await afit._slots.acquire() # Occupy the engine, the first spectrum is held by the batching loop
+        futs = [await afit.submit(y, init) for y, init in zip(ys[:3], inits[:3])]
+        await asyncio.sleep(0.05)
+        assert afit.pending == 2
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(afit.submit(ys[3], inits[3]), 0.1)
+        futs[1].cancel()
+        afit._slots.release()
+        await afit.close() # Drains the queue
+        return afit, futs
+
+    afit, futs = asyncio.run(run())
+    assert futs[1].cancelled()
+    assert futs[0].done() and futs[2].done()
+    assert afit.nbatches == 2
+
+
+@pytest.mark.parametrize('engine', ['batch', 'pool'])
+def test_async_fitter_propagates_exceptions(engine):
+
+    import asyncio
+    x, ys, inits, centers = async_spectra(2)
+
+    async def run():
+        async with fitter.AsyncFitter(x, inits=band_inits(), engine=engine, max_batch=2, max_delay=0.5, num_workers=1) as afit:
+            # Spectra of different lengths in one micro-batch, then a micro-batch failing in the fitting engine
+            futs = [await afit.submit(ys[0], inits[0]), await afit.submit(ys[1][:-5], inits[1])]
+            await asyncio.wait(futs)
+            futs.append(await afit.submit(ys[1][:-5], inits[1]))
+            await asyncio.wait(futs)
+            good = await afit.fit(ys[0], inits[0])
+        return futs, good
+
+    futs, good = asyncio.run(run())
+    for fut in futs:
+        with pytest.raises(ValueError):
+            fut.result()
+    assert isinstance(good, fitter.CompactResult)
+
+
+def test_batch_fit_with_tch_voigt():
+
+    x, y, centers, binit = synthetic_patch()
+    kfit = fitter.PatchFitter(peaks={'FastVoigt':2}, xdata=x, ydata=y, modelkwds={'lineshape_kwds':{'accuracy':1.5e-2}})
+    assert kfit.model.components[0].method == 'tch'
+    kfit.set_inits(inits_dict=band_inits(), band_inits=binit)
+    kfit.batch_fit()
+    batch = kfit.df_fit[['lp1_center', 'lp2_center']].values
+    kfit.sequential_fit(compact=True)
+
+    assert kfit.batch_result.success.all()
+    assert np.allclose(batch, kfit.df_fit[['lp1_center', 'lp2_center']].values, atol=1e-4)
+
+
+def test_energy_window():
+
+    model = fitter.model_generator(peaks={'Voigt':2}, background='Linear')
+    pars = model.make_params()
+    pars['lp1_center'].set(value=-3, vary=False)
+    pars['lp2_center'].set(value=-1.4, min=-1.6, max=-1.2)
+    x = np.linspace(-6, 0, 61)
+    mask = fitter.energy_window(x, pars, model.prefixes, 0.2)
+
+    expected = ((x >= -3.2 - 1e-9) & (x <= -2.8 + 1e-9)) | ((x >= -1.8 - 1e-9) & (x <= -1.0 + 1e-9))
+    assert np.array_equal(mask, expected)
+
+
+@pytest.mark.parametrize('crop_groups', [None, 1])
+def test_cropped_fit_matches_full_fit(crop_groups):
+
+    x, y, centers, binit = synthetic_patch(nrow=1, ncol=1)
+    model = fitter.model_generator(peaks={'Voigt':2}, background='Linear')
+    fits = []
+    for crop in [None, 1.0]:
+        pars = model.make_params()
+        fitter.varsetter(pars, band_inits())
+        for i in range(2):
+            pars['lp{}_center'.format(i+1)].set(value=binit[i,0,0], min=binit[i,0,0]-0.3, max=binit[i,0,0]+0.3)
+        fits.append(fitter.pointwise_fitting(x, y[0,0], model=model, params=pars, crop=crop, crop_groups=crop_groups))
+
+    assert fits[1].userkws['x'].size < x.size
+    for i in range(2):
+        name = 'lp{}_center'.format(i+1)
+        assert np.isclose(fits[1].params[name].value, fits[0].params[name].value, atol=0.01)
+
+
+def test_cropped_fit_with_stages():
+
+    import matplotlib
+    matplotlib.use('Agg')
+
+    model = fitter.model_generator(peaks={'Voigt':2}, fermi=True, convolve='gaussian', cache=False)
+    x = np.linspace(-6, 0.5, 651)
+    truth = model.make_params()
+    for name, val in [('lp1_center', -4), ('lp2_center', -1), ('lp1_sigma', 0.2), ('lp2_sigma', 0.2), ('ins_sigma', 0.1), ('fd_kt', 0.05)]:
+        truth[name].set(value=val)
+    y = model.eval(truth, x=x)
+
+    pars = truth.copy()
+    for pref, shift in [('lp1_', 0.1), ('lp2_', -0.1)]:
+        center = truth[pref + 'center'].value
+        pars[pref + 'center'].set(value=center + shift, min=center - 0.3, max=center + 0.3)
+    fres = fitter.pointwise_fitting(x, y, model=model, params=pars, crop=0.5, crop_groups=1, ynorm=False)
+
+    # One contiguous window over the bounds of the band positions, extended by the span of the instrument response (5 sigma)
+    xfit = fres.userkws['x']
+    assert np.allclose(np.diff(xfit), x[1] - x[0])
+    assert (abs(xfit[0] + 5.3) < 0.011) and (abs(xfit[-1] - 0.3) < 0.011)
+    for name in ['lp1_center', 'lp2_center']:
+        assert np.isclose(fres.params[name].value, truth[name].value, atol=1e-3)
+    fitter.plot_fit_result(fres, x)
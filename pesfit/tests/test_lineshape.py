@@ -0,0 +1,169 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from functools import partial
+from lmfit import models as lmm
+from pesfit import lineshape as ls
+
+
+@pytest.mark.parametrize('method', list(ls.voigt_methods))
+def test_voigt_deviation_within_bound(method):
+
+    bound = ls.voigt_methods[method][1]
+    assert ls.voigt_deviation(method) <= bound + 1e-12
+
+
+@pytest.mark.parametrize('method', list(ls.voigt_methods))
+def test_fast_voigt_matches_lmfit(method):
+
+    fast, ref = ls.FastVoigtModel(prefix='lp1_', method=method), lmm.VoigtModel(prefix='lp1_')
+    fpars, rpars = fast.make_params(), ref.make_params()
+    assert set(fpars) == set(rpars)
+
+    bound = ls.voigt_methods[method][1]
+    x = np.linspace(-10, 10, 2001)
+    for amplitude in (0.5, 2.0):
+        for center in (-1.0, 0.3):
+            for sigma in (0.05, 0.3, 1.0):
+                for gamma in (0.01, 0.3, 2.0):
+                    for pars in (fpars, rpars):
+                        pars['lp1_amplitude'].set(value=amplitude)
+                        pars['lp1_center'].set(value=center)
+                        pars['lp1_sigma'].set(value=sigma)
+                        pars['lp1_gamma'].set(value=gamma, vary=True, expr='')
+                    yfast, yref = fast.eval(fpars, x=x), ref.eval(rpars, x=x)
+                    assert np.abs(yfast - yref).max() <= (bound + 1e-12) * yref.max()
+                    assert np.isclose(fpars['lp1_fwhm'].value, rpars['lp1_fwhm'].value)
+                    assert np.isclose(fpars['lp1_height'].value, rpars['lp1_height'].value)
+
+
+def test_fast_voigt_auto_method():
+
+    assert ls.FastVoigtModel(accuracy=1e-4).method == 'humlicek'
+    assert ls.FastVoigtModel(accuracy=1e-2).method == 'humlicek'
+    assert ls.FastVoigtModel(accuracy=0.1).method == 'tch'
+    assert ls.FastVoigtModel(accuracy=0).method == 'exact'
+
+
+# The derivatives of the Humlicek approximation follow the exact Faddeeva function within its accuracy
+@pytest.mark.parametrize('lineshape, background, tol', [(lmm.GaussianModel, lmm.LinearModel, 1e-6), (lmm.LorentzianModel, lmm.QuadraticModel, 1e-6),
+                        (lmm.VoigtModel, lmm.ExponentialModel, 1e-6), (lmm.PseudoVoigtModel, lmm.LinearModel, 1e-6),
+                        (partial(ls.FastVoigtModel, method='humlicek'), lmm.QuadraticModel, 2e-4),
+                        (partial(ls.FastVoigtModel, method='tch'), lmm.LinearModel, 1e-6)])
+@pytest.mark.parametrize('free_gamma', [False, True])
+def test_jacobian_matches_finite_differences(lineshape, background, tol, free_gamma):
+
+    model = ls.MultipeakModel(lineshape=lineshape, n=2, background=background(prefix='bg_'))
+    x = np.linspace(-3, 1, 201)
+    pars = model.make_params()
+    for i, (center, sigma) in enumerate([(-1.6, 0.3), (-0.4, 0.2)]):
+        pars['lp{}_center'.format(i+1)].set(value=center)
+        pars['lp{}_sigma'.format(i+1)].set(value=sigma)
+        if free_gamma and ('lp{}_gamma'.format(i+1) in pars):
+            pars['lp{}_gamma'.format(i+1)].set(value=0.15, vary=True, expr='')
+    for name in pars:
+        if name.startswith('bg_'):
+            pars[name].set(value=0.2 if name.endswith(('decay', 'amplitude')) else 0.05)
+    if 'bg_decay' in pars:
+        pars['bg_decay'].set(value=-5)
+
+    jac = model.jacobian(pars, x=x)
+    var_names = [name for name, par in pars.items() if par.vary and not par.expr]
+    assert jac.shape == (x.size, len(var_names))
+    for j, name in enumerate(var_names):
+        val = pars[name].value
+        step = 1e-6*max(1, abs(val))
+        pars[name].set(value=val + step)
+        fplus = model.eval(pars, x=x)
+        pars[name].set(value=val - step)
+        fminus = model.eval(pars, x=x)
+        pars[name].set(value=val)
+        numeric = ls.residual_sign()*(fplus - fminus) / (2*step)
+        assert np.allclose(jac[:, j], numeric, rtol=1e-4, atol=tol*np.abs(numeric).max()), name
+
+
+def test_residual_sign_matches_lmfit():
+
+    model = lmm.GaussianModel()
+    x = np.linspace(-3, 3, 101)
+    y = ls.gaussian(x, 1, 0.2, 0.5)
+    res = model.fit(y, model.make_params(amplitude=1.2, center=0, sigma=0.6), x=x, max_nfev=3)
+
+    assert np.allclose(res.residual, ls.residual_sign()*(res.best_fit - y))
+
+
+def test_components_include_stages():
+
+    model = ls.MultipeakModel(lineshape=lmm.VoigtModel, n=2, background=lmm.LinearModel(prefix='bg_'), fermi=True, convolve='gaussian')
+    x = np.linspace(-3, 0.5, 351)
+    pars = model.make_params()
+    pars['lp1_center'].set(value=-1.5)
+    pars['lp2_center'].set(value=-0.1)
+    pars['bg_intercept'].set(value=0.2)
+    pars['ins_sigma'].set(value=0.05)
+
+    comps = model.eval_components(params=pars, x=x)
+    assert list(comps) == ['bg_', 'lp1_', 'lp2_']
+    assert np.allclose(sum(comps.values()), model.eval(pars, x=x))
+    assert comps['lp2_'][-1] < 1e-3 * comps['lp2_'].max() # Cut off above the Fermi level
+
+
+def assert_same_params(pars, ref):
+
+    assert list(pars) == list(ref)
+    for name, par in pars.items():
+        rpar = ref[name]
+        assert (par.value, par.min, par.max, par.vary, par.expr) == (rpar.value, rpar.min, rpar.max, rpar.vary, rpar.expr), name
+
+
+@pytest.mark.parametrize('fallback', [False, True])
+def test_clone_params_matches_copy(fallback, monkeypatch):
+
+    import pickle
+    if fallback:
+        monkeypatch.setattr(ls, '_clone_attrs', ls._clone_attrs + ('_missing',))
+
+    model = ls.MultipeakModel(lineshape=lmm.VoigtModel, n=2, background=lmm.LinearModel(prefix='bg_'))
+    params = model.make_params()
+    params['lp2_sigma'].set(expr='2*lp1_sigma')
+    cloned, ref = ls.clone_params(params), params.copy()
+    assert_same_params(cloned, ref)
+
+    # Constraints are re-evaluated in the copy only, bounds are applied
+    for pars in (cloned, ref):
+        pars['lp1_sigma'].set(value=0.4)
+        pars['lp1_amplitude'].set(min=2)
+    assert_same_params(cloned, ref)
+    assert np.isclose(cloned['lp2_sigma'].value, 0.8) and np.isclose(cloned['lp1_gamma'].value, 0.4)
+    assert cloned['lp1_amplitude'].min == 2 and params['lp1_amplitude'].min != 2
+    assert params['lp1_sigma'].value != 0.4
+
+    restored = pickle.loads(pickle.dumps(cloned))
+    assert_same_params(restored, pickle.loads(pickle.dumps(ref)))
+    restored['lp1_sigma'].set(value=0.2)
+    assert np.isclose(restored['lp2_sigma'].value, 0.4)
+
+
+@pytest.mark.parametrize('lineshape', [lmm.GaussianModel, lmm.LorentzianModel, lmm.VoigtModel, lmm.PseudoVoigtModel])
+@pytest.mark.parametrize('background', [lmm.LinearModel, lmm.ExponentialModel])
+def test_vectorized_evaluation_matches_components(lineshape, background):
+
+    models = [ls.MultipeakModel(lineshape=lineshape, n=3, background=background(prefix='bg_'), vectorize=vec) for vec in (True, False)]
+    x = np.linspace(-3, 1, 201)
+    pars = models[0].make_params()
+    for i, (center, sigma) in enumerate([(-2.1, 0.3), (-1.2, 0.15), (-0.3, 0.4)]):
+        pars['lp{}_center'.format(i+1)].set(value=center)
+        pars['lp{}_sigma'.format(i+1)].set(value=sigma)
+        pars['lp{}_amplitude'.format(i+1)].set(value=1 + 0.5*i)
+    for name in pars:
+        if name.startswith('bg_'):
+            pars[name].set(value=-5 if name.endswith('decay') else 0.1)
+
+    vec, seq = [mod.eval(pars, x=x) for mod in models]
+    assert np.allclose(vec, seq)
+    cvec, cseq = [mod.eval_components(params=pars, x=x) for mod in models]
+    assert list(cvec) == list(cseq)
+    for name in cvec:
+        assert np.allclose(cvec[name], cseq[name]), name
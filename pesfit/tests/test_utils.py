@@ -0,0 +1,145 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from pesfit import utils as u
+
+
+def test_grid_bin_truncated_blocks():
+
+    data = np.arange(35.).reshape((5, 7))
+    binned = u.grid_bin(data, 2)
+
+    assert binned.shape == (3, 4)
+    assert binned[0, 0] == data[:2, :2].mean()
+    assert binned[-1, -1] == data[4, 6]
+
+
+def test_grid_unbin_linear_extrapolation():
+
+    rows, cols = np.meshgrid(np.arange(6.), np.arange(7.), indexing='ij')
+    data = np.stack([0.3*rows - 0.2*cols, 1 + 0.1*cols], axis=-1)
+    restored = u.grid_unbin(u.grid_bin(data, 2), 2, (6, 7))
+
+    assert restored.shape == data.shape
+    assert np.allclose(restored, data)
+
+
+def test_grid_unbin_single_block():
+
+    data = np.full((3, 3), 2.5)
+
+    assert np.allclose(u.grid_unbin(u.grid_bin(data, 4), 4, (3, 3)), data)
+
+
+def test_shared_array_close_with_views():
+
+    from multiprocessing import shared_memory
+
+    sarr = u.SharedArray(np.arange(10.))
+    view = sarr.array[2:5]
+    sarr.close()
+
+    assert np.array_equal(view, [2., 3., 4.])
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=sarr.name)
+
+
+def test_result_collector_dataframe_columns():
+
+    from types import SimpleNamespace
+
+    collector = u.ResultCollector(['a', 'b'], 3)
+    fitres = SimpleNamespace(names=['a', 'b'], values=np.array([1., 2.]), stderr=np.array([0.1, 0.2]),
+                            chisqr=0.5, redchi=0.25, nfev=12, success=True)
+    collector.collect(fitres, 1)
+
+    df = collector.to_dataframe()
+    assert list(df.columns) == ['a', 'b', 'spec_id']
+    assert df.loc[1, 'b'] == 2.
+
+    df = collector.to_dataframe(stderr=True, stats=True)
+    assert df['success'].dtype == bool
+    assert df.loc[1, 'success'] and (df.loc[1, 'nfev'] == 12)
+    assert df.loc[1, 'a_stderr'] == 0.1
+
+
+def test_chunk_slices_cover_array():
+
+    data = np.arange(2*3*5).reshape((2, 3, 5))
+    for chunksize in [1, 4, 15, 40]:
+        flat = np.concatenate([data[sel].ravel() for sel, start, stop in u.chunk_slices(data.shape, chunksize)])
+        assert np.array_equal(flat, data.ravel())
+
+    assert list(u.chunk_slices((), 8)) == [((), 0, 1)]
+
+
+@pytest.mark.parametrize('shape', [(4, 4), (8, 8), (3, 5), (6, 1)])
+def test_traversal_orders(shape):
+
+    nrow, ncol = shape
+    for order in ['raster', 'serpentine', 'hilbert']:
+        inds = u.traversal_order(nrow, ncol, order=order)
+        assert np.array_equal(np.sort(inds), np.arange(nrow*ncol)), order
+
+        # Consecutive points along the serpentine and Hilbert orders are neighbours on a grid with sides of 2^n
+        if (order != 'raster') and (nrow == ncol) and (nrow & (nrow - 1) == 0):
+            r, c = np.divmod(inds, ncol)
+            assert np.all(np.abs(np.diff(r)) + np.abs(np.diff(c)) == 1), order
+
+    with pytest.raises(ValueError, match='serpentine'):
+        u.traversal_order(nrow, ncol, order='spiral')
+
+
+def test_grid_tiles_and_neighbours():
+
+    nrow, ncol = 5, 7
+    tiles = u.grid_tiles(nrow, ncol, (2, 3), order='serpentine')
+    assert len(tiles) == 3*3
+    assert np.array_equal(np.sort(np.concatenate(tiles)), np.arange(nrow*ncol))
+    for tile in tiles:
+        r, c = np.divmod(tile, ncol)
+        assert (np.ptp(r) < 2) and (np.ptp(c) < 3)
+        assert np.all(np.abs(np.diff(r)) + np.abs(np.diff(c)) == 1)
+
+    for ind in range(nrow*ncol):
+        nbs = u.grid_neighbours(ind, nrow, ncol)
+        r, c = divmod(ind, ncol)
+        assert len(nbs) == 4 - (r in (0, nrow - 1)) - (c in (0, ncol - 1))
+        for nb in nbs:
+            rn, cn = divmod(nb, ncol)
+            assert abs(rn - r) + abs(cn - c) == 1
+            assert ind in u.grid_neighbours(nb, nrow, ncol)
+
+
+def test_result_cache_hit_miss_and_eviction(tmp_path):
+
+    import os
+
+    cache = u.ResultCache(str(tmp_path))
+    keys = [cache.key('spectrum', np.full(4, i)) for i in range(4)]
+    assert cache.get(keys[0]) is None
+    for i, key in enumerate(keys[:3]):
+        cache.put(key, np.full(100, i))
+        os.utime(cache._path(key), (1000 + i, 1000 + i))
+    assert np.array_equal(cache.get(keys[0]), np.full(100, 0)) # Marks the first entry as recently used
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.max_size = cache.size()
+    cache.put(keys[3], np.full(100, 3))
+    assert [cache.get(key) is not None for key in keys] == [True, False, True, True]
+
+
+def test_content_digest_stable_across_processes():
+
+    import sys, subprocess
+
+    code = ('import numpy as np; from functools import partial; from pesfit import utils as u; '
+            'print(u.content_digest({"a": [np.arange(3.), (np.ones(2), u.grid_bin)]}, partial(u.grid_unbin, bins=2)))')
+    digests = [subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.strip()
+                for _ in range(2)]
+
+    assert digests[0] == digests[1]
+    assert u.content_digest([np.arange(3.)]) != u.content_digest([np.arange(1., 4.)])
+    assert u.content_digest(u.grid_bin) != u.content_digest(u.grid_unbin)
@@ -1,9 +1,11 @@
 #! /usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os, tempfile, hashlib, pickle, time, ctypes
 import numpy as np
 import pandas as pd
-from functools import reduce
+from functools import reduce, partial
+from contextlib import contextmanager
 from scipy.interpolate import RegularGridInterpolator as RGI
 from tqdm import notebook as nbk
 from tqdm import tqdm as tqdm_classic
@@ -106,6 +108,489 @@ def df_collect(params, extra_params=None, currdf=None):
     return df
 
 
+def _hash_update(h, obj, _active=()):
+    """ Update a hash object with the content of a (nested) object (see ``content_digest()``).
+    """
+
+    if id(obj) in _active: # Reference cycle
+        h.update(b'<cycle>')
+        return
+    _active = _active + (id(obj),)
+
+    if isinstance(obj, np.ndarray):
+        h.update(repr(('ndarray', obj.dtype.str, obj.shape)).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        h.update(b'{')
+        for key in sorted(obj, key=repr):
+            _hash_update(h, key, _active)
+            h.update(b':')
+            _hash_update(h, obj[key], _active)
+        h.update(b'}')
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        h.update(type(obj).__name__.encode() + b'(')
+        for item in (sorted(obj, key=repr) if isinstance(obj, (set, frozenset)) else obj):
+            _hash_update(h, item, _active)
+            h.update(b',')
+        h.update(b')')
+    elif isinstance(obj, partial):
+        _hash_update(h, ('partial', obj.func, obj.args, obj.keywords), _active)
+    elif hasattr(obj, '__func__') and hasattr(obj, '__self__'): # Bound method, identified by its function and class
+        _hash_update(h, ('method', obj.__func__, type(obj.__self__)), _active)
+    elif callable(obj) and hasattr(obj, '__qualname__'): # Function or class, its representation contains the address
+        h.update(repr(('callable', getattr(obj, '__module__', None), obj.__qualname__)).encode())
+    elif (type(obj).__repr__ is object.__repr__) and hasattr(obj, '__dict__'): # Default representation contains the address
+        _hash_update(h, ('object', type(obj), vars(obj)), _active)
+    else:
+        h.update(repr(obj).encode())
+
+
+def content_digest(*parts):
+    """ Hash of (nested) objects, where arrays are hashed by their data type, shape and content, dictionaries, lists, tuples and sets by their entries, functions and classes by their module and qualified name, objects without a custom representation by their class and attributes, and other objects by their representation. The hash is stable across processes.
+    """
+
+    h = hashlib.sha1()
+    for part in parts:
+        _hash_update(h, part)
+        h.update(b'|')
+
+    return h.hexdigest()
+
+
+class ResultCollector(object):
+    """ Preallocated array-backed collector of fitting outcomes, filled in place and converted into a dataframe once at the end. The row of every outcome is given by its spectrum ID (``spec_id``).
+
+    **Parameters**\n
+    parnames: list/tuple
+        Names of the fitting parameters.
+    nspec: int
+        Number of spectra (rows).
+    offset: int | 0
+        Spectrum ID of the first row (for collecting a contiguous block of spectra).
+    """
+
+    stat_names = ['chisqr', 'redchi', 'nfev', 'success']
+
+    def __init__(self, parnames, nspec, offset=0):
+
+        self.parnames = list(parnames)
+        self.nspec = nspec
+        self.offset = offset
+        self.values = np.full((nspec, self.npar), np.nan)
+        self.stderr = np.full((nspec, self.npar), np.nan)
+        self.stats = np.full((nspec, len(self.stat_names)), np.nan)
+        self.filled = np.zeros(nspec, dtype='bool')
+
+    @property
+    def npar(self):
+        """ Number of fitting parameters.
+        """
+
+        return len(self.parnames)
+
+    def collect(self, fitres, spec_id):
+        """ Collect a fitting outcome.
+
+        **Parameters**\n
+        fitres: instance of ``lmfit.model.ModelResult`` or ``pesfit.fitter.CompactResult``
+            Fitting result with the parameters (or parameter names and value arrays) and fit statistics as attributes.
+        spec_id: int
+            Spectrum ID.
+        """
+
+        spec_id = spec_id - self.offset
+        params = getattr(fitres, 'params', None)
+        if params is not None:
+            self.values[spec_id] = [params[pn].value if pn in params else np.nan for pn in self.parnames]
+            self.stderr[spec_id] = [params[pn].stderr if (pn in params) and (params[pn].stderr is not None) else np.nan
+                                    for pn in self.parnames]
+        else: # Compact result
+            index = dict((name, i) for i, name in enumerate(fitres.names))
+            self.values[spec_id] = [fitres.values[index[pn]] if pn in index else np.nan for pn in self.parnames]
+            self.stderr[spec_id] = [fitres.stderr[index[pn]] if pn in index else np.nan for pn in self.parnames]
+        self.stats[spec_id] = [getattr(fitres, sn, np.nan) for sn in self.stat_names]
+        self.filled[spec_id] = True
+
+    def to_dataframe(self, stderr=False, stats=False, spec_ids=None):
+        """ Convert the collected outcomes into a dataframe, by default with the parameter values and the spectrum ID as columns.
+
+        **Parameters**\n
+        stderr: bool | False
+            Option to include the standard errors (columns named as '<parameter>_stderr').
+        stats: bool | False
+            Option to include the fit statistics (``self.stat_names``, with 'success' as booleans).
+        spec_ids: list/tuple/array | None
+            Spectrum IDs of the outcomes to convert (None for all filled rows).
+
+        **Return**\n
+        df: instance of ``pandas.DataFrame``
+            Fitting outcomes of the filled rows, ordered by ``spec_id``.
+        """
+
+        if spec_ids is None:
+            rows = np.where(self.filled)[0]
+        else:
+            rows = np.sort(np.asarray(spec_ids, dtype='int')) - self.offset
+        cols = dict(zip(self.parnames, self.values[rows].T))
+        if stderr:
+            cols.update(zip([pn + '_stderr' for pn in self.parnames], self.stderr[rows].T))
+        if stats:
+            cols.update(zip(self.stat_names, self.stats[rows].T))
+            cols['success'] = cols['success'] > 0
+        cols['spec_id'] = rows + self.offset
+        df = pd.DataFrame(cols, index=rows + self.offset)
+
+        return df
+
+
+class ResultWriter(object):
+    """ Incremental writer of fitting outcomes to a table in an HDF5 file, which doubles as a checkpoint. Outcomes are appended in batches as the fits complete, and the spectrum IDs already in the file can be skipped when a fitting job is restarted. The file is only opened while writing, so partial outcomes can be inspected while the job runs.
+
+    **Parameters**\n
+    path: str
+        Path of the HDF5 file.
+    keyname: str | 'fitres'
+        Key of the table in the file.
+    resume: bool | False
+        Option to keep the outcomes already in the file (otherwise they are removed).
+    flush_every: int | 100
+        Number of outcomes per write.
+    signature: str | None
+        Digest of the fitting setup (e.g. from ``pesfit.utils.content_digest()``), stored with the table. Resuming from a table written with a different setup raises a ``ValueError``.
+    """
+
+    def __init__(self, path, keyname='fitres', resume=False, flush_every=100, signature=None):
+
+        self.path = path
+        self.keyname = keyname
+        self.flush_every = flush_every
+        self.signature = signature
+        self.collector = None
+        self.pending = []
+
+        if not resume:
+            with pd.HDFStore(self.path, mode='a') as store:
+                if self.keyname in store:
+                    store.remove(self.keyname)
+        elif (signature is not None) and os.path.exists(self.path):
+            with pd.HDFStore(self.path, mode='r') as store:
+                if self.keyname in store:
+                    stored = getattr(store.get_storer(self.keyname).attrs, 'signature', None)
+                    if stored != signature:
+                        raise ValueError('The outcomes under {} in {} were written with a different fitting setup, '
+                                        'fit without resuming to replace them.'.format(self.keyname, self.path))
+
+    def done_ids(self):
+        """ Spectrum IDs of the outcomes already in the file.
+        """
+
+        if not os.path.exists(self.path):
+            return np.array([], dtype='int')
+        with pd.HDFStore(self.path, mode='r') as store:
+            if self.keyname not in store:
+                return np.array([], dtype='int')
+            return store.select_column(self.keyname, 'index').values.astype('int')
+
+    def add(self, collector, spec_id):
+        """ Register a collected outcome for writing.
+
+        **Parameters**\n
+        collector: instance of ``pesfit.utils.ResultCollector``
+            Collector holding the outcome.
+        spec_id: int
+            Spectrum ID.
+        """
+
+        if collector is not self.collector:
+            self.flush()
+            self.collector = collector
+        self.pending.append(spec_id)
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """ Write the registered outcomes to the file.
+        """
+
+        if self.pending:
+            df = self.collector.to_dataframe(spec_ids=self.pending)
+            with pd.HDFStore(self.path, mode='a') as store:
+                store.append(self.keyname, df, format='table')
+                store.get_storer(self.keyname).attrs.signature = self.signature
+            self.pending = []
+
+    def load(self):
+        """ Load all outcomes in the file as a dataframe ordered by ``spec_id``.
+        """
+
+        self.flush()
+
+        return pd.read_hdf(self.path, key=self.keyname).sort_index()
+
+
+class ResultCache(object):
+    """ On-disk cache of fitting outcomes with size-bounded least-recently-used (LRU) eviction. Every entry is a pickled file named by the hash of its key, the recency of use is tracked by the file modification time. The cache can be shared by multiple processes.
+
+    **Parameters**\n
+    cdir: str
+        Directory of the cache (created if absent).
+    max_size: numeric | 1e9
+        Maximum total size of the cache in bytes.
+    """
+
+    def __init__(self, cdir, max_size=1e9):
+
+        self.cdir = cdir
+        self.max_size = max_size
+        os.makedirs(self.cdir, exist_ok=True)
+        self._size = None # Estimated total size, initialized by scanning the directory
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+        state['_size'] = None
+
+        return state
+
+    @staticmethod
+    def key(*parts):
+        """ Hash of the key components, including the arrays nested in them by content (see ``content_digest()``).
+        """
+
+        return content_digest(*parts)
+
+    def _path(self, key):
+
+        return os.path.join(self.cdir, key + '.pkl')
+
+    def get(self, key):
+        """ Retrieve the cached object of a key (None on a miss).
+        """
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                obj = pickle.load(f)
+            os.utime(path) # Mark as recently used
+        except Exception:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return obj
+
+    def put(self, key, obj):
+        """ Store an object under a key, evicting the least recently used entries if the cache exceeds its size limit.
+        """
+
+        path = self._path(key)
+        fd, tmppath = tempfile.mkstemp(dir=self.cdir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmppath, path) # Atomic for concurrent readers
+
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += os.path.getsize(path)
+        if self._size > self.max_size:
+            self.evict()
+
+    def _entries(self):
+
+        entries = []
+        for fname in os.listdir(self.cdir):
+            if fname.endswith('.pkl'):
+                try:
+                    st = os.stat(os.path.join(self.cdir, fname))
+                    entries.append((st.st_mtime, st.st_size, fname))
+                except FileNotFoundError: # Removed by another process
+                    pass
+
+        return entries
+
+    def size(self):
+        """ Total size of the cache in bytes.
+        """
+
+        return sum(ent[1] for ent in self._entries())
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache is within its size limit.
+        """
+
+        entries = sorted(self._entries())
+        size = sum(ent[1] for ent in entries)
+        for _, fsize, fname in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.cdir, fname))
+            except FileNotFoundError:
+                pass
+            size -= fsize
+        self._size = size
+
+    def clear(self):
+        """ Remove all entries.
+        """
+
+        for _, _, fname in self._entries():
+            try:
+                os.remove(os.path.join(self.cdir, fname))
+            except FileNotFoundError:
+                pass
+        self._size = 0
+
+
+class GuidedScheduler(object):
+    """ Chunk size scheduler for parallel task execution based on guided self-scheduling. Every chunk takes a fraction of the remaining tasks that decreases towards the end, so the tail is spread over all workers, and its size is capped such that a chunk lasts about ``target_time`` given the measured task duration.
+
+    **Parameters**\n
+    nworkers: int
+        Number of workers.
+    target_time: numeric | 0.25
+        Target duration of a chunk (in seconds).
+    min_chunk, max_chunk: int, int | 1, None
+        Bounds of the chunk size.
+    smoothing: numeric | 0.3
+        Weight of the latest measurement in the moving average of the task duration.
+    """
+
+    def __init__(self, nworkers, target_time=0.25, min_chunk=1, max_chunk=None, smoothing=0.3):
+
+        self.nworkers = max(int(nworkers), 1)
+        self.target_time = target_time
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+        self.smoothing = smoothing
+        self.task_time = None # Moving average of the duration of a task
+
+    def update(self, ntasks, elapsed):
+        """ Update the estimated task duration with the duration of a completed chunk.
+        """
+
+        if ntasks > 0:
+            tt = elapsed / ntasks
+            if self.task_time is None:
+                self.task_time = tt
+            else:
+                self.task_time = (1 - self.smoothing)*self.task_time + self.smoothing*tt
+
+    def next_size(self, remaining):
+        """ Size of the next chunk given the number of remaining tasks.
+        """
+
+        if self.task_time is None: # Probe the task duration with the smallest chunks first
+            size = self.min_chunk
+        else:
+            size = int(np.ceil(remaining / (2*self.nworkers)))
+            if self.task_time > 0:
+                size = min(size, int(self.target_time / self.task_time))
+        if self.max_chunk is not None:
+            size = min(size, self.max_chunk)
+
+        return max(size, self.min_chunk)
+
+
+class Profiler(object):
+    """ Accumulation of the time spent in the phases of a fitting job and of the number of function evaluations per line spectrum. The phases recorded by the fitting routines are\n
+    ``'init'``: setting the (precompiled) initialization of the parameters;\n
+    ``'model'``: model evaluations within the minimizer (estimated from the number of function evaluations and the duration of one model evaluation);\n
+    ``'minimize'``: the remaining time of the minimizer iterations;\n
+    ``'jitter'``: refits with jittered initialization;\n
+    ``'ipc'``: serialization and transfer of the outcomes from worker processes;\n
+    ``'collect'``: collection of the outcomes into arrays, checkpoint files and dataframes.
+    """
+
+    def __init__(self):
+
+        self.totals = {}
+        self.counts = {}
+        self.nfev = {}
+        self.wall = 0.
+        self._tstart = None
+
+    def start(self):
+        """ Start the wall-clock timer of the job.
+        """
+
+        self._tstart = time.perf_counter()
+
+    def stop(self):
+        """ Stop the wall-clock timer of the job.
+        """
+
+        if self._tstart is not None:
+            self.wall += time.perf_counter() - self._tstart
+            self._tstart = None
+
+    def add(self, phase, elapsed, count=1):
+        """ Add the elapsed time (in seconds) to a phase.
+        """
+
+        self.totals[phase] = self.totals.get(phase, 0.) + elapsed
+        self.counts[phase] = self.counts.get(phase, 0) + count
+
+    @contextmanager
+    def phase(self, name):
+        """ Context manager timing the enclosed code as a phase.
+        """
+
+        tstart = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - tstart)
+
+    def merge(self, timing, spec_id=None, arrival=None):
+        """ Merge the timing of a fitting task (see ``pesfit.fitter.fit_spectrum()``). The time between the completion of the task (``timing['t_done']``) and the ``arrival`` of its outcome (from ``time.time()``) is counted as ``'ipc'``, which includes the serialization, the transfer and the wait for the other tasks returned together (e.g. in the same chunk).
+        """
+
+        for phase, elapsed in timing.items():
+            if phase == 'nfev':
+                if spec_id is not None:
+                    self.nfev[spec_id] = elapsed
+            elif phase != 't_done':
+                self.add(phase, elapsed)
+        if (arrival is not None) and ('t_done' in timing):
+            self.add('ipc', max(arrival - timing['t_done'], 0.))
+
+    def report(self):
+        """ Structured report of the recorded phases (total and mean time, number of calls and fraction of the wall-clock time) and of the function evaluations. The phases timed within parallel workers add up over the workers, so their fractions can exceed one.
+        """
+
+        wall = self.wall
+        if self._tstart is not None:
+            wall += time.perf_counter() - self._tstart
+
+        phases = {}
+        for phase, total in self.totals.items():
+            count = self.counts[phase]
+            phases[phase] = {'total': total, 'count': count, 'mean': total / count if count else np.nan,
+                            'fraction': total / wall if wall > 0 else np.nan}
+
+        nfev = np.array(list(self.nfev.values()), dtype='float')
+        nfev_stats = {'nspec': nfev.size, 'total': nfev.sum(),
+                    'mean': nfev.mean() if nfev.size else np.nan, 'max': nfev.max() if nfev.size else np.nan}
+
+        return {'wall': wall, 'phases': phases, 'nfev': nfev_stats}
+
+    def to_dataframe(self):
+        """ Recorded phases as a dataframe (one row per phase).
+        """
+
+        return pd.DataFrame.from_dict(self.report()['phases'], orient='index', columns=['total', 'count', 'mean', 'fraction'])
+
+    def nfev_series(self):
+        """ Number of function evaluations per line spectrum, indexed by the spectrum ID.
+        """
+
+        return pd.Series(self.nfev, name='nfev').sort_index()
+
+
 def partial_flatten(arr, axis):
     """ Partially flatten a multidimensional array.
     
@@ -215,10 +700,206 @@ def grid_indices(x, y, dtyp='float', ordering='rc', flatten=True):
 
     if flatten:
         grid = grid.reshape((nx*ny, 2))
-        
+
     return grid
 
 
+def hilbert_curve(nrow, ncol):
+    """ Row and column indices of a grid ordered along a Hilbert (space-filling) curve. Grids with sides other than a power of 2 use the curve of the enclosing square grid, skipping the points outside.
+
+    **Parameters**\n
+    nrow, ncol: int, int
+        Number of rows and columns of the grid.
+    """
+
+    side = 1 << max(int(np.ceil(np.log2(max(nrow, ncol, 1)))), 0)
+    d = np.arange(side*side)
+    r, c = np.zeros_like(d), np.zeros_like(d)
+
+    s = 1
+    while s < side:
+        rx = 1 & (d // 2)
+        ry = 1 & (d ^ rx)
+        # Rotate the quadrant
+        flip = (ry == 0) & (rx == 1)
+        r[flip], c[flip] = s - 1 - r[flip], s - 1 - c[flip]
+        swap = ry == 0
+        r[swap], c[swap] = c[swap], r[swap].copy()
+        c += s * rx
+        r += s * ry
+        d //= 4
+        s *= 2
+
+    inside = (r < nrow) & (c < ncol)
+
+    return r[inside], c[inside]
+
+
+def traversal_order(nrow, ncol, order='raster'):
+    """ Flattened (row-major) indices of the grid points in the order of traversal.
+
+    **Parameters**\n
+    nrow, ncol: int, int
+        Number of rows and columns of the grid.
+    order: str | 'raster'
+        Order of traversal, 'raster' (row by row), 'serpentine' (row by row in alternating directions) or 'hilbert' (Hilbert space-filling curve). Consecutive grid points are neighbours in the latter two.
+    """
+
+    inds = np.arange(nrow*ncol).reshape((nrow, ncol))
+
+    if order == 'raster':
+        return inds.ravel()
+    elif order == 'serpentine':
+        inds[1::2, :] = inds[1::2, ::-1]
+        return inds.ravel()
+    elif order == 'hilbert':
+        r, c = hilbert_curve(nrow, ncol)
+        return inds[r, c]
+    else:
+        raise ValueError("The order of traversal should be one of ['raster', 'serpentine', 'hilbert'].")
+
+
+def grid_tiles(nrow, ncol, tile_shape, order='raster'):
+    """ Split a grid into rectangular tiles, each traversed in the specified order from its corner.
+
+    **Parameters**\n
+    nrow, ncol: int, int
+        Number of rows and columns of the grid.
+    tile_shape: list/tuple
+        Number of rows and columns of a tile (the tiles at the grid border can be smaller).
+    order: str | 'raster'
+        Order of traversal within each tile (see ``pesfit.utils.traversal_order()``).
+
+    **Return**\n
+    tiles: list
+        Flattened (row-major) indices of the grid points of every tile.
+    """
+
+    trow, tcol = tile_shape
+    inds = np.arange(nrow*ncol).reshape((nrow, ncol))
+    tiles = []
+    for r0 in range(0, nrow, trow):
+        for c0 in range(0, ncol, tcol):
+            tile = inds[r0:r0+trow, c0:c0+tcol]
+            tiles.append(tile.ravel()[traversal_order(*tile.shape, order=order)])
+
+    return tiles
+
+
+def grid_neighbours(ind, nrow, ncol):
+    """ Flattened (row-major) indices of the nearest neighbours (up to 4) of a grid point.
+
+    **Parameters**\n
+    ind: int
+        Flattened index of the grid point.
+    nrow, ncol: int, int
+        Number of rows and columns of the grid.
+    """
+
+    r, c = divmod(ind, ncol)
+    nbs = []
+    if r > 0:
+        nbs.append(ind - ncol)
+    if r < nrow - 1:
+        nbs.append(ind + ncol)
+    if c > 0:
+        nbs.append(ind - 1)
+    if c < ncol - 1:
+        nbs.append(ind + 1)
+
+    return nbs
+
+
+def chunk_slices(shape, chunksize):
+    """ Split an array into contiguous blocks (in row-major order) of at most ``chunksize`` elements that can be selected by slicing, e.g. for reading from an HDF5 dataset.
+
+    **Parameters**\n
+    shape: list/tuple
+        Shape of the array.
+    chunksize: int
+        Maximum number of elements in a block.
+
+    **Return**\n
+    Generator of (selection, start, stop), where selection is a tuple of indices and slices, and start and stop are the flattened indices of the first and beyond the last element of the block. A 0-dimensional array (``shape=()``) forms a single block of one element.
+    """
+
+    shape = tuple(shape)
+    if chunksize < 1:
+        raise ValueError('The chunk size needs to be a positive integer.')
+    if shape == ():
+        yield (), 0, 1
+        return
+    # Split along the first axis whose trailing block fits into a chunk
+    ax = 0
+    while np.prod(shape[ax+1:], dtype='int') > chunksize:
+        ax += 1
+    inner = int(np.prod(shape[ax+1:], dtype='int'))
+    step = max(chunksize // inner, 1)
+
+    for outer in np.ndindex(*shape[:ax]):
+        base = (np.ravel_multi_index(outer, shape[:ax]) if ax > 0 else 0) * shape[ax] * inner
+        for i0 in range(0, shape[ax], step):
+            i1 = min(i0 + step, shape[ax])
+            yield outer + (slice(i0, i1),), base + i0*inner, base + i1*inner
+
+
+def grid_bin(data, bins):
+    """ Average the data over square blocks of the first two (grid) dimensions. The blocks at the far edges of the grid are truncated if its size is not a multiple of the block size, and NaNs are ignored in the averaging.
+
+    **Parameters**\n
+    data: numpy.ndarray
+        Data with the grid in the first two dimensions.
+    bins: int
+        Number of grid points per block along each dimension.
+
+    **Return**\n
+    Binned data with the shape (ceil(nrow/bins), ceil(ncol/bins), ...).
+    """
+
+    nrow, ncol = data.shape[:2]
+    nr, nc = -(-nrow // bins), -(-ncol // bins)
+    padded = np.full((nr*bins, nc*bins) + data.shape[2:], np.nan)
+    padded[:nrow, :ncol, ...] = data
+    blocks = padded.reshape((nr, bins, nc, bins) + data.shape[2:])
+
+    return np.nanmean(blocks, axis=(1, 3))
+
+
+def grid_unbin(data, bins, shape):
+    """ Bilinear interpolation of block-averaged data (see ``pesfit.utils.grid_bin()``) back onto the original grid. Values beyond the outermost block centers are extrapolated linearly from the outermost pair of blocks (and held constant along a dimension with a single block).
+
+    **Parameters**\n
+    data: numpy.ndarray
+        Binned data with the grid in the first two dimensions.
+    bins: int
+        Number of grid points per block along each dimension.
+    shape: list/tuple
+        Shape (nrow, ncol) of the original grid.
+
+    **Return**\n
+    Interpolated data with the shape (nrow, ncol, ...).
+    """
+
+    def centers(npts, nblock):
+        starts = np.arange(nblock) * bins
+        return (starts + np.minimum(starts + bins, npts) - 1) / 2
+
+    def interp_first(arr, xp, npts):
+        # Linear interpolation (and extrapolation) along the first dimension
+        if len(xp) == 1:
+            return np.repeat(arr, npts, axis=0)
+        x = np.arange(npts)
+        i = np.clip(np.searchsorted(xp, x) - 1, 0, len(xp) - 2)
+        w = ((x - xp[i]) / (xp[i+1] - xp[i])).reshape((-1,) + (1,)*(arr.ndim - 1))
+        return arr[i]*(1 - w) + arr[i+1]*w
+
+    nrow, ncol = shape
+    out = interp_first(data, centers(nrow, data.shape[0]), nrow)
+    out = interp_first(np.swapaxes(out, 0, 1), centers(ncol, data.shape[1]), ncol)
+
+    return np.swapaxes(out, 0, 1)
+
+
 def grid_resample(data, coords_axes, coords_new=None, grid_scale=None, zoom_scale=None, interpolator=RGI, ret='scaled', **kwds):
     """ Resample data to new resolution.
 
@@ -358,4 +1039,103 @@ def shape_gen(scale_vector):
     shape = (length, length)
     indices = index_gen(scale_vector)
 
-    return length, shape, indices
\ No newline at end of file
+    return length, shape, indices
+
+
+_SharedMemory = None
+
+def _shared_memory(**kwds):
+    """ Shared memory block (see ``multiprocessing.shared_memory.SharedMemory``, available since Python 3.8), which stays mapped as long as views of its buffer exist.
+    """
+
+    global _SharedMemory
+    if _SharedMemory is None:
+        from multiprocessing import shared_memory
+
+        class _SharedMemory(shared_memory.SharedMemory):
+
+            def __del__(self):
+                try:
+                    self.close()
+                except (OSError, BufferError): # The memory is unmapped when the views are deleted
+                    pass
+
+    return _SharedMemory(**kwds)
+
+
+class SharedArray(object):
+    """ Numpy array placed in shared memory or in a memory-mapped file for zero-copy access from multiple processes. Pickling an instance only transfers the reference to the storage (name or file path, shape and data type), and the unpickled instance attaches to the existing storage.
+
+    **Parameters**\n
+    arr: numpy array
+        Array to copy into the shared storage.
+    storage: str | 'shm'
+        Type of storage, 'shm' for ``multiprocessing.shared_memory`` and 'memmap' for a ``numpy.memmap`` file on disk.
+    fpath: str | None
+        File path for the memory-mapped storage (a temporary file is created if None).
+    """
+
+    def __init__(self, arr, storage='shm', fpath=None):
+
+        arr = np.ascontiguousarray(arr)
+        self.shape = arr.shape
+        self.dtype = arr.dtype.str
+        self.storage = storage
+        self.owner = True
+
+        if storage == 'shm':
+            self._shm = _shared_memory(create=True, size=max(arr.nbytes, 1))
+            self.name = self._shm.name
+            self.array = self._shm_array()
+        elif storage == 'memmap':
+            if fpath is None:
+                fd, fpath = tempfile.mkstemp(prefix='pesfit_', suffix='.dat')
+                os.close(fd)
+            self.name = fpath
+            self.array = np.memmap(self.name, dtype=self.dtype, mode='w+', shape=self.shape)
+        else:
+            raise NotImplementedError
+
+        self.array[...] = arr
+
+    def __getstate__(self):
+
+        return {'name':self.name, 'shape':self.shape, 'dtype':self.dtype, 'storage':self.storage}
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+        self.owner = False
+        if self.storage == 'shm':
+            self._shm = _shared_memory(name=self.name)
+            self.array = self._shm_array()
+        elif self.storage == 'memmap':
+            self.array = np.memmap(self.name, dtype=self.dtype, mode='r', shape=self.shape)
+
+    def _shm_array(self):
+        """ Array on the shared memory. The ctypes buffer at its base holds on to the memory, so that it is not unmapped while the array or its views are in use.
+        """
+
+        cbuf = (ctypes.c_char * self._shm.size).from_buffer(self._shm.buf)
+
+        return np.frombuffer(cbuf, dtype=self.dtype, count=int(np.prod(self.shape))).reshape(self.shape)
+
+    def __getitem__(self, key):
+
+        return self.array[key]
+
+    def close(self):
+        """ Release the storage, which is also removed if the instance created it. Views of ``self.array`` that are still in use keep the shared memory mapped until they are deleted, but it is removed regardless.
+        """
+
+        self.array = None
+        if self.storage == 'shm':
+            try:
+                self._shm.close()
+            except BufferError: # Views of the array are still in use, the memory is unmapped when they are deleted
+                pass
+            if self.owner:
+                self._shm.unlink()
+        elif (self.storage == 'memmap') and self.owner:
+            os.remove(self.name)
+